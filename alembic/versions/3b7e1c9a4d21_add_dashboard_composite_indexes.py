@@ -0,0 +1,52 @@
+"""add_dashboard_composite_indexes
+
+Revision ID: 3b7e1c9a4d21
+Revises: 849d2968c4fe
+Create Date: 2025-11-28 09:12:44.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision = '3b7e1c9a4d21'
+down_revision = '849d2968c4fe'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # CONCURRENTLY no puede correr dentro de una transacción
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_ventas_tienda_status_fecha',
+            'ventas',
+            ['tienda_id', 'status_pago', 'fecha'],
+            unique=False,
+            postgresql_include=['total'],
+            postgresql_concurrently=True
+        )
+        op.create_index(
+            'ix_productos_tienda_stock_activos',
+            'productos',
+            ['tienda_id', 'stock_actual'],
+            unique=False,
+            postgresql_where=sa.text('is_active'),
+            postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_productos_tienda_stock_activos',
+            table_name='productos',
+            postgresql_concurrently=True
+        )
+        op.drop_index(
+            'ix_ventas_tienda_status_fecha',
+            table_name='ventas',
+            postgresql_concurrently=True
+        )
@@ -0,0 +1,38 @@
+"""add_insights_listing_index
+
+Revision ID: a41f6d2c8e57
+Revises: 3b7e1c9a4d21
+Create Date: 2025-11-28 15:40:02.771093
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision = 'a41f6d2c8e57'
+down_revision = '3b7e1c9a4d21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # CONCURRENTLY no puede correr dentro de una transacción
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_insights_tienda_activo_urgencia_fecha',
+            'insights',
+            ['tienda_id', 'is_active', 'nivel_urgencia', sa.text('created_at DESC')],
+            unique=False,
+            postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_insights_tienda_activo_urgencia_fecha',
+            table_name='insights',
+            postgresql_concurrently=True
+        )
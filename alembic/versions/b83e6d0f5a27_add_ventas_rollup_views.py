@@ -0,0 +1,67 @@
+"""add_ventas_rollup_views
+
+Revision ID: b83e6d0f5a27
+Revises: f4c19b7e2a60
+Create Date: 2025-12-08 09:17:44.530128
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision = 'b83e6d0f5a27'
+down_revision = 'f4c19b7e2a60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Agregados diarios para /reportes (se refrescan con REFRESH ... CONCURRENTLY)
+    op.execute(
+        """
+        CREATE MATERIALIZED VIEW mv_ventas_diarias AS
+        SELECT v.tienda_id,
+               date(v.fecha AT TIME ZONE 'UTC') AS dia,
+               v.metodo_pago,
+               count(*)::integer AS cantidad_ventas,
+               sum(v.total)::double precision AS monto_total
+        FROM ventas v
+        WHERE v.status_pago = 'pagado'
+        GROUP BY v.tienda_id, date(v.fecha AT TIME ZONE 'UTC'), v.metodo_pago
+        """
+    )
+    op.execute(
+        """
+        CREATE MATERIALIZED VIEW mv_productos_vendidos_diarios AS
+        SELECT v.tienda_id,
+               date(v.fecha AT TIME ZONE 'UTC') AS dia,
+               d.producto_id,
+               sum(d.cantidad)::double precision AS cantidad_vendida,
+               sum(d.subtotal)::double precision AS subtotal_vendido,
+               count(*)::integer AS veces_vendido
+        FROM detalles_venta d
+        JOIN ventas v ON v.id = d.venta_id
+        WHERE v.status_pago = 'pagado'
+        GROUP BY v.tienda_id, date(v.fecha AT TIME ZONE 'UTC'), d.producto_id
+        """
+    )
+    # El índice único es requisito de REFRESH MATERIALIZED VIEW CONCURRENTLY
+    op.create_index(
+        'uq_mv_ventas_diarias',
+        'mv_ventas_diarias',
+        ['tienda_id', 'dia', 'metodo_pago'],
+        unique=True
+    )
+    op.create_index(
+        'uq_mv_productos_vendidos_diarios',
+        'mv_productos_vendidos_diarios',
+        ['tienda_id', 'dia', 'producto_id'],
+        unique=True
+    )
+
+
+def downgrade() -> None:
+    op.execute('DROP MATERIALIZED VIEW IF EXISTS mv_productos_vendidos_diarios')
+    op.execute('DROP MATERIALIZED VIEW IF EXISTS mv_ventas_diarias')
@@ -0,0 +1,69 @@
+"""add_inventory_partial_indexes
+
+Revision ID: c5d82e1f0b93
+Revises: a41f6d2c8e57
+Create Date: 2025-12-02 10:41:07.582913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5d82e1f0b93'
+down_revision = 'a41f6d2c8e57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # CONCURRENTLY no puede correr dentro de una transacción
+    with op.get_context().autocommit_block():
+        # Reemplaza ix_productos_tienda_stock_activos: mismas claves, pero con los
+        # precios incluidos para resolver /inventario/estadisticas con index-only scan
+        op.create_index(
+            'ix_productos_tienda_stock_valores_activos',
+            'productos',
+            ['tienda_id', 'stock_actual'],
+            unique=False,
+            postgresql_include=['precio_costo', 'precio_venta'],
+            postgresql_where=sa.text('is_active'),
+            postgresql_concurrently=True
+        )
+        op.drop_index(
+            'ix_productos_tienda_stock_activos',
+            table_name='productos',
+            postgresql_concurrently=True
+        )
+        # /inventario/sin-stock: solo las filas agotadas, ya ordenadas por nombre
+        op.create_index(
+            'ix_productos_tienda_sin_stock_activos',
+            'productos',
+            ['tienda_id', 'nombre'],
+            unique=False,
+            postgresql_where=sa.text('is_active AND stock_actual = 0'),
+            postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_productos_tienda_sin_stock_activos',
+            table_name='productos',
+            postgresql_concurrently=True
+        )
+        op.create_index(
+            'ix_productos_tienda_stock_activos',
+            'productos',
+            ['tienda_id', 'stock_actual'],
+            unique=False,
+            postgresql_where=sa.text('is_active'),
+            postgresql_concurrently=True
+        )
+        op.drop_index(
+            'ix_productos_tienda_stock_valores_activos',
+            table_name='productos',
+            postgresql_concurrently=True
+        )
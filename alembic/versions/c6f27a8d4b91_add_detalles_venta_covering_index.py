@@ -0,0 +1,53 @@
+"""add_detalles_venta_covering_index
+
+Revision ID: c6f27a8d4b91
+Revises: b83e6d0f5a27
+Create Date: 2025-12-09 10:05:12.648310
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6f27a8d4b91'
+down_revision = 'b83e6d0f5a27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # CONCURRENTLY no puede correr dentro de una transacción
+    with op.get_context().autocommit_block():
+        # Reemplaza ix_detalles_venta_venta_id: misma clave, con las columnas que
+        # leen los agregados de ventas para resolver el join con index-only scan
+        op.create_index(
+            'ix_detalles_venta_venta_cubriente',
+            'detalles_venta',
+            ['venta_id'],
+            unique=False,
+            postgresql_include=['producto_id', 'cantidad', 'subtotal'],
+            postgresql_concurrently=True
+        )
+        op.drop_index(
+            'ix_detalles_venta_venta_id',
+            table_name='detalles_venta',
+            postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_detalles_venta_venta_id',
+            'detalles_venta',
+            ['venta_id'],
+            unique=False,
+            postgresql_concurrently=True
+        )
+        op.drop_index(
+            'ix_detalles_venta_venta_cubriente',
+            table_name='detalles_venta',
+            postgresql_concurrently=True
+        )
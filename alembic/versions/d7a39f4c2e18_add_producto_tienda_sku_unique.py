@@ -0,0 +1,39 @@
+"""add_producto_tienda_sku_unique
+
+Revision ID: d7a39f4c2e18
+Revises: c5d82e1f0b93
+Create Date: 2025-12-04 16:22:51.904736
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7a39f4c2e18'
+down_revision = 'c5d82e1f0b93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Requiere que no existan SKUs duplicados dentro de una misma tienda.
+    # El índice se construye CONCURRENTLY y luego se promueve a constraint,
+    # así la tabla no queda bloqueada mientras se indexa
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'uq_producto_tienda_sku',
+            'productos',
+            ['tienda_id', 'sku'],
+            unique=True,
+            postgresql_concurrently=True
+        )
+    op.execute(
+        'ALTER TABLE productos ADD CONSTRAINT uq_producto_tienda_sku '
+        'UNIQUE USING INDEX uq_producto_tienda_sku'
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint('uq_producto_tienda_sku', 'productos', type_='unique')
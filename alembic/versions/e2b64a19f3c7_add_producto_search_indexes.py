@@ -0,0 +1,61 @@
+"""add_producto_search_indexes
+
+Revision ID: e2b64a19f3c7
+Revises: d7a39f4c2e18
+Create Date: 2025-12-05 11:08:37.215490
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b64a19f3c7'
+down_revision = 'd7a39f4c2e18'
+branch_labels = None
+depends_on = None
+
+
+TRGM_COLUMNS = ('nombre', 'sku', 'descripcion')
+
+
+def upgrade() -> None:
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # CONCURRENTLY no puede correr dentro de una transacción
+    with op.get_context().autocommit_block():
+        # /productos/buscar: ILIKE '%q%' usa estos índices GIN en lugar de seq scan
+        for column in TRGM_COLUMNS:
+            op.create_index(
+                f'ix_productos_{column}_trgm',
+                'productos',
+                [column],
+                unique=False,
+                postgresql_using='gin',
+                postgresql_ops={column: 'gin_trgm_ops'},
+                postgresql_concurrently=True
+            )
+        # Rangos de precio/stock de la búsqueda avanzada (solo productos activos)
+        op.create_index(
+            'ix_productos_tienda_precio_stock_activos',
+            'productos',
+            ['tienda_id', 'precio_venta', 'stock_actual'],
+            unique=False,
+            postgresql_where=sa.text('is_active'),
+            postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_productos_tienda_precio_stock_activos',
+            table_name='productos',
+            postgresql_concurrently=True
+        )
+        for column in TRGM_COLUMNS:
+            op.drop_index(
+                f'ix_productos_{column}_trgm',
+                table_name='productos',
+                postgresql_concurrently=True
+            )
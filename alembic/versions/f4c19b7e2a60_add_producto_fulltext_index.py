@@ -0,0 +1,62 @@
+"""add_producto_fulltext_index
+
+Revision ID: f4c19b7e2a60
+Revises: e2b64a19f3c7
+Create Date: 2025-12-05 15:42:19.804377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4c19b7e2a60'
+down_revision = 'e2b64a19f3c7'
+branch_labels = None
+depends_on = None
+
+
+# Debe coincidir con app.models.PRODUCTO_SEARCH_VECTOR_SQL
+SEARCH_VECTOR_SQL = (
+    "to_tsvector('spanish'::regconfig, "
+    "coalesce(nombre, '') || ' ' || coalesce(sku, '') || ' ' || coalesce(descripcion, ''))"
+)
+
+
+def upgrade() -> None:
+    # CONCURRENTLY no puede correr dentro de una transacción
+    with op.get_context().autocommit_block():
+        # /productos/buscar pasa de tres ILIKE a un único match de texto completo
+        op.create_index(
+            'ix_productos_busqueda_fts',
+            'productos',
+            [sa.text(SEARCH_VECTOR_SQL)],
+            unique=False,
+            postgresql_using='gin',
+            postgresql_concurrently=True
+        )
+        # descripcion solo se buscaba con ILIKE desde /productos/buscar
+        op.drop_index(
+            'ix_productos_descripcion_trgm',
+            table_name='productos',
+            postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_productos_descripcion_trgm',
+            'productos',
+            ['descripcion'],
+            unique=False,
+            postgresql_using='gin',
+            postgresql_ops={'descripcion': 'gin_trgm_ops'},
+            postgresql_concurrently=True
+        )
+        op.drop_index(
+            'ix_productos_busqueda_fts',
+            table_name='productos',
+            postgresql_concurrently=True
+        )
@@ -2,27 +2,181 @@
 Dependencias de FastAPI - Nexus POS
 Inyección de dependencias para autenticación y Multi-Tenancy
 """
-from typing import Annotated
+import hashlib
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Annotated, Optional
 from uuid import UUID
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
+from jose import JWTError, jwk, jwt
+from sqlalchemy import Select, event
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import ORMExecuteState, Session, joinedload, with_loader_criteria
 from sqlmodel import select
+from app.core.cache import CacheManager
 from app.core.config import settings
 from app.core.db import get_session
-from app.models import User, Tienda
+from app.models import User, Tienda, Producto, Venta, Insight
 from app.schemas import TokenData
 
 
 # OAuth2 scheme para extraer el token del header Authorization
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_V1_STR}/auth/login")
 
+# Verificación JWT preparada una sola vez al importar el módulo:
+# la clave HMAC ya construida evita re-parsear SECRET_KEY en cada request
+_JWT_VERIFY_KEY = jwk.construct(settings.SECRET_KEY, settings.ALGORITHM)
+_JWT_ALGORITHMS = (settings.ALGORITHM,)
+_JWT_OPTIONS = {"require_exp": True, "require_sub": True, "verify_aud": False}
+
+# Caché de usuarios autenticados por hash de token
+# Guarda un UserSnapshot inmutable (no el objeto ORM ni el hash del password)
+# para no arrastrar sesiones entre requests. El TTL corto acota cuánto tarda
+# en verse un usuario desactivado.
+USER_CACHE_TTL_SECONDS = 30
+_usuarios_cache = CacheManager()
+
+
+# Caché de payloads JWT ya verificados: el token es inmutable hasta su `exp`,
+# así que la verificación de firma se hace una sola vez por token y worker
+_tokens_cache = CacheManager()
+
+
+# Caché de tiendas por id: snapshots inmutables compartidos entre requests
+TIENDA_CACHE_TTL_SECONDS = 30
+_tiendas_cache = CacheManager()
+
+
+@dataclass(frozen=True, slots=True)
+class TiendaSnapshot:
+    """Vista inmutable de una Tienda, segura de compartir entre requests"""
+    id: UUID
+    nombre: str
+    rubro: str
+    is_active: bool
+    created_at: datetime
+
+
+@dataclass(frozen=True, slots=True)
+class UserSnapshot:
+    """
+    Vista inmutable del usuario autenticado, segura de compartir entre requests
+    
+    No incluye hashed_password. Al no ser un objeto ORM, agregarlo a una sesión
+    o asignarlo a una relación falla en lugar de insertar un duplicado.
+    """
+    id: UUID
+    email: str
+    full_name: str
+    rol: str
+    is_active: bool
+    created_at: datetime
+    tienda_id: UUID
+    tienda: Optional[TiendaSnapshot]
+
+
+def _snapshot_tienda(tienda: Tienda) -> TiendaSnapshot:
+    """Snapshot inmutable de una Tienda cargada desde la BD"""
+    return TiendaSnapshot(
+        id=tienda.id,
+        nombre=tienda.nombre,
+        rubro=tienda.rubro,
+        is_active=tienda.is_active,
+        created_at=tienda.created_at
+    )
+
+
+def _snapshot_usuario(user: User) -> UserSnapshot:
+    """Snapshot inmutable del usuario y su tienda, listo para guardar en caché"""
+    return UserSnapshot(
+        id=user.id,
+        email=user.email,
+        full_name=user.full_name,
+        rol=user.rol,
+        is_active=user.is_active,
+        created_at=user.created_at,
+        tienda_id=user.tienda_id,
+        tienda=_snapshot_tienda(user.tienda) if user.tienda else None
+    )
+
+
+@event.listens_for(Tienda, "after_update")
+def _invalidar_tienda_cache(mapper, connection, target: Tienda) -> None:
+    """Descarta el snapshot cacheado cuando la tienda se modifica"""
+    _tiendas_cache.delete(str(target.id))
+
+
+# Modelos con tienda_id que se filtran automáticamente por la tienda del request
+TENANT_MODELS = (Producto, Venta, Insight)
+
+# Clave de Session.info donde get_current_active_tienda deja la tienda actual
+SESSION_TIENDA_KEY = "tienda_id"
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _filtrar_por_tienda(execute_state: ORMExecuteState) -> None:
+    """
+    Agrega `tienda_id = <tienda actual>` a todo SELECT ORM sobre TENANT_MODELS
+    
+    Es un respaldo: las rutas siguen filtrando por tienda_id explícitamente.
+    Solo aplica a sesiones de requests autenticados (las de tareas de fondo no
+    tienen tienda en `info`) y no cubre lambda_stmt, update() ni delete().
+    """
+    tienda_id = execute_state.session.info.get(SESSION_TIENDA_KEY)
+    if (
+        tienda_id is None
+        or not execute_state.is_select
+        or execute_state.is_column_load
+        or execute_state.is_relationship_load
+        or not isinstance(execute_state.statement, Select)
+    ):
+        return
+    
+    execute_state.statement = execute_state.statement.options(*(
+        with_loader_criteria(
+            model,
+            lambda cls: cls.tienda_id == tienda_id,
+            include_aliases=True
+        )
+        for model in TENANT_MODELS
+    ))
+
+
+def _token_cache_key(token: str) -> str:
+    """Clave de caché derivada del token (nunca se guarda el token en claro)"""
+    return hashlib.blake2b(token.encode(), digest_size=16).hexdigest()
+
+
+def _decodificar_token(token: str, cache_key: str) -> dict:
+    """
+    Decodifica y verifica el JWT, reutilizando el payload si ya fue verificado
+    
+    La entrada del caché vence junto con el claim `exp` del token
+    
+    Raises:
+        JWTError: Token inválido o expirado
+    """
+    payload = _tokens_cache.get(cache_key)
+    if payload is not None:
+        return payload
+    
+    payload = jwt.decode(token, _JWT_VERIFY_KEY, algorithms=_JWT_ALGORITHMS, options=_JWT_OPTIONS)
+    
+    exp = payload.get("exp")
+    if exp is not None:
+        ttl_seconds = int(exp - time.time())
+        if ttl_seconds > 0:
+            _tokens_cache.set(cache_key, payload, ttl_seconds)
+    
+    return payload
+
 
 async def get_current_user(
     token: Annotated[str, Depends(oauth2_scheme)],
     session: Annotated[AsyncSession, Depends(get_session)]
-) -> User:
+) -> UserSnapshot:
     """
     Dependencia que valida el JWT y retorna el usuario actual
     
@@ -31,6 +185,9 @@ async def get_current_user(
     2. Usuario existe en BD
     3. Usuario está activo
     
+    Retorna siempre un UserSnapshot (con o sin caché), cacheado por token
+    durante USER_CACHE_TTL_SECONDS para evitar un SELECT por request autenticado
+    
     Raises:
         HTTPException 401: Credenciales inválidas
         HTTPException 403: Usuario inactivo
@@ -41,9 +198,14 @@ async def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
     
+    cache_key = _token_cache_key(token)
+    snapshot = _usuarios_cache.get(cache_key)
+    if snapshot is not None:
+        return snapshot
+    
     try:
-        # Decodificar JWT
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        # Decodificar JWT (la firma se verifica una vez por token)
+        payload = _decodificar_token(token, cache_key)
         user_id: str = payload.get("sub")
         
         if user_id is None:
@@ -54,8 +216,12 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
     
-    # Buscar usuario en BD con relación a Tienda
-    statement = select(User).where(User.id == UUID(token_data.user_id))
+    # Buscar usuario en BD con su Tienda en el mismo JOIN
+    statement = (
+        select(User)
+        .options(joinedload(User.tienda))
+        .where(User.id == UUID(token_data.user_id))
+    )
     result = await session.execute(statement)
     user = result.scalar_one_or_none()
     
@@ -68,13 +234,16 @@ async def get_current_user(
             detail="Usuario inactivo"
         )
     
-    return user
+    snapshot = _snapshot_usuario(user)
+    _usuarios_cache.set(cache_key, snapshot, USER_CACHE_TTL_SECONDS)
+    
+    return snapshot
 
 
 async def get_current_active_tienda(
-    current_user: Annotated[User, Depends(get_current_user)],
+    current_user: Annotated[UserSnapshot, Depends(get_current_user)],
     session: Annotated[AsyncSession, Depends(get_session)]
-) -> Tienda:
+) -> TiendaSnapshot:
     """
     Dependencia crítica Multi-Tenant
     
@@ -83,7 +252,11 @@ async def get_current_active_tienda(
     2. La tienda existe en BD
     3. La tienda está activa
     
-    Este es el punto de control principal para aislar datos por tenant
+    Este es el punto de control principal para aislar datos por tenant.
+    La tienda ya viene cargada por get_current_user, no consulta la BD, y se
+    retorna como TiendaSnapshot cacheado por TIENDA_CACHE_TTL_SECONDS.
+    Además registra la tienda en la sesión del request: desde ahí cada SELECT
+    sobre TENANT_MODELS queda filtrado por tienda (ver _filtrar_por_tienda).
     
     Raises:
         HTTPException 403: Usuario sin tienda asignada
@@ -96,16 +269,18 @@ async def get_current_active_tienda(
             detail="Usuario no tiene una tienda asignada"
         )
     
-    # Buscar la tienda
-    statement = select(Tienda).where(Tienda.id == current_user.tienda_id)
-    result = await session.execute(statement)
-    tienda = result.scalar_one_or_none()
+    cache_key = str(current_user.tienda_id)
+    tienda = _tiendas_cache.get(cache_key)
     
     if tienda is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Tienda no encontrada"
-        )
+        if current_user.tienda is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Tienda no encontrada"
+            )
+        
+        tienda = current_user.tienda
+        _tiendas_cache.set(cache_key, tienda, TIENDA_CACHE_TTL_SECONDS)
     
     if not tienda.is_active:
         raise HTTPException(
@@ -113,9 +288,11 @@ async def get_current_active_tienda(
             detail="La tienda está inactiva. Contacte al administrador"
         )
     
+    session.info[SESSION_TIENDA_KEY] = tienda.id
+    
     return tienda
 
 
 # Aliases para uso simplificado con Annotated
-CurrentUser = Annotated[User, Depends(get_current_user)]
-CurrentTienda = Annotated[Tienda, Depends(get_current_active_tienda)]
+CurrentUser = Annotated[UserSnapshot, Depends(get_current_user)]
+CurrentTienda = Annotated[TiendaSnapshot, Depends(get_current_active_tienda)]
@@ -2,13 +2,14 @@
 Rutas de Autenticación - Nexus POS
 Endpoints para login y gestión de tokens
 """
+import secrets
 from typing import Annotated
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import select
 from app.core.db import get_session
-from app.core.security import verify_password, create_access_token
+from app.core.security import get_password_hash, verify_password_async, create_access_token
 from app.models import User
 from app.schemas import Token, LoginRequest
 from app.api.deps import CurrentUser, CurrentTienda
@@ -16,6 +17,10 @@ from app.api.deps import CurrentUser, CurrentTienda
 
 router = APIRouter(prefix="/auth", tags=["Autenticación"])
 
+# Hash de relleno para emails inexistentes: el login siempre paga una
+# verificación bcrypt, así el tiempo de respuesta no revela qué cuentas existen
+_DUMMY_PASSWORD_HASH = get_password_hash(secrets.token_urlsafe(32))
+
 
 @router.post("/login", response_model=Token)
 async def login(
@@ -38,8 +43,12 @@ async def login(
     result = await session.execute(statement)
     user = result.scalar_one_or_none()
     
-    # Validar existencia y password
-    if not user or not verify_password(login_data.password, user.hashed_password):
+    # Validar existencia y password (una verificación bcrypt en ambos casos)
+    password_valido = await verify_password_async(
+        login_data.password,
+        user.hashed_password if user else _DUMMY_PASSWORD_HASH
+    )
+    if not user or not password_valido:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Email o contraseña incorrectos",
@@ -73,7 +82,11 @@ async def login_form(
     result = await session.execute(statement)
     user = result.scalar_one_or_none()
     
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    password_valido = await verify_password_async(
+        form_data.password,
+        user.hashed_password if user else _DUMMY_PASSWORD_HASH
+    )
+    if not user or not password_valido:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Email o contraseña incorrectos",
@@ -104,14 +117,14 @@ async def get_current_user_info(
     """
     return {
         "user": {
-            "id": str(current_user.id),
+            "id": current_user.id,
             "email": current_user.email,
             "full_name": current_user.full_name,
             "rol": current_user.rol,
             "is_active": current_user.is_active
         },
         "tienda": {
-            "id": str(current_tienda.id),
+            "id": current_tienda.id,
             "nombre": current_tienda.nombre,
             "rubro": current_tienda.rubro,
             "is_active": current_tienda.is_active
@@ -2,14 +2,16 @@
 Dashboard Endpoints - Nexus POS
 Endpoints consolidados para vista de dashboard con métricas clave
 """
-from datetime import datetime, timedelta
+import asyncio
+from datetime import datetime, time, timedelta, timezone
 from typing import Annotated
+from uuid import UUID
 from fastapi import APIRouter, Depends
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, and_, desc
+from sqlalchemy import select, func, and_, case, cast, desc, Numeric
 from pydantic import BaseModel
 
-from app.core.db import get_session
+from app.core.db import get_session, AsyncSessionLocal
 import logging
 from app.core.cache import cached
 from app.models import Producto, Venta, DetalleVenta
@@ -41,7 +43,7 @@ class MetricaInventario(BaseModel):
 
 class ProductoDestacado(BaseModel):
     """Producto destacado del dashboard"""
-    id: str
+    id: UUID
     nombre: str
     sku: str
     stock: float
@@ -57,13 +59,26 @@ class DashboardResumen(BaseModel):
     ultima_actualizacion: datetime
 
 
+# === HELPERS ===
+
+async def _ejecutar_consulta(stmt, mappings: bool = False) -> list:
+    """
+    Ejecuta una consulta en una sesión propia del pool
+    Permite lanzar varias consultas del dashboard en paralelo
+    
+    Con mappings=True retorna las filas como mapeos livianos por nombre de columna
+    """
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(stmt)
+        return result.mappings().all() if mappings else result.all()
+
+
 # === ENDPOINTS ===
 
 @router.get("/resumen", response_model=DashboardResumen)
 @cached(ttl_seconds=60, key_prefix="dashboard")  # Cache de 1 minuto
 async def obtener_dashboard_resumen(
-    current_tienda: CurrentTienda,
-    session: Annotated[AsyncSession, Depends(get_session)]
+    current_tienda: CurrentTienda
 ) -> DashboardResumen:
     """
     Endpoint principal del dashboard con todas las métricas consolidadas
@@ -78,82 +93,62 @@ async def obtener_dashboard_resumen(
     """
     logger.info(f"Generando dashboard para tienda {current_tienda.id}")
     
-    # Rangos de fechas
-    ahora = datetime.utcnow()
-    hoy_inicio = ahora.replace(hour=0, minute=0, second=0, microsecond=0)
+    # Rangos de fechas (un solo "ahora" por request)
+    ahora = datetime.now(timezone.utc)
+    hoy_inicio = datetime.combine(ahora.date(), time.min, tzinfo=timezone.utc)
     ayer_inicio = hoy_inicio - timedelta(days=1)
     semana_inicio = hoy_inicio - timedelta(days=7)
     mes_inicio = hoy_inicio - timedelta(days=30)
     
     # === VENTAS ===
-    # Ventas de hoy
-    stmt_hoy = select(func.coalesce(func.sum(Venta.total), 0)).where(
-        and_(
-            Venta.tienda_id == current_tienda.id,
-            Venta.fecha >= hoy_inicio,
-            Venta.status_pago == 'pagado'
-        )
-    )
-    ventas_hoy = (await session.execute(stmt_hoy)).scalar()
-    
-    # Ventas de ayer
-    stmt_ayer = select(func.coalesce(func.sum(Venta.total), 0)).where(
-        and_(
-            Venta.tienda_id == current_tienda.id,
-            Venta.fecha >= ayer_inicio,
-            Venta.fecha < hoy_inicio,
-            Venta.status_pago == 'pagado'
-        )
-    )
-    ventas_ayer = (await session.execute(stmt_ayer)).scalar()
-    
-    # Ventas de la semana
-    stmt_semana = select(func.coalesce(func.sum(Venta.total), 0)).where(
-        and_(
-            Venta.tienda_id == current_tienda.id,
-            Venta.fecha >= semana_inicio,
-            Venta.status_pago == 'pagado'
-        )
-    )
-    ventas_semana = (await session.execute(stmt_semana)).scalar()
-    
-    # Ventas del mes
-    stmt_mes = select(func.coalesce(func.sum(Venta.total), 0)).where(
+    # Una sola pasada sobre ventas del último mes con agregados condicionales
+    sumas_ventas = select(
+        func.coalesce(func.sum(case((Venta.fecha >= hoy_inicio, Venta.total), else_=0)), 0).label('hoy'),
+        func.coalesce(func.sum(case(
+            (and_(Venta.fecha >= ayer_inicio, Venta.fecha < hoy_inicio), Venta.total), else_=0
+        )), 0).label('ayer'),
+        func.coalesce(func.sum(case((Venta.fecha >= semana_inicio, Venta.total), else_=0)), 0).label('semana'),
+        func.coalesce(func.sum(Venta.total), 0).label('mes')
+    ).where(
         and_(
             Venta.tienda_id == current_tienda.id,
             Venta.fecha >= mes_inicio,
             Venta.status_pago == 'pagado'
         )
-    )
-    ventas_mes = (await session.execute(stmt_mes)).scalar()
-    
-    # Calcular cambios porcentuales
-    cambio_diario = ((ventas_hoy - ventas_ayer) / ventas_ayer * 100) if ventas_ayer > 0 else 0
-    semana_pasada = ventas_semana - ventas_hoy  # Aproximación
-    cambio_semanal = ((ventas_hoy - (semana_pasada / 7)) / (semana_pasada / 7) * 100) if semana_pasada > 0 else 0
-    
-    # === INVENTARIO ===
-    # Contar productos totales
-    stmt_total = select(func.count(Producto.id)).where(Producto.tienda_id == current_tienda.id)
-    total_productos = (await session.execute(stmt_total)).scalar()
+    ).subquery()
     
-    # Contar productos activos
-    stmt_activos = select(func.count(Producto.id)).where(
-        and_(Producto.tienda_id == current_tienda.id, Producto.is_active == True)
+    # Cambios porcentuales calculados por Postgres sobre las sumas
+    hoy, ayer = sumas_ventas.c.hoy, sumas_ventas.c.ayer
+    promedio_semana_pasada = (sumas_ventas.c.semana - hoy) / 7  # Aproximación
+    stmt_ventas = select(
+        hoy,
+        ayer,
+        sumas_ventas.c.semana,
+        sumas_ventas.c.mes,
+        case(
+            (ayer > 0, func.round(cast((hoy - ayer) / ayer * 100, Numeric), 2)),
+            else_=0
+        ).label('cambio_diario'),
+        case(
+            (promedio_semana_pasada > 0, func.round(
+                cast((hoy - promedio_semana_pasada) / promedio_semana_pasada * 100, Numeric), 2
+            )),
+            else_=0
+        ).label('cambio_semanal')
     )
-    productos_activos = (await session.execute(stmt_activos)).scalar()
     
-    # Contar productos bajo stock
-    stmt_bajo_stock = select(func.count(Producto.id)).where(
-        and_(Producto.tienda_id == current_tienda.id, Producto.stock_actual <= 10)
-    )
-    productos_bajo_stock = (await session.execute(stmt_bajo_stock)).scalar()
-    
-    # Valor total del inventario
-    stmt_valor = select(func.coalesce(func.sum(Producto.stock_actual * Producto.precio_venta), 0)).where(
-        Producto.tienda_id == current_tienda.id
-    )
-    valor_inventario = (await session.execute(stmt_valor)).scalar()
+    # === INVENTARIO + ALERTAS ===
+    # Conteos filtrados sobre productos en una sola consulta
+    stmt_inventario = select(
+        func.count(Producto.id).label('total'),
+        func.count(Producto.id).filter(Producto.is_active == True).label('activos'),
+        func.count(Producto.id).filter(Producto.stock_actual <= 10).label('bajo_stock'),
+        func.coalesce(func.sum(Producto.stock_actual * Producto.precio_venta), 0).label('valor'),
+        # Productos sin stock + bajo stock crítico (< 5)
+        func.count(Producto.id).filter(
+            and_(Producto.stock_actual < 5, Producto.is_active == True)
+        ).label('alertas')
+    ).where(Producto.tienda_id == current_tienda.id)
     
     # === PRODUCTOS DESTACADOS (más vendidos hoy) ===
     stmt_destacados = select(
@@ -176,39 +171,44 @@ async def obtener_dashboard_resumen(
         Producto.id, Producto.nombre, Producto.sku, Producto.stock_actual
     ).order_by(desc('ventas_count')).limit(5)
     
-    destacados_result = await session.execute(stmt_destacados)
+    # Las tres consultas son independientes: cada una usa su propia sesión
+    # (una AsyncSession serializa las queries) y corren en paralelo
+    async with asyncio.TaskGroup() as tg:
+        ventas_task = tg.create_task(_ejecutar_consulta(stmt_ventas))
+        inventario_task = tg.create_task(_ejecutar_consulta(stmt_inventario))
+        destacados_task = tg.create_task(_ejecutar_consulta(stmt_destacados, mappings=True))
+    
+    metricas_ventas = ventas_task.result()[0]
+    
+    metricas_inventario = inventario_task.result()[0]
+    total_productos = metricas_inventario.total
+    productos_activos = metricas_inventario.activos
+    productos_bajo_stock = metricas_inventario.bajo_stock
+    valor_inventario = metricas_inventario.valor
+    alertas = metricas_inventario.alertas
+    
+    # Los valores vienen de SQL con tipos conocidos: se construyen sin re-validar
     destacados = [
-        ProductoDestacado(
-            id=str(row[0]),
-            nombre=row[1],
-            sku=row[2],
-            stock=row[3],
-            ventas_hoy=row[4]
+        ProductoDestacado.model_construct(
+            id=row["id"],
+            nombre=row["nombre"],
+            sku=row["sku"],
+            stock=row["stock_actual"],
+            ventas_hoy=row["ventas_count"]
         )
-        for row in destacados_result.all()
+        for row in destacados_task.result()
     ]
     
-    # === ALERTAS CRÍTICAS ===
-    # Productos sin stock + bajo stock crítico (< 5)
-    stmt_alertas = select(func.count(Producto.id)).where(
-        and_(
-            Producto.tienda_id == current_tienda.id,
-            Producto.stock_actual < 5,
-            Producto.is_active == True
-        )
-    )
-    alertas = (await session.execute(stmt_alertas)).scalar()
-    
-    return DashboardResumen(
-        ventas=MetricaVentas(
-            hoy=float(ventas_hoy),
-            ayer=float(ventas_ayer),
-            semana=float(ventas_semana),
-            mes=float(ventas_mes),
-            cambio_diario_porcentaje=round(cambio_diario, 2),
-            cambio_semanal_porcentaje=round(cambio_semanal, 2)
+    return DashboardResumen.model_construct(
+        ventas=MetricaVentas.model_construct(
+            hoy=float(metricas_ventas.hoy),
+            ayer=float(metricas_ventas.ayer),
+            semana=float(metricas_ventas.semana),
+            mes=float(metricas_ventas.mes),
+            cambio_diario_porcentaje=float(metricas_ventas.cambio_diario),
+            cambio_semanal_porcentaje=float(metricas_ventas.cambio_semanal)
         ),
-        inventario=MetricaInventario(
+        inventario=MetricaInventario.model_construct(
             total_productos=total_productos or 0,
             productos_activos=productos_activos or 0,
             productos_bajo_stock=productos_bajo_stock or 0,
@@ -216,7 +216,7 @@ async def obtener_dashboard_resumen(
         ),
         productos_destacados=destacados,
         alertas_criticas=alertas,
-        ultima_actualizacion=datetime.utcnow()
+        ultima_actualizacion=ahora
     )
 
 
@@ -230,7 +230,7 @@ async def obtener_ventas_tiempo_real(
     
     **Sin caché para datos en tiempo real**
     """
-    hace_24h = datetime.utcnow() - timedelta(hours=24)
+    hace_24h = datetime.now(timezone.utc) - timedelta(hours=24)
     
     stmt = select(
         func.date_trunc('hour', Venta.fecha).label('hora'),
@@ -250,7 +250,7 @@ async def obtener_ventas_tiempo_real(
         "periodo": "ultimas_24h",
         "datos": [
             {
-                "hora": row[0].isoformat() if row[0] else None,
+                "hora": row[0],  # ORJSONResponse serializa datetime a ISO 8601
                 "cantidad_ventas": row[1],
                 "total": float(row[2] or 0)
             }
@@ -2,52 +2,127 @@
 Exportación de Reportes - Nexus POS
 Endpoints para exportar reportes en formatos CSV y PDF
 """
-from datetime import datetime, timedelta
-from typing import Annotated, Optional
-from fastapi import APIRouter, Depends, Query
+from datetime import datetime, timedelta, timezone
+from typing import Annotated, AsyncIterator, Callable, Optional
+from fastapi import APIRouter, Depends, Query, Request, Response, status
 from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, and_, desc
-import io
+from sqlalchemy import select, func, and_, case, desc
+from redis.exceptions import RedisError
 import csv
+import logging
 
-from app.core.db import get_session
+from app.core.cache import etag_matches, generate_etag, get_redis_client
+from app.core.db import AsyncSessionLocal, get_session
 from app.models import Producto, Venta, DetalleVenta
 from app.api.deps import CurrentTienda
 
+logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/exportar", tags=["Exportación"])
 
+# Filas que se traen por vez desde el cursor del servidor
+CSV_BATCH_SIZE = 500
+
+# Tiempo que se guarda en Redis un CSV ya generado
+CSV_CACHE_TTL_SECONDS = 3600
+
+
+class _Sink:
+    """
+    Destino mínimo para csv.writer: acumula lo escrito hasta el próximo yield
+    Evita un StringIO intermedio por fila
+    """
+    
+    def __init__(self):
+        self.buf: list[str] = []
+    
+    def write(self, s: str) -> None:
+        self.buf.append(s)
+    
+    def drain(self) -> bytes:
+        """Devuelve lo acumulado ya codificado en UTF-8 y vacía el buffer"""
+        data = ''.join(self.buf).encode('utf-8')
+        self.buf.clear()
+        return data
+
+
+async def _stream_csv(
+    stmt,
+    encabezados: list[str],
+    formatear_fila: Callable[..., list]
+) -> AsyncIterator[bytes]:
+    """
+    Genera el CSV por lotes a medida que llegan los datos de la BD
+    
+    Usa una sesión propia porque el generador se consume después de que
+    FastAPI cerró la sesión del request. La memoria queda constante y el
+    primer byte sale sin esperar a leer todo el resultado. Cada lote se
+    entrega ya codificado para que Starlette no vuelva a codificarlo.
+    """
+    sink = _Sink()
+    writer = csv.writer(sink)
+    
+    writer.writerow(encabezados)
+    yield sink.drain()
+    
+    async with AsyncSessionLocal() as session:
+        result = await session.stream(stmt.execution_options(yield_per=CSV_BATCH_SIZE))
+        async for lote in result.partitions():
+            writer.writerows(formatear_fila(row) for row in lote)
+            yield sink.drain()
+
+
+async def _cachear_stream(
+    stream: AsyncIterator[bytes],
+    cache_key: str
+) -> AsyncIterator[bytes]:
+    """Reenvía el stream al cliente y, al completarse, guarda el archivo en Redis"""
+    chunks = []
+    async for chunk in stream:
+        chunks.append(chunk)
+        yield chunk
+    
+    try:
+        await get_redis_client().set(cache_key, b''.join(chunks), ex=CSV_CACHE_TTL_SECONDS)
+    except RedisError as e:
+        logger.warning(f"No se pudo guardar el CSV en Redis: {str(e)}")
+
 
 @router.get("/productos/csv")
 async def exportar_productos_csv(
+    request: Request,
     current_tienda: CurrentTienda,
     session: Annotated[AsyncSession, Depends(get_session)],
     solo_activos: bool = Query(True)
-) -> StreamingResponse:
+) -> Response:
     """
     Exporta listado de productos a formato CSV
     
     Columnas: SKU, Nombre, Tipo, Precio Venta, Precio Costo, Stock, Estado
+    
+    Responde con ETag según la última modificación del catálogo: si el cliente
+    ya tiene esa versión retorna 304, y con Redis se reutiliza el CSV generado.
     """
+    # Versión del catálogo (cambia con altas, ediciones y bajas lógicas)
+    version_stmt = select(
+        func.max(Producto.updated_at),
+        func.count(Producto.id)
+    ).where(Producto.tienda_id == current_tienda.id)
+    ultima_modificacion, cantidad = (await session.execute(version_stmt)).one()
+    etag = generate_etag(current_tienda.id, solo_activos, ultima_modificacion, cantidad)
+    
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    
     # Consultar productos
     stmt = select(Producto).where(Producto.tienda_id == current_tienda.id)
     if solo_activos:
         stmt = stmt.where(Producto.is_active == True)
     
-    result = await session.execute(stmt)
-    productos = result.scalars().all()
-    
-    # Crear CSV en memoria
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Encabezados
-    writer.writerow(['SKU', 'Nombre', 'Tipo', 'Precio Venta', 'Precio Costo', 'Stock Actual', 'Margen %', 'Estado'])
-    
-    # Datos
-    for p in productos:
+    def formatear_fila(row) -> list:
+        p = row[0]
         margen = ((p.precio_venta - p.precio_costo) / p.precio_venta * 100) if p.precio_venta > 0 else 0
-        writer.writerow([
+        return [
             p.sku,
             p.nombre,
             p.tipo,
@@ -56,24 +131,38 @@ async def exportar_productos_csv(
             p.stock_actual,
             f"{margen:.1f}%",
             'Activo' if p.is_active else 'Inactivo'
-        ])
+        ]
+    
+    encabezados = ['SKU', 'Nombre', 'Tipo', 'Precio Venta', 'Precio Costo', 'Stock Actual', 'Margen %', 'Estado']
     
     # Preparar respuesta
-    output.seek(0)
     fecha = datetime.now().strftime('%Y%m%d_%H%M%S')
     filename = f"productos_{current_tienda.nombre.replace(' ', '_')}_{fecha}.csv"
+    headers = {"Content-Disposition": f"attachment; filename={filename}", "ETag": etag}
+    
+    stream = _stream_csv(stmt, encabezados, formatear_fila)
+    
+    redis_client = get_redis_client()
+    if redis_client is not None:
+        cache_key = f"exportar:{current_tienda.id}:productos_csv:{etag}"
+        try:
+            contenido = await redis_client.get(cache_key)
+            if contenido is not None:
+                return Response(content=contenido, media_type="text/csv", headers=headers)
+        except RedisError as e:
+            logger.warning(f"Redis no disponible, se genera el CSV: {str(e)}")
+        stream = _cachear_stream(stream, cache_key)
     
     return StreamingResponse(
-        iter([output.getvalue()]),
+        stream,
         media_type="text/csv",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
+        headers=headers
     )
 
 
 @router.get("/ventas/csv")
 async def exportar_ventas_csv(
     current_tienda: CurrentTienda,
-    session: Annotated[AsyncSession, Depends(get_session)],
     fecha_desde: Optional[datetime] = None,
     fecha_hasta: Optional[datetime] = None
 ) -> StreamingResponse:
@@ -84,17 +173,25 @@ async def exportar_ventas_csv(
     """
     # Defaults
     if fecha_hasta is None:
-        fecha_hasta = datetime.utcnow()
+        fecha_hasta = datetime.now(timezone.utc)
     if fecha_desde is None:
         fecha_desde = fecha_hasta - timedelta(days=30)
     
+    # Cantidad de items por venta como subconsulta correlacionada
+    # (evita expandir todos los detalles y agrupar por venta)
+    cantidad_items = (
+        select(func.count(DetalleVenta.id))
+        .where(DetalleVenta.venta_id == Venta.id)
+        .correlate(Venta)
+        .scalar_subquery()
+    )
+    
     # Consultar ventas
     stmt = (
         select(
             Venta,
-            func.count(DetalleVenta.id).label('cantidad_items')
+            cantidad_items.label('cantidad_items')
         )
-        .outerjoin(DetalleVenta, Venta.id == DetalleVenta.venta_id)
         .where(
             and_(
                 Venta.tienda_id == current_tienda.id,
@@ -102,23 +199,12 @@ async def exportar_ventas_csv(
                 Venta.fecha <= fecha_hasta
             )
         )
-        .group_by(Venta.id)
         .order_by(Venta.fecha.desc())
     )
     
-    result = await session.execute(stmt)
-    rows = result.all()
-    
-    # Crear CSV
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Encabezados
-    writer.writerow(['Fecha', 'ID Venta', 'Total', 'Método Pago', 'Status Pago', 'Cantidad Items', 'Payment ID', 'CAE AFIP'])
-    
-    # Datos
-    for venta, cantidad_items in rows:
-        writer.writerow([
+    def formatear_fila(row) -> list:
+        venta, cantidad_items = row
+        return [
             venta.fecha.strftime('%Y-%m-%d %H:%M:%S'),
             str(venta.id),
             f"${venta.total:.2f}",
@@ -127,15 +213,16 @@ async def exportar_ventas_csv(
             cantidad_items or 0,
             venta.payment_id or '-',
             venta.afip_cae or '-'
-        ])
+        ]
+    
+    encabezados = ['Fecha', 'ID Venta', 'Total', 'Método Pago', 'Status Pago', 'Cantidad Items', 'Payment ID', 'CAE AFIP']
     
     # Preparar respuesta
-    output.seek(0)
     fecha_archivo = datetime.now().strftime('%Y%m%d_%H%M%S')
     filename = f"ventas_{current_tienda.nombre.replace(' ', '_')}_{fecha_archivo}.csv"
     
     return StreamingResponse(
-        iter([output.getvalue()]),
+        _stream_csv(stmt, encabezados, formatear_fila),
         media_type="text/csv",
         headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
@@ -144,7 +231,6 @@ async def exportar_ventas_csv(
 @router.get("/reportes/rentabilidad/csv")
 async def exportar_rentabilidad_csv(
     current_tienda: CurrentTienda,
-    session: Annotated[AsyncSession, Depends(get_session)],
     fecha_desde: Optional[datetime] = None,
     fecha_hasta: Optional[datetime] = None
 ) -> StreamingResponse:
@@ -155,17 +241,23 @@ async def exportar_rentabilidad_csv(
     """
     # Defaults
     if fecha_hasta is None:
-        fecha_hasta = datetime.utcnow()
+        fecha_hasta = datetime.now(timezone.utc)
     if fecha_desde is None:
         fecha_desde = fecha_hasta - timedelta(days=30)
     
-    # Query de rentabilidad
+    # Query de rentabilidad: utilidad y margen calculados por Postgres
+    costo_total = func.coalesce(func.sum(DetalleVenta.cantidad * Producto.precio_costo), 0)
+    ingreso_total = func.coalesce(func.sum(DetalleVenta.subtotal), 0)
+    utilidad = ingreso_total - costo_total
+    
     stmt = select(
         Producto.nombre,
         Producto.sku,
-        func.sum(DetalleVenta.cantidad).label('cantidad_vendida'),
-        func.sum(DetalleVenta.cantidad * Producto.precio_costo).label('costo_total'),
-        func.sum(DetalleVenta.subtotal).label('ingreso_total')
+        func.coalesce(func.sum(DetalleVenta.cantidad), 0).label('cantidad_vendida'),
+        costo_total.label('costo_total'),
+        ingreso_total.label('ingreso_total'),
+        utilidad.label('utilidad'),
+        case((ingreso_total > 0, utilidad / ingreso_total * 100), else_=0).label('margen')
     ).join(
         DetalleVenta, Producto.id == DetalleVenta.producto_id
     ).join(
@@ -181,41 +273,25 @@ async def exportar_rentabilidad_csv(
         Producto.id, Producto.nombre, Producto.sku
     ).order_by(desc('ingreso_total'))
     
-    result = await session.execute(stmt)
-    rows = result.all()
-    
-    # Crear CSV
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Encabezados
-    writer.writerow(['Producto', 'SKU', 'Cantidad Vendida', 'Costo Total', 'Ingreso Total', 'Utilidad Bruta', 'Margen %'])
-    
-    # Datos
-    for nombre, sku, cantidad, costo, ingreso in rows:
-        cantidad = float(cantidad or 0)
-        costo_total = float(costo or 0)
-        ingreso_total = float(ingreso or 0)
-        utilidad = ingreso_total - costo_total
-        margen = (utilidad / ingreso_total * 100) if ingreso_total > 0 else 0
-        
-        writer.writerow([
-            nombre,
-            sku,
-            f"{cantidad:.2f}",
-            f"${costo_total:.2f}",
-            f"${ingreso_total:.2f}",
-            f"${utilidad:.2f}",
-            f"{margen:.1f}%"
-        ])
+    def formatear_fila(row) -> list:
+        return [
+            row.nombre,
+            row.sku,
+            f"{row.cantidad_vendida:.2f}",
+            f"${row.costo_total:.2f}",
+            f"${row.ingreso_total:.2f}",
+            f"${row.utilidad:.2f}",
+            f"{row.margen:.1f}%"
+        ]
+    
+    encabezados = ['Producto', 'SKU', 'Cantidad Vendida', 'Costo Total', 'Ingreso Total', 'Utilidad Bruta', 'Margen %']
     
     # Preparar respuesta
-    output.seek(0)
     fecha_archivo = datetime.now().strftime('%Y%m%d_%H%M%S')
     filename = f"rentabilidad_{current_tienda.nombre.replace(' ', '_')}_{fecha_archivo}.csv"
     
     return StreamingResponse(
-        iter([output.getvalue()]),
+        _stream_csv(stmt, encabezados, formatear_fila),
         media_type="text/csv",
         headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
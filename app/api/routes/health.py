@@ -5,9 +5,9 @@ Monitoreo de servicios críticos y métricas de sistema
 import logging
 import asyncio
 from typing import Dict, Any, Optional
-from datetime import datetime
+from datetime import datetime, timezone
 from fastapi import APIRouter, status
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 from app.core.db import get_session, engine
@@ -107,7 +107,7 @@ async def health_check_basic():
     """
     return {
         "status": "healthy",
-        "timestamp": datetime.utcnow().isoformat(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
         "service": settings.PROJECT_NAME,
         "version": settings.VERSION
     }
@@ -134,13 +134,13 @@ async def readiness_check():
     
     response_data = {
         "status": "ready" if all_healthy else "not_ready",
-        "timestamp": datetime.utcnow().isoformat(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
         "checks": checks
     }
     
     status_code = status.HTTP_200_OK if all_healthy else status.HTTP_503_SERVICE_UNAVAILABLE
     
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=status_code,
         content=response_data
     )
@@ -166,7 +166,7 @@ async def system_metrics():
     # - CPU usage
     
     return {
-        "timestamp": datetime.utcnow().isoformat(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
         "database": db_check,
         "application": {
             "name": settings.PROJECT_NAME,
@@ -2,14 +2,19 @@
 Rutas de Insights - Nexus POS
 Dashboard de alertas y recomendaciones inteligentes
 """
+import asyncio
+import base64
+import json
 import logging
-from typing import Annotated, List
+from typing import Annotated, List, Optional
 from uuid import UUID
-from fastapi import APIRouter, Depends, HTTPException, status, Query, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, status, Query, BackgroundTasks, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_
+from sqlalchemy import select, and_, or_, case, delete, func, lambda_stmt, update
 from sqlmodel import col
-from app.core.db import get_session
+from app.core.cache import cached, invalidate_cache
+from app.core.config import settings
+from app.core.db import AsyncSessionLocal, get_session
 from app.models import Insight
 from app.services.insight_service import insight_service
 from app.api.deps import CurrentTienda
@@ -20,6 +25,12 @@ from datetime import datetime
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/insights", tags=["Insights & Alertas"])
 
+# Prioridad de cada nivel de urgencia (menor = más urgente)
+URGENCIA_PRIORIDAD: dict[str, int] = {'CRITICA': 1, 'ALTA': 2, 'MEDIA': 3, 'BAJA': 4}
+
+# Las expresiones SQL son inmutables: se construye una sola vez al importar el módulo
+_URGENCIA_ORDER = case(URGENCIA_PRIORIDAD, value=Insight.nivel_urgencia, else_=5)
+
 
 # ==================== SCHEMAS ====================
 
@@ -44,16 +55,43 @@ class InsightRefreshResponse(BaseModel):
     total: int
 
 
+# ==================== HELPERS ====================
+
+def _codificar_cursor(rank: int, created_at: datetime, insight_id: UUID) -> str:
+    """Codifica la posición (urgencia, fecha, id) del último insight de la página"""
+    raw = json.dumps([rank, created_at.isoformat(), str(insight_id)])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decodificar_cursor(cursor: str) -> tuple[int, datetime, UUID]:
+    """
+    Decodifica un cursor generado por _codificar_cursor
+    
+    Raises:
+        HTTPException 400: Cursor inválido
+    """
+    try:
+        rank, created_at, insight_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return int(rank), datetime.fromisoformat(created_at), UUID(insight_id)
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cursor de paginación inválido"
+        ) from None
+
+
 # ==================== ENDPOINTS ====================
 
 @router.get("/", response_model=List[InsightRead])
 async def listar_insights(
     current_tienda: CurrentTienda,
     session: Annotated[AsyncSession, Depends(get_session)],
+    response: Response,
     activos_solo: bool = Query(True, description="Mostrar solo insights activos"),
     nivel_urgencia: str = Query(None, description="Filtrar por urgencia: BAJA, MEDIA, ALTA, CRITICA"),
     tipo: str = Query(None, description="Filtrar por tipo: STOCK_BAJO, VENTAS_DIARIAS, etc."),
-    limit: int = Query(50, ge=1, le=200)
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = Query(None, description="Cursor de la página siguiente (header X-Next-Cursor)")
 ) -> List[InsightRead]:
     """
     Lista los insights de la tienda ordenados por urgencia y fecha
@@ -66,9 +104,38 @@ async def listar_insights(
     - activos_solo: Mostrar solo activos (por defecto True)
     - nivel_urgencia: Filtrar por nivel específico
     - tipo: Filtrar por tipo específico
+    
+    Paginación por cursor (keyset): si hay más resultados, la respuesta incluye
+    el header X-Next-Cursor para pedir la página siguiente con `cursor`
     """
-    # Construir query base
-    statement = select(Insight).where(Insight.tienda_id == current_tienda.id)
+    # Normalizar filtros; un valor desconocido nunca matchea: responder sin ir a la BD
+    if nivel_urgencia:
+        nivel_urgencia = nivel_urgencia.upper()
+        if nivel_urgencia not in URGENCIA_PRIORIDAD:
+            return []
+    
+    if tipo:
+        tipo = tipo.upper()
+        if tipo not in insight_service.TIPOS:
+            return []
+    
+    # Ordenamiento por urgencia y fecha resuelto en SQL, así el LIMIT
+    # se aplica sobre los insights más urgentes y no sobre un subconjunto arbitrario
+    urgencia_order = _URGENCIA_ORDER
+    
+    # Construir query base: solo las columnas del schema, sin hidratar objetos ORM
+    statement = select(
+        Insight.id,
+        Insight.tipo,
+        Insight.mensaje,
+        Insight.nivel_urgencia,
+        Insight.is_active,
+        Insight.extra_data,
+        Insight.created_at,
+        urgencia_order.label('urgencia_rank')
+    ).where(
+        Insight.tienda_id == current_tienda.id
+    )
     
     # Filtro de activos
     if activos_solo:
@@ -76,34 +143,58 @@ async def listar_insights(
     
     # Filtro por nivel de urgencia
     if nivel_urgencia:
-        statement = statement.where(Insight.nivel_urgencia == nivel_urgencia.upper())
+        statement = statement.where(Insight.nivel_urgencia == nivel_urgencia)
     
     # Filtro por tipo
     if tipo:
-        statement = statement.where(Insight.tipo == tipo.upper())
-    
-    # Ordenamiento personalizado por urgencia
-    urgencia_order = {
-        'CRITICA': 1,
-        'ALTA': 2,
-        'MEDIA': 3,
-        'BAJA': 4
-    }
+        statement = statement.where(Insight.tipo == tipo)
+    
+    # Continuar después del último insight de la página anterior
+    if cursor:
+        rank, created_at, insight_id = _decodificar_cursor(cursor)
+        statement = statement.where(
+            or_(
+                urgencia_order > rank,
+                and_(
+                    urgencia_order == rank,
+                    or_(
+                        Insight.created_at < created_at,
+                        and_(Insight.created_at == created_at, Insight.id < insight_id)
+                    )
+                )
+            )
+        )
+    
+    statement = statement.order_by(
+        urgencia_order.asc(),
+        Insight.created_at.desc(),
+        Insight.id.desc()
+    ).limit(limit)
     
     # Ejecutar query
-    statement = statement.limit(limit)
     result = await session.execute(statement)
-    insights = result.scalars().all()
-    
-    # Ordenar en Python por urgencia y fecha
-    insights_sorted = sorted(
-        insights,
-        key=lambda x: (urgencia_order.get(x.nivel_urgencia, 5), -x.created_at.timestamp())
-    )
-    
-    logger.info(f"Listados {len(insights_sorted)} insights para tienda {current_tienda.id}")
+    rows = result.all()
     
-    return [InsightRead.model_validate(insight) for insight in insights_sorted]
+    # Página completa: puede haber más resultados
+    if len(rows) == limit:
+        ultimo = rows[-1]
+        response.headers["X-Next-Cursor"] = _codificar_cursor(ultimo.urgencia_rank, ultimo.created_at, ultimo.id)
+    
+    logger.info(f"Listados {len(rows)} insights para tienda {current_tienda.id}")
+    
+    # Filas ya tipadas por la BD: se construyen sin re-validar
+    return [
+        InsightRead.model_construct(
+            id=row.id,
+            tipo=row.tipo,
+            mensaje=row.mensaje,
+            nivel_urgencia=row.nivel_urgencia,
+            is_active=row.is_active,
+            metadata=row.extra_data or {},
+            created_at=row.created_at
+        )
+        for row in rows
+    ]
 
 
 @router.post("/{insight_id}/dismiss", status_code=status.HTTP_204_NO_CONTENT)
@@ -142,6 +233,7 @@ async def archivar_insight(
     insight.is_active = False
     session.add(insight)
     await session.commit()
+    await invalidate_cache(f"insights:{current_tienda.id}")
     
     logger.info(f"Insight {insight_id} archivado por usuario de tienda {current_tienda.id}")
 
@@ -172,27 +264,22 @@ async def refrescar_insights(
     try:
         # Si force=True, archivar insights antiguos para evitar duplicados
         if force:
-            statement = select(Insight).where(
+            statement = update(Insight).where(
                 and_(
                     Insight.tienda_id == current_tienda.id,
                     Insight.is_active == True
                 )
-            )
+            ).values(is_active=False)
             result = await session.execute(statement)
-            insights_antiguos = result.scalars().all()
-            
-            for insight in insights_antiguos:
-                insight.is_active = False
-                session.add(insight)
-            
             await session.commit()
-            logger.info(f"Archivados {len(insights_antiguos)} insights antiguos (force=True)")
+            logger.info(f"Archivados {result.rowcount} insights antiguos (force=True)")
         
         # Generar todos los insights
         resultado = await insight_service.generate_all_insights(
             tienda_id=current_tienda.id,
             session=session
         )
+        await invalidate_cache(f"insights:{current_tienda.id}")
         
         return InsightRefreshResponse(
             mensaje="Insights actualizados exitosamente",
@@ -211,24 +298,47 @@ async def refrescar_insights(
 @router.post("/background-refresh", status_code=status.HTTP_202_ACCEPTED)
 async def refrescar_insights_background(
     current_tienda: CurrentTienda,
-    session: Annotated[AsyncSession, Depends(get_session)],
     background_tasks: BackgroundTasks
 ) -> dict:
     """
-    Genera insights en segundo plano usando FastAPI BackgroundTasks
+    Genera insights en segundo plano
     
     Retorna inmediatamente 202 Accepted mientras procesa en background
     
-    Ideal para no bloquear la respuesta del API cuando hay muchos datos
+    Si CELERY_BROKER_URL está configurado, la tarea se encola en Celery y
+    corre en un worker dedicado; el estado se consulta en GET /insights/jobs/{job_id}.
+    Sin broker, se usa FastAPI BackgroundTasks dentro del mismo proceso.
     """
+    tienda_id = current_tienda.id
+    
+    if settings.CELERY_BROKER_URL:
+        from app.tasks.insights_tasks import generate_insights_task
+        
+        # Publicar en el broker es I/O bloqueante: fuera del event loop
+        job = await asyncio.to_thread(generate_insights_task.delay, str(tienda_id))
+        logger.info(f"Generación de insights encolada para tienda {tienda_id} (job {job.id})")
+        
+        return {
+            "mensaje": "Generación de insights encolada",
+            "status": "queued",
+            "job_id": job.id
+        }
+    
     async def generar_insights_task():
-        """Tarea en segundo plano"""
-        logger.info(f"Iniciando generación de insights en background para tienda {current_tienda.id}")
+        """
+        Tarea en segundo plano
+        
+        Abre su propia sesión: la del request ya fue cerrada por FastAPI
+        cuando se ejecuta la tarea
+        """
+        logger.info(f"Iniciando generación de insights en background para tienda {tienda_id}")
         try:
-            resultado = await insight_service.generate_all_insights(
-                tienda_id=current_tienda.id,
-                session=session
-            )
+            async with AsyncSessionLocal() as bg_session:
+                resultado = await insight_service.generate_all_insights(
+                    tienda_id=tienda_id,
+                    session=bg_session
+                )
+            await invalidate_cache(f"insights:{tienda_id}")
             logger.info(f"Insights generados en background: {resultado}")
         except Exception as e:
             logger.error(f"Error en tarea de background: {str(e)}", exc_info=True)
@@ -242,7 +352,48 @@ async def refrescar_insights_background(
     }
 
 
+@router.get("/jobs/{job_id}")
+async def estado_job_insights(
+    job_id: str,
+    current_tienda: CurrentTienda
+) -> dict:
+    """
+    Consulta el estado de una generación de insights encolada en Celery
+    
+    Estados: PENDING, STARTED, SUCCESS, FAILURE, RETRY
+    """
+    if not settings.CELERY_BROKER_URL:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="La cola de tareas no está configurada"
+        )
+    
+    from celery.result import AsyncResult
+    from app.celery_app import celery_app
+    
+    job = AsyncResult(job_id, app=celery_app)
+    
+    # Consultar el result backend también es I/O bloqueante
+    estado, resultado = await asyncio.to_thread(lambda: (job.state, job.result))
+    
+    respuesta = {"job_id": job_id, "status": estado}
+    
+    if estado == "SUCCESS":
+        # No exponer resultados de jobs de otra tienda
+        if resultado.get("tienda_id") != str(current_tienda.id):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Job no encontrado"
+            )
+        respuesta["insights_generados"] = resultado["insights_generados"]
+    elif estado == "FAILURE":
+        respuesta["error"] = "Error al generar insights"
+    
+    return respuesta
+
+
 @router.get("/stats")
+@cached(ttl_seconds=60, key_prefix="insights")
 async def estadisticas_insights(
     current_tienda: CurrentTienda,
     session: Annotated[AsyncSession, Depends(get_session)]
@@ -252,21 +403,26 @@ async def estadisticas_insights(
     
     Returns:
         Contadores por tipo, urgencia y estado
-    """
-    from sqlalchemy import func
     
-    # Query de contadores
-    statement = select(
-        Insight.tipo,
-        Insight.nivel_urgencia,
-        Insight.is_active,
-        func.count(Insight.id).label('count')
-    ).where(
-        Insight.tienda_id == current_tienda.id
-    ).group_by(
-        Insight.tipo,
-        Insight.nivel_urgencia,
-        Insight.is_active
+    **Cacheado por 60 segundos (se invalida al archivar, refrescar o limpiar)**
+    """
+    tienda_id = current_tienda.id
+    
+    # Query de contadores (lambda_stmt: la construcción y la clave de caché del
+    # SQL se resuelven una vez; tienda_id se extrae como parámetro en cada llamada)
+    statement = lambda_stmt(
+        lambda: select(
+            Insight.tipo,
+            Insight.nivel_urgencia,
+            Insight.is_active,
+            func.count(Insight.id).label('count')
+        ).where(
+            Insight.tienda_id == tienda_id
+        ).group_by(
+            Insight.tipo,
+            Insight.nivel_urgencia,
+            Insight.is_active
+        )
     )
     
     result = await session.execute(statement)
@@ -316,20 +472,18 @@ async def limpiar_insights(
     
     ATENCIÓN: Esta operación es irreversible
     """
-    statement = select(Insight).where(Insight.tienda_id == current_tienda.id)
+    # Un único DELETE en el servidor, sin cargar las filas
+    statement = delete(Insight).where(Insight.tienda_id == current_tienda.id)
     
     if solo_archivados:
         statement = statement.where(Insight.is_active == False)
     
     result = await session.execute(statement)
-    insights = result.scalars().all()
-    
-    for insight in insights:
-        await session.delete(insight)
-    
     await session.commit()
+    eliminados = result.rowcount
+    await invalidate_cache(f"insights:{current_tienda.id}")
     
     logger.warning(
-        f"Eliminados {len(insights)} insights de tienda {current_tienda.id} "
+        f"Eliminados {eliminados} insights de tienda {current_tienda.id} "
         f"({'solo archivados' if solo_archivados else 'TODOS'})"
     )
@@ -3,15 +3,18 @@ Gestión Avanzada de Inventario - Nexus POS
 Movimientos de stock, alertas y transferencias
 """
 import logging
-from typing import Annotated, List, Optional
+from typing import Annotated, AsyncIterator, Optional
 from datetime import datetime
 from uuid import UUID, uuid4
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, func
+from sqlalchemy import select, update, and_, bindparam, cast, exists, func, Float, Numeric
 from pydantic import BaseModel, Field
-from app.core.db import get_session
-from app.models import Producto
+import orjson
+from app.core.cache import cached, invalidate_cache
+from app.core.db import AsyncSessionLocal, get_session
+from app.models import Producto, _utcnow
 from app.api.deps import CurrentTienda, CurrentUser
 from app.core.logging_config import log_audit
 
@@ -19,6 +22,56 @@ from app.core.logging_config import log_audit
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/inventario", tags=["Inventario"])
 
+# Filas leídas por lote desde el cursor del servidor al emitir listados grandes
+STREAM_BATCH_SIZE = 500
+
+
+# === CONSULTAS PRECONSTRUIDAS ===
+# Consultas de forma fija construidas una sola vez al importar el módulo; la
+# tienda se pasa como parámetro al ejecutar, así cada request solo reutiliza
+# el SQL ya compilado en la caché del engine
+
+def _redondear(expr):
+    """Redondea a 2 decimales en SQL y devuelve float8 (sin Decimal en Python)"""
+    return cast(func.round(cast(expr, Numeric), 2), Float)
+
+
+_EXISTEN_SIN_STOCK_STMT = select(
+    exists().where(
+        and_(
+            Producto.tienda_id == bindparam("tienda_id"),
+            Producto.stock_actual == 0,
+            Producto.is_active == True
+        )
+    )
+)
+
+_total = func.count(Producto.id)
+_sin_stock = func.count(Producto.id).filter(Producto.stock_actual == 0)
+_valor_costo = func.coalesce(func.sum(Producto.stock_actual * Producto.precio_costo), 0)
+_valor_venta = func.coalesce(func.sum(Producto.stock_actual * Producto.precio_venta), 0)
+
+# Todos los contadores y valores en una sola pasada sobre productos activos,
+# con porcentajes y redondeos resueltos en la BD
+_ESTADISTICAS_STMT = select(
+    _total.label('total_productos'),
+    _sin_stock.label('productos_sin_stock'),
+    func.count(Producto.id).filter(
+        and_(Producto.stock_actual > 0, Producto.stock_actual < 10)
+    ).label('productos_bajo_stock'),
+    func.coalesce(
+        _redondear(_sin_stock * 100.0 / func.nullif(_total, 0)), 0
+    ).label('porcentaje_sin_stock'),
+    _redondear(_valor_costo).label('valor_inventario_costo'),
+    _redondear(_valor_venta).label('valor_inventario_venta'),
+    _redondear(_valor_venta - _valor_costo).label('utilidad_potencial')
+).where(
+    and_(
+        Producto.tienda_id == bindparam("tienda_id"),
+        Producto.is_active == True
+    )
+)
+
 
 # === SCHEMAS ===
 
@@ -30,7 +83,7 @@ class MovimientoStock(BaseModel):
     tipo_movimiento: str  # entrada, salida, ajuste, transferencia
     motivo: Optional[str] = None
     usuario_id: UUID
-    fecha: datetime = Field(default_factory=datetime.utcnow)
+    fecha: datetime = Field(default_factory=_utcnow)
     stock_anterior: float
     stock_nuevo: float
     
@@ -80,15 +133,32 @@ async def ajustar_stock_manual(
     
     IMPORTANTE: Genera registro de auditoría
     """
-    # Buscar producto
-    stmt = select(Producto).where(
+    tienda_id = current_tienda.id
+    
+    # Lectura del stock anterior (con bloqueo de fila) y actualización en un solo
+    # round trip: WITH anterior AS (SELECT ... FOR UPDATE) UPDATE ... RETURNING
+    anterior = select(Producto.id, Producto.stock_actual).where(
         and_(
             Producto.id == ajuste.producto_id,
-            Producto.tienda_id == current_tienda.id
+            Producto.tienda_id == tienda_id
         )
+    ).with_for_update().cte("anterior")
+    
+    stmt = (
+        update(Producto)
+        .where(Producto.id == anterior.c.id)
+        .values(stock_actual=ajuste.cantidad_nueva)
+        .returning(
+            Producto.id,
+            Producto.nombre,
+            Producto.sku,
+            anterior.c.stock_actual.label("stock_anterior"),
+            Producto.stock_actual
+        )
+        .execution_options(synchronize_session=False)
     )
     result = await session.execute(stmt)
-    producto = result.scalar_one_or_none()
+    producto = result.one_or_none()
     
     if not producto:
         raise HTTPException(
@@ -96,26 +166,26 @@ async def ajustar_stock_manual(
             detail="Producto no encontrado"
         )
     
-    # Guardar stock anterior
-    stock_anterior = producto.stock_actual
-    diferencia = ajuste.cantidad_nueva - stock_anterior
-    
-    # Actualizar stock
-    producto.stock_actual = ajuste.cantidad_nueva
-    session.add(producto)
     await session.commit()
     
+    stock_anterior = producto.stock_anterior
+    diferencia = producto.stock_actual - stock_anterior
+    
+    # El stock cambió: descartar estadísticas y alertas cacheadas
+    await invalidate_cache(f"inventario:{tienda_id}")
+    await invalidate_cache(f"productos:{tienda_id}")
+    
     # LOG DE AUDITORÍA
     log_audit(
         action="AJUSTE_STOCK_MANUAL",
         user_id=str(current_user.id),
-        tienda_id=str(current_tienda.id),
+        tienda_id=str(tienda_id),
         details={
             "producto_id": str(producto.id),
             "producto_nombre": producto.nombre,
             "sku": producto.sku,
             "stock_anterior": stock_anterior,
-            "stock_nuevo": ajuste.cantidad_nueva,
+            "stock_nuevo": producto.stock_actual,
             "diferencia": diferencia,
             "motivo": ajuste.motivo
         }
@@ -123,7 +193,7 @@ async def ajustar_stock_manual(
     
     logger.info(
         f"Stock ajustado manualmente: {producto.nombre} (SKU: {producto.sku}) "
-        f"de {stock_anterior} a {ajuste.cantidad_nueva}"
+        f"de {stock_anterior} a {producto.stock_actual}"
     )
     
     return {
@@ -136,12 +206,66 @@ async def ajustar_stock_manual(
     }
 
 
-@router.get("/alertas-stock-bajo", response_model=List[ProductoBajoStock])
+def _alertas_json(lote, umbral: float) -> bytes:
+    """Serializa un lote de filas como elementos del arreglo JSON (sin corchetes)"""
+    return b",".join(
+        orjson.dumps({
+            # asyncpg entrega su propio tipo UUID, que orjson no serializa
+            "id": str(p.id),
+            "sku": p.sku,
+            "nombre": p.nombre,
+            "stock_actual": p.stock_actual,
+            "stock_minimo": umbral,
+            "debe_reabastecer": p.stock_actual < (umbral / 2)
+        })
+        for p in lote
+    )
+
+
+async def _stream_alertas_stock_bajo(
+    session: AsyncSession,
+    lotes: AsyncIterator,
+    primer_lote: list,
+    umbral: float
+) -> AsyncIterator[bytes]:
+    """
+    Emite el arreglo JSON de alertas por lotes a medida que llegan los datos de la BD
+    
+    El primer lote ya viene leído por el endpoint; la sesión es propia (FastAPI
+    cierra la del request antes de consumir el generador) y se cierra al terminar.
+    """
+    try:
+        yield b"[" + _alertas_json(primer_lote, umbral)
+        async for lote in lotes:
+            yield b"," + _alertas_json(lote, umbral)
+        yield b"]"
+    finally:
+        await session.close()
+
+
+# El cuerpo se emite a mano, así que response_model no aplicaría: se documenta
+# el arreglo de ProductoBajoStock directamente en OpenAPI
+_ALERTAS_STOCK_BAJO_RESPONSES = {
+    200: {
+        "description": "Arreglo JSON de productos con stock bajo (emitido en streaming)",
+        "content": {
+            "application/json": {
+                "schema": {"type": "array", "items": ProductoBajoStock.model_json_schema()}
+            }
+        },
+    }
+}
+
+
+@router.get(
+    "/alertas-stock-bajo",
+    response_class=StreamingResponse,
+    responses=_ALERTAS_STOCK_BAJO_RESPONSES
+)
 async def obtener_alertas_stock_bajo(
     current_tienda: CurrentTienda,
-    session: Annotated[AsyncSession, Depends(get_session)],
     umbral: float = 10.0
-) -> List[ProductoBajoStock]:
+) -> StreamingResponse:
     """
     Obtiene lista de productos con stock bajo
     
@@ -149,8 +273,18 @@ async def obtener_alertas_stock_bajo(
     - Dashboard de alertas
     - Planificación de compras
     - Prevenir quiebres de stock
+    
+    La respuesta se emite en streaming: la memoria queda acotada sin importar
+    la cantidad de productos. El primer lote se lee antes de responder, así un
+    error de BD en la consulta sigue devolviendo 500 y no un 200 truncado.
     """
-    stmt = select(Producto).where(
+    # Solo las columnas del schema, sin hidratar objetos ORM
+    stmt = select(
+        Producto.id,
+        Producto.sku,
+        Producto.nombre,
+        Producto.stock_actual
+    ).where(
         and_(
             Producto.tienda_id == current_tienda.id,
             Producto.stock_actual <= umbral,
@@ -158,58 +292,95 @@ async def obtener_alertas_stock_bajo(
         )
     ).order_by(Producto.stock_actual)
     
-    result = await session.execute(stmt)
-    productos = result.scalars().all()
+    session = AsyncSessionLocal()
+    try:
+        result = await session.stream(stmt.execution_options(yield_per=STREAM_BATCH_SIZE))
+        lotes = result.partitions()
+        primer_lote = await anext(lotes, [])
+    except Exception:
+        await session.close()
+        raise
     
-    return [
-        ProductoBajoStock(
-            id=p.id,
-            sku=p.sku,
-            nombre=p.nombre,
-            stock_actual=p.stock_actual,
-            stock_minimo=umbral,
-            debe_reabastecer=p.stock_actual < (umbral / 2)
-        )
-        for p in productos
-    ]
+    return StreamingResponse(
+        _stream_alertas_stock_bajo(session, lotes, primer_lote, umbral),
+        media_type="application/json"
+    )
+
+
+@router.get("/sin-stock/existe")
+async def existen_productos_sin_stock(
+    current_tienda: CurrentTienda,
+    session: Annotated[AsyncSession, Depends(get_session)]
+) -> dict:
+    """
+    Indica si hay al menos un producto activo sin stock
+    
+    Pensado para badges del dashboard: EXISTS corta en la primera fila
+    encontrada, sin contar ni traer productos
+    """
+    hay_sin_stock = await session.scalar(
+        _EXISTEN_SIN_STOCK_STMT, {"tienda_id": current_tienda.id}
+    )
+    
+    return {"hay_sin_stock": hay_sin_stock}
 
 
 @router.get("/sin-stock")
 async def obtener_productos_sin_stock(
     current_tienda: CurrentTienda,
-    session: Annotated[AsyncSession, Depends(get_session)]
+    session: Annotated[AsyncSession, Depends(get_session)],
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=500)
 ):
     """
-    Retorna productos completamente sin stock
+    Retorna productos completamente sin stock (paginado)
     
     Urgente para reabastecimiento
     """
-    stmt = select(Producto).where(
-        and_(
-            Producto.tienda_id == current_tienda.id,
-            Producto.stock_actual == 0,
-            Producto.is_active == True
-        )
+    conditions = and_(
+        Producto.tienda_id == current_tienda.id,
+        Producto.stock_actual == 0,
+        Producto.is_active == True
     )
     
+    # El total viaja en cada fila (window function): una sola consulta por página
+    stmt = select(
+        Producto.id,
+        Producto.sku,
+        Producto.nombre,
+        func.count().over().label('total')
+    ).where(conditions).order_by(Producto.nombre, Producto.id).offset(skip).limit(limit)
+    
     result = await session.execute(stmt)
-    productos = result.scalars().all()
+    rows = result.all()
+    
+    if rows:
+        total = rows[0].total
+    elif skip > 0:
+        # Página fuera de rango: el total no viene en ninguna fila
+        total = await session.scalar(select(func.count(Producto.id)).where(conditions))
+    else:
+        total = 0
     
     return {
-        "total": len(productos),
+        "total": total,
+        "skip": skip,
+        "limit": limit,
+        "has_more": (skip + limit) < total,
         "productos": [
             {
-                "id": p.id,
-                "sku": p.sku,
-                "nombre": p.nombre,
+                "id": row.id,
+                "sku": row.sku,
+                "nombre": row.nombre,
                 "ultima_venta": None  # TODO: Agregar query de última venta
             }
-            for p in productos
+            for row in rows
         ]
     }
 
 
 @router.get("/estadisticas")
+@cached(ttl_seconds=60, key_prefix="inventario")
 async def obtener_estadisticas_inventario(
     current_tienda: CurrentTienda,
     session: Annotated[AsyncSession, Depends(get_session)]
@@ -222,70 +393,11 @@ async def obtener_estadisticas_inventario(
     - Valor total de inventario
     - Productos sin stock
     - Productos con stock bajo
-    """
-    # Total de productos activos
-    stmt_total = select(func.count(Producto.id)).where(
-        and_(
-            Producto.tienda_id == current_tienda.id,
-            Producto.is_active == True
-        )
-    )
-    result_total = await session.execute(stmt_total)
-    total_productos = result_total.scalar()
-    
-    # Productos sin stock
-    stmt_sin_stock = select(func.count(Producto.id)).where(
-        and_(
-            Producto.tienda_id == current_tienda.id,
-            Producto.stock_actual == 0,
-            Producto.is_active == True
-        )
-    )
-    result_sin_stock = await session.execute(stmt_sin_stock)
-    productos_sin_stock = result_sin_stock.scalar()
     
-    # Productos con stock bajo (< 10)
-    stmt_bajo_stock = select(func.count(Producto.id)).where(
-        and_(
-            Producto.tienda_id == current_tienda.id,
-            Producto.stock_actual > 0,
-            Producto.stock_actual < 10,
-            Producto.is_active == True
-        )
-    )
-    result_bajo_stock = await session.execute(stmt_bajo_stock)
-    productos_bajo_stock = result_bajo_stock.scalar()
-    
-    # Valor total de inventario (a precio de costo)
-    stmt_valor = select(
-        func.sum(Producto.stock_actual * Producto.precio_costo)
-    ).where(
-        and_(
-            Producto.tienda_id == current_tienda.id,
-            Producto.is_active == True
-        )
-    )
-    result_valor = await session.execute(stmt_valor)
-    valor_inventario = result_valor.scalar() or 0
-    
-    # Valor total a precio de venta
-    stmt_valor_venta = select(
-        func.sum(Producto.stock_actual * Producto.precio_venta)
-    ).where(
-        and_(
-            Producto.tienda_id == current_tienda.id,
-            Producto.is_active == True
-        )
-    )
-    result_valor_venta = await session.execute(stmt_valor_venta)
-    valor_venta = result_valor_venta.scalar() or 0
+    **Cacheado por 60 segundos (se invalida al modificar stock)**
+    """
+    metricas = (await session.execute(
+        _ESTADISTICAS_STMT, {"tienda_id": current_tienda.id}
+    )).mappings().one()
     
-    return {
-        "total_productos": total_productos,
-        "productos_sin_stock": productos_sin_stock,
-        "productos_bajo_stock": productos_bajo_stock,
-        "porcentaje_sin_stock": round((productos_sin_stock / total_productos * 100) if total_productos > 0 else 0, 2),
-        "valor_inventario_costo": round(float(valor_inventario), 2),
-        "valor_inventario_venta": round(float(valor_venta), 2),
-        "utilidad_potencial": round(float(valor_venta - valor_inventario), 2)
-    }
+    return dict(metricas)
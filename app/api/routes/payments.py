@@ -2,14 +2,18 @@
 Rutas de Pagos - Nexus POS
 Integración con Mercado Pago y gestión de webhooks
 """
+import asyncio
 import logging
 from typing import Annotated, Dict, Any, Optional
 from uuid import UUID
-from fastapi import APIRouter, Depends, HTTPException, status, Request, Header
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status, Request, Header
+from redis.exceptions import RedisError
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import update
 from sqlmodel import select
-from app.core.db import get_session
-from app.models import Venta, DetalleVenta
+from app.core.cache import get_redis_client
+from app.core.db import AsyncSessionLocal, get_session
+from app.models import Venta, DetalleVenta, Producto
 from app.services.payment_service import payment_service
 from app.services.afip_service import afip_service
 from app.api.deps import CurrentTienda
@@ -19,6 +23,124 @@ from datetime import datetime
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/payments", tags=["Pagos"])
 
+# Idempotencia de webhooks: MercadoPago reintenta la misma notificación
+# (mismo X-Request-Id) hasta recibir 200
+WEBHOOK_IDEMPOTENCY_PREFIX = "mp:req:"
+WEBHOOK_IDEMPOTENCY_TTL_SECONDS = 86400
+
+
+async def _es_webhook_duplicado(x_request_id: str) -> bool:
+    """
+    Registra el X-Request-Id y devuelve True si ya había sido recibido
+    
+    Con Redis el registro es compartido entre workers (un solo SET NX); sin
+    Redis, o si falla, se usa el LRU en memoria del payment_service.
+    """
+    redis_client = get_redis_client()
+    if redis_client is not None:
+        try:
+            nuevo = await redis_client.set(
+                f"{WEBHOOK_IDEMPOTENCY_PREFIX}{x_request_id}",
+                1,
+                nx=True,
+                ex=WEBHOOK_IDEMPOTENCY_TTL_SECONDS
+            )
+            return not nuevo
+        except RedisError as e:
+            logger.warning(f"Redis no disponible, idempotencia en memoria: {str(e)}")
+    
+    return payment_service.is_replay(x_request_id)
+
+
+async def _emitir_factura_background(venta_id: UUID, monto: float) -> None:
+    """
+    Emite la factura AFIP de una venta pagada y guarda el CAE
+    
+    Corre como tarea de fondo del webhook, con su propia sesión (la del
+    request ya está cerrada). Un error no afecta al pago: queda en el log
+    para reintentar con POST /payments/facturar/{venta_id}.
+    """
+    try:
+        factura_data = await asyncio.to_thread(
+            afip_service.emitir_factura,
+            venta_id=venta_id,
+            cuit_cliente=None,  # TODO: Obtener del cliente
+            monto=monto
+        )
+        
+        if not factura_data.get("cae"):
+            logger.error(f"AFIP no devolvió CAE para la venta {venta_id}: {factura_data}")
+            return
+        
+        async with AsyncSessionLocal() as session:
+            venta = await session.get(Venta, venta_id)
+            venta.afip_cae = factura_data["cae"]
+            venta.afip_cae_vto = datetime.strptime(factura_data["vto"], "%Y-%m-%d")
+            session.add(venta)
+            await session.commit()
+        
+        logger.info(f"Factura AFIP emitida: CAE {factura_data['cae']}")
+    
+    except Exception as afip_error:
+        logger.error(
+            f"Error al emitir factura AFIP para venta {venta_id}: {str(afip_error)}",
+            exc_info=True
+        )
+
+
+async def _procesar_pago_background(payment_id: str) -> None:
+    """
+    Procesa una notificación de pago ya aceptada por el webhook
+    
+    Consulta el pago en MercadoPago, marca la venta como pagada y emite la
+    factura AFIP. Corre después de responder 200 a MercadoPago, con su propia
+    sesión; los errores quedan en el log.
+    """
+    try:
+        logger.info(f"Consultando información de pago: {payment_id}")
+        payment_info = await asyncio.to_thread(payment_service.get_payment_info, payment_id)
+        
+        # Extraer datos relevantes
+        status_pago_mp = payment_info.get("status")
+        external_reference = payment_info.get("external_reference")
+        
+        logger.info(f"Estado del pago: {status_pago_mp}")
+        logger.info(f"Referencia externa (venta_id): {external_reference}")
+        
+        # Solo procesar si está aprobado
+        if status_pago_mp != "approved" or not external_reference:
+            return
+        
+        try:
+            venta_id = UUID(external_reference)
+        except ValueError:
+            logger.error(f"External reference inválido: {external_reference}")
+            return
+        
+        async with AsyncSessionLocal() as session:
+            # UPDATE condicional atómico: de dos notificaciones concurrentes solo
+            # una encuentra la venta sin pagar, así la factura se emite una vez
+            result = await session.execute(
+                update(Venta)
+                .where(Venta.id == venta_id, Venta.status_pago != "pagado")
+                .values(status_pago="pagado", payment_id=payment_id)
+                .returning(Venta.total)
+                .execution_options(synchronize_session=False)
+            )
+            monto = result.scalar_one_or_none()
+            await session.commit()
+        
+        if monto is None:
+            logger.warning(f"Venta {venta_id} no encontrada o ya pagada")
+            return
+        
+        logger.info(f"Venta {venta_id} marcada como pagada")
+        
+        await _emitir_factura_background(venta_id=venta_id, monto=monto)
+    
+    except Exception as e:
+        logger.error(f"Error procesando pago {payment_id}: {str(e)}", exc_info=True)
+
 
 @router.post("/generate/{venta_id}")
 async def generar_pago(
@@ -30,8 +152,8 @@ async def generar_pago(
     Genera un link de pago o QR de Mercado Pago para una venta
     
     Flujo:
-    1. Valida que la venta exista y pertenezca a la tienda
-    2. Obtiene los detalles de la venta
+    1. Obtiene la venta y sus detalles en una sola consulta
+    2. Valida que la venta exista, pertenezca a la tienda y no esté pagada/anulada
     3. Crea una preferencia en Mercado Pago
     4. Retorna el link de pago y QR para mostrar al cliente
     
@@ -41,20 +163,34 @@ async def generar_pago(
         qr_code_url: URL del código QR (si está disponible)
     """
     try:
-        # Validar que la venta existe y pertenece a la tienda
-        statement = select(Venta).where(
+        # Venta y detalles (con el nombre de cada producto) en un solo round trip:
+        # una fila por item, con los datos de la venta repetidos en cada una
+        statement = select(
+            Venta.total,
+            Venta.status_pago,
+            DetalleVenta.cantidad,
+            DetalleVenta.precio_unitario,
+            Producto.nombre
+        ).outerjoin(
+            DetalleVenta, DetalleVenta.venta_id == Venta.id
+        ).outerjoin(
+            Producto, Producto.id == DetalleVenta.producto_id
+        ).where(
             Venta.id == venta_id,
             Venta.tienda_id == current_tienda.id
         )
         result = await session.execute(statement)
-        venta = result.scalar_one_or_none()
+        filas = result.all()
         
-        if not venta:
+        # Validar que la venta existe y pertenece a la tienda
+        if not filas:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Venta no encontrada"
             )
         
+        venta = filas[0]
+        
         # Validar que no esté ya pagada
         if venta.status_pago == "pagado":
             raise HTTPException(
@@ -68,18 +204,14 @@ async def generar_pago(
                 detail="Esta venta fue anulada"
             )
         
-        # Obtener detalles de la venta para MercadoPago
-        statement_detalles = select(DetalleVenta).where(
-            DetalleVenta.venta_id == venta_id
-        )
-        result_detalles = await session.execute(statement_detalles)
-        detalles = result_detalles.scalars().all()
+        # Una venta sin items produce una única fila con los detalles en NULL
+        detalles = [fila for fila in filas if fila.cantidad is not None]
         
         # Preparar items en formato MercadoPago
         items_mp = []
         for detalle in detalles:
             items_mp.append({
-                "title": f"Producto ID: {detalle.producto_id}",  # TODO: Cargar nombre real del producto
+                "title": detalle.nombre,
                 "quantity": int(detalle.cantidad),
                 "unit_price": float(detalle.precio_unitario),
                 "currency_id": "ARS"
@@ -88,7 +220,10 @@ async def generar_pago(
         # Crear preferencia en MercadoPago
         logger.info(f"Generando preferencia de pago para venta {venta_id}")
         
-        preference_data = payment_service.create_preference(
+        # Los SDKs de MercadoPago y AFIP son bloqueantes: se ejecutan en el
+        # threadpool para no frenar el event loop durante la llamada HTTP/SOAP
+        preference_data = await asyncio.to_thread(
+            payment_service.create_preference,
             venta_id=venta_id,
             total=venta.total,
             items=items_mp,
@@ -124,7 +259,7 @@ async def generar_pago(
 @router.post("/webhook", status_code=status.HTTP_200_OK)
 async def webhook_mercadopago(
     request: Request,
-    session: Annotated[AsyncSession, Depends(get_session)],
+    background_tasks: BackgroundTasks,
     x_signature: Optional[str] = Header(None),
     x_request_id: Optional[str] = Header(None)
 ) -> Dict[str, str]:
@@ -140,11 +275,10 @@ async def webhook_mercadopago(
     
     Flujo:
     1. Recibe notificación de MercadoPago
-    2. Valida firma (opcional pero recomendado)
-    3. Consulta el estado del pago
-    4. Actualiza la venta en base de datos
-    5. Emite factura AFIP si corresponde
-    6. Responde 200 OK inmediatamente
+    2. Valida firma, timestamp y que no sea un reenvío
+    3. Encola el procesamiento del pago y responde 200 OK inmediatamente
+    4. Después de responder: consulta el estado del pago, actualiza la
+       venta y emite la factura AFIP
     
     Documentación:
     https://www.mercadopago.com.ar/developers/es/docs/your-integrations/notifications/webhooks
@@ -157,12 +291,19 @@ async def webhook_mercadopago(
         logger.info(f"X-Signature: {x_signature}")
         logger.info(f"X-Request-ID: {x_request_id}")
         
-        # Validar firma (si está configurado)
-        if x_signature and not payment_service.validate_webhook_signature(webhook_data, x_signature):
+        # Validar firma (obligatoria si MERCADOPAGO_WEBHOOK_SECRET está configurado).
+        # MercadoPago firma el data.id que envía en la query string
+        data_id = request.query_params.get("data.id") or webhook_data.get("data", {}).get("id")
+        if not payment_service.validate_webhook_signature(data_id, x_request_id, x_signature):
             logger.warning("Firma del webhook inválida")
             # Aún así respondemos 200 para no bloquear MercadoPago
             return {"status": "received", "warning": "invalid_signature"}
         
+        # Descartar reenvíos de una notificación ya procesada
+        if x_request_id and await _es_webhook_duplicado(x_request_id):
+            logger.warning(f"Webhook duplicado descartado: {x_request_id}")
+            return {"status": "received", "warning": "duplicate"}
+        
         # Extraer información del webhook
         notification_type = webhook_data.get("type")
         
@@ -174,68 +315,15 @@ async def webhook_mercadopago(
                 logger.warning("Webhook sin payment_id")
                 return {"status": "received", "warning": "no_payment_id"}
             
-            # Consultar información completa del pago
-            logger.info(f"Consultando información de pago: {payment_id}")
-            payment_info = payment_service.get_payment_info(str(payment_id))
-            
-            # Extraer datos relevantes
-            status_pago_mp = payment_info.get("status")
-            external_reference = payment_info.get("external_reference")
-            
-            logger.info(f"Estado del pago: {status_pago_mp}")
-            logger.info(f"Referencia externa (venta_id): {external_reference}")
-            
-            # Solo procesar si está aprobado
-            if status_pago_mp == "approved" and external_reference:
-                try:
-                    venta_id = UUID(external_reference)
-                    
-                    # Buscar la venta
-                    statement = select(Venta).where(Venta.id == venta_id)
-                    result = await session.execute(statement)
-                    venta = result.scalar_one_or_none()
-                    
-                    if venta:
-                        # Actualizar estado de pago
-                        venta.status_pago = "pagado"
-                        venta.payment_id = str(payment_id)
-                        
-                        session.add(venta)
-                        await session.commit()
-                        
-                        logger.info(f"Venta {venta_id} marcada como pagada")
-                        
-                        # TODO: Emitir factura AFIP automáticamente (opcional)
-                        try:
-                            factura_data = afip_service.emitir_factura(
-                                venta_id=venta_id,
-                                cuit_cliente=None,  # TODO: Obtener del cliente
-                                monto=venta.total
-                            )
-                            
-                            if factura_data.get("cae"):
-                                venta.afip_cae = factura_data["cae"]
-                                venta.afip_cae_vto = datetime.strptime(factura_data["vto"], "%Y-%m-%d")
-                                session.add(venta)
-                                await session.commit()
-                                
-                                logger.info(f"Factura AFIP emitida: CAE {factura_data['cae']}")
-                        
-                        except Exception as afip_error:
-                            logger.error(f"Error al emitir factura AFIP: {str(afip_error)}")
-                            # No bloqueamos el webhook por error de facturación
-                    
-                    else:
-                        logger.warning(f"Venta {venta_id} no encontrada")
-                
-                except ValueError:
-                    logger.error(f"External reference inválido: {external_reference}")
+            # MercadoPago solo necesita el 200: la consulta del pago, la
+            # actualización de la venta y la factura corren después de responder
+            background_tasks.add_task(_procesar_pago_background, str(payment_id))
         
         elif notification_type == "merchant_order":
             logger.info("Notificación de merchant_order recibida (no procesada)")
         
         # SIEMPRE responder 200 OK para que MercadoPago no reintente
-        return {"status": "received", "message": "Webhook procesado"}
+        return {"status": "received", "message": "Webhook recibido"}
     
     except Exception as e:
         logger.error(f"Error procesando webhook: {str(e)}", exc_info=True)
@@ -255,14 +343,10 @@ async def consultar_estado_pago(
     
     Útil para polling desde el frontend mientras espera la confirmación
     """
-    statement = select(Venta).where(
-        Venta.id == venta_id,
-        Venta.tienda_id == current_tienda.id
-    )
-    result = await session.execute(statement)
-    venta = result.scalar_one_or_none()
+    # Lookup por PK (identity map); la pertenencia a la tienda se valida después
+    venta = await session.get(Venta, venta_id)
     
-    if not venta:
+    if not venta or venta.tienda_id != current_tienda.id:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Venta no encontrada"
@@ -293,14 +377,9 @@ async def emitir_factura_manual(
     """
     try:
         # Buscar venta
-        statement = select(Venta).where(
-            Venta.id == venta_id,
-            Venta.tienda_id == current_tienda.id
-        )
-        result = await session.execute(statement)
-        venta = result.scalar_one_or_none()
+        venta = await session.get(Venta, venta_id)
         
-        if not venta:
+        if not venta or venta.tienda_id != current_tienda.id:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Venta no encontrada"
@@ -316,7 +395,8 @@ async def emitir_factura_manual(
         # Emitir factura
         logger.info(f"Emitiendo factura manual para venta {venta_id}")
         
-        factura_data = afip_service.emitir_factura(
+        factura_data = await asyncio.to_thread(
+            afip_service.emitir_factura,
             venta_id=venta_id,
             cuit_cliente=cuit_cliente,
             monto=venta.total,
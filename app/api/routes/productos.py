@@ -4,13 +4,25 @@ CRUD completo con filtrado Multi-Tenant y polimorfismo
 """
 from typing import Annotated, Optional, List
 from uuid import UUID
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
+from fastapi.responses import ORJSONResponse
+from pydantic import TypeAdapter
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlmodel import select, col, and_, or_, func
+from sqlalchemy import lambda_stmt, literal_column
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import raiseload
+from sqlmodel import select, col, and_, func
 from app.core.db import get_session
-from app.core.cache import invalidate_cache
+from app.core.cache import (
+    cache_manager,
+    etag_matches,
+    generate_etag,
+    get_cache_version,
+    invalidate_cache
+)
 import logging
-from app.models import Producto, Tienda
+from app.models import Producto, Tienda, PRODUCTO_SEARCH_VECTOR_SQL
 from app.schemas_models.productos import (
     ProductoCreate,
     ProductoUpdate,
@@ -23,18 +35,61 @@ from app.api.deps import CurrentTienda
 router = APIRouter(prefix="/productos", tags=["Productos"])
 logger = logging.getLogger(__name__)
 
+# TTL del caché en proceso de listados y búsquedas por SKU (la clave incluye la
+# versión del catálogo, así que una modificación nunca sirve datos viejos)
+PRODUCTOS_CACHE_TTL_SECONDS = 30
+
+# Expresión de texto completo idéntica a la del índice ix_productos_busqueda_fts
+# (se renderiza literal: con parámetros el planner no reconoce el índice)
+_TS_CONFIG = literal_column("'spanish'::regconfig")
+_SEARCH_VECTOR = literal_column(PRODUCTO_SEARCH_VECTOR_SQL, type_=TSVECTOR)
+
+# Los schemas de lectura no usan relaciones (tienda, detalles_venta): cualquier
+# acceso accidental falla explícito en vez de disparar un lazy load por fila
+_SIN_RELACIONES = raiseload("*")
+
+# Serializador de listados (el schema se compila una sola vez al importar)
+_LISTA_PRODUCTOS_ADAPTER = TypeAdapter(List[ProductoReadWithCalculatedStock])
+
+# Constraint UNIQUE (tienda_id, sku) de la tabla productos
+SKU_UNIQUE_CONSTRAINT = "uq_producto_tienda_sku"
+
 
-def calcular_stock_ropa(producto: Producto) -> float:
+async def _etag_productos(tienda_id: UUID, *params) -> str:
+    """ETag de una consulta de productos: versión del catálogo de la tienda + parámetros"""
+    version = await get_cache_version(f"productos:{tienda_id}")
+    return generate_etag(tienda_id, version, *params)
+
+
+async def _commit_validando_sku(session: AsyncSession, sku: str) -> None:
+    """
+    Confirma la transacción traduciendo un SKU duplicado en la tienda a un 400
+    
+    La unicidad la valida la BD al escribir (sin SELECT previo ni carrera entre
+    requests concurrentes)
+    """
+    try:
+        await session.commit()
+    except IntegrityError as e:
+        await session.rollback()
+        if SKU_UNIQUE_CONSTRAINT not in str(e.orig):
+            raise
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Ya existe un producto con SKU '{sku}' en esta tienda"
+        ) from e
+
+
+def calcular_stock_variantes(atributos: Optional[dict]) -> float:
     """
     Calcula el stock total de un producto tipo ropa
     sumando el stock de todas sus variantes
-    """
-    if producto.tipo != 'ropa':
-        return producto.stock_actual
     
-    variantes = producto.atributos.get('variantes', [])
-    stock_total = sum(variante.get('stock', 0) for variante in variantes)
-    return float(stock_total)
+    Se usa solo al escribir (crear/actualizar): para productos tipo ropa
+    stock_actual es la fuente de verdad y los listados lo devuelven tal cual
+    """
+    variantes = (atributos or {}).get('variantes', [])
+    return float(sum(variante.get('stock', 0) for variante in variantes))
 
 
 @router.post("/", response_model=ProductoRead, status_code=status.HTTP_201_CREATED)
@@ -48,40 +103,25 @@ async def crear_producto(
     
     - Asigna automáticamente el tienda_id de la tienda actual
     - Para productos tipo 'ropa', calcula el stock_actual desde las variantes
-    - Valida que el SKU no esté duplicado en la tienda
+    - Valida que el SKU no esté duplicado en la tienda (constraint de BD)
     """
-    # Validar SKU único dentro de la tienda
-    statement = select(Producto).where(
-        Producto.tienda_id == current_tienda.id,
-        Producto.sku == producto_data.sku
-    )
-    result = await session.execute(statement)
-    existing_producto = result.scalar_one_or_none()
-    
-    if existing_producto is not None:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Ya existe un producto con SKU '{producto_data.sku}' en esta tienda"
-        )
-    
     # Crear producto
     producto_dict = producto_data.model_dump()
     producto_dict['tienda_id'] = current_tienda.id
     
     # Calcular stock automáticamente para productos tipo ropa
     if producto_data.tipo == 'ropa':
-        variantes = producto_data.atributos.get('variantes', [])
-        stock_total = sum(variante.get('stock', 0) for variante in variantes)
-        producto_dict['stock_actual'] = float(stock_total)
+        producto_dict['stock_actual'] = calcular_stock_variantes(producto_data.atributos)
     
     nuevo_producto = Producto(**producto_dict)
     
     session.add(nuevo_producto)
-    await session.commit()
+    # SKU único por tienda: lo garantiza la constraint uq_producto_tienda_sku
+    await _commit_validando_sku(session, producto_data.sku)
     await session.refresh(nuevo_producto)
     
     # Invalidar caché
-    invalidate_cache(f"productos:{current_tienda.id}")
+    await invalidate_cache(f"productos:{current_tienda.id}")
     logger.info(f"Producto creado: {nuevo_producto.id} - {nuevo_producto.nombre}")
     
     return nuevo_producto
@@ -91,7 +131,7 @@ async def crear_producto(
 async def buscar_productos_avanzado(
     current_tienda: CurrentTienda,
     session: Annotated[AsyncSession, Depends(get_session)],
-    q: Optional[str] = Query(None, description="Búsqueda por nombre o SKU"),
+    q: Optional[str] = Query(None, description="Búsqueda de texto en nombre, SKU o descripción"),
     tipo: Optional[str] = Query(None, description="Filtrar por tipo"),
     precio_min: Optional[float] = Query(None, ge=0),
     precio_max: Optional[float] = Query(None, ge=0),
@@ -99,12 +139,12 @@ async def buscar_productos_avanzado(
     solo_activos: bool = Query(True),
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=100)
-) -> dict:
+):
     """
     Búsqueda avanzada de productos con múltiples filtros
     
     Filtros disponibles:
-    - q: Búsqueda por nombre o SKU (case-insensitive)
+    - q: Búsqueda de texto completo (sintaxis web: "remera -negra"), ordenada por relevancia
     - tipo: Filtrar por tipo de producto
     - precio_min/max: Rango de precios
     - stock_min: Stock mínimo
@@ -112,20 +152,19 @@ async def buscar_productos_avanzado(
     
     Retorna: items, total, paginación
     """
+    # Filtro Multi-Tenant explícito (deps._filtrar_por_tienda queda como respaldo)
     conditions = [Producto.tienda_id == current_tienda.id]
+    order_by = []
     
     if solo_activos:
         conditions.append(Producto.is_active == True)
     
     if q:
-        search_pattern = f"%{q.lower()}%"
-        conditions.append(
-            or_(
-                col(Producto.nombre).ilike(search_pattern),
-                col(Producto.sku).ilike(search_pattern),
-                col(Producto.descripcion).ilike(search_pattern)
-            )
-        )
+        # Una sola probe al índice GIN ix_productos_busqueda_fts, con stemming
+        # en español y resultados ordenados por relevancia
+        ts_query = func.websearch_to_tsquery(_TS_CONFIG, q)
+        conditions.append(_SEARCH_VECTOR.op('@@')(ts_query))
+        order_by = [func.ts_rank_cd(_SEARCH_VECTOR, ts_query).desc(), Producto.nombre]
     
     if tipo:
         conditions.append(Producto.tipo == tipo)
@@ -139,36 +178,47 @@ async def buscar_productos_avanzado(
     if stock_min is not None:
         conditions.append(Producto.stock_actual >= stock_min)
     
-    stmt = select(Producto).where(and_(*conditions)).offset(skip).limit(limit)
+    # El total para paginación viaja en cada fila (window function): una sola consulta
+    stmt = select(
+        Producto,
+        func.count().over().label('total')
+    ).options(_SIN_RELACIONES).where(and_(*conditions)).order_by(
+        *order_by
+    ).offset(skip).limit(limit)
     result = await session.execute(stmt)
-    productos = result.scalars().all()
-    
-    # Contar total para paginación
-    count_stmt = select(func.count(Producto.id)).where(and_(*conditions))
-    count_result = await session.execute(count_stmt)
-    total = count_result.scalar()
-    if total is None:
+    rows = result.all()
+    productos = [producto for producto, _ in rows]
+    
+    if rows:
+        total = rows[0].total
+    elif skip > 0:
+        # Página fuera de rango: el total no viene en ninguna fila
+        count_stmt = select(func.count(Producto.id)).where(and_(*conditions))
+        total = await session.scalar(count_stmt) or 0
+    else:
         total = 0
     
-    # Procesar productos con stock calculado
+    # Procesar productos con stock calculado (una sola validación por fila)
     productos_response = []
     for producto in productos:
-        producto_dict = ProductoReadWithCalculatedStock.model_validate(producto).model_dump()
+        producto_dict = ProductoReadWithCalculatedStock.model_validate(producto).model_dump(mode="json")
         if producto.tipo == 'ropa':
-            producto_dict['stock_calculado'] = calcular_stock_ropa(producto)
+            producto_dict['stock_calculado'] = producto.stock_actual
         productos_response.append(producto_dict)
     
-    return {
+    # Respuesta directa: evita la revalidación y el jsonable_encoder de FastAPI
+    return ORJSONResponse({
         "items": productos_response,
         "total": total,
         "skip": skip,
         "limit": limit,
         "has_more": (skip + limit) < total
-    }
+    })
 
 
 @router.get("/", response_model=List[ProductoReadWithCalculatedStock])
 async def listar_productos(
+    request: Request,
     current_tienda: CurrentTienda,
     session: Annotated[AsyncSession, Depends(get_session)],
     skip: int = Query(0, ge=0),
@@ -176,7 +226,7 @@ async def listar_productos(
     search: Optional[str] = Query(None, description="Buscar por SKU o nombre"),
     tipo: Optional[str] = Query(None, pattern="^(general|ropa|pesable)$"),
     is_active: Optional[bool] = None
-) -> List[ProductoReadWithCalculatedStock]:
+):
     """
     Lista productos de la tienda actual con filtros opcionales
     
@@ -184,41 +234,65 @@ async def listar_productos(
     - search: Busca por SKU o nombre (case-insensitive)
     - tipo: Filtra por tipo de producto
     - is_active: Filtra por productos activos/inactivos
+    
+    Responde con ETag según la versión del catálogo: con If-None-Match
+    vigente retorna 304 sin consultar la BD
     """
-    # Base query con filtro Multi-Tenant
-    statement = select(Producto).where(Producto.tienda_id == current_tienda.id)
-    
-    # Aplicar filtros opcionales
-    if search:
-        search_pattern = f"%{search}%"
-        statement = statement.where(
-            (col(Producto.sku).ilike(search_pattern)) |
-            (col(Producto.nombre).ilike(search_pattern))
+    etag = await _etag_productos(current_tienda.id, "listar", skip, limit, search, tipo, is_active)
+    headers = {"ETag": etag}
+    
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    # El ETag identifica la versión del catálogo y los filtros: sirve como clave
+    cache_key = f"productos:{current_tienda.id}:listar_productos:{etag}"
+    contenido = cache_manager.get(cache_key)
+    
+    if contenido is None:
+        # Base query con filtro Multi-Tenant. lambda_stmt cachea el SQL compilado
+        # por sitio de llamada: cada request solo aporta los valores de los parámetros
+        tienda_id = current_tienda.id
+        statement = lambda_stmt(
+            lambda: select(Producto)
+            .options(raiseload("*"))
+            .where(Producto.tienda_id == tienda_id)
         )
-    
-    if tipo:
-        statement = statement.where(Producto.tipo == tipo)
-    
-    if is_active is not None:
-        statement = statement.where(Producto.is_active == is_active)
-    
-    # Paginación
-    statement = statement.offset(skip).limit(limit)
-    
-    result = await session.execute(statement)
-    productos = result.scalars().all()
-    
-    # Agregar stock calculado para productos tipo ropa
-    productos_response = []
-    for producto in productos:
-        producto_dict = ProductoReadWithCalculatedStock.model_validate(producto).model_dump()
         
-        if producto.tipo == 'ropa':
-            producto_dict['stock_calculado'] = calcular_stock_ropa(producto)
+        # Aplicar filtros opcionales
+        if search:
+            search_pattern = f"%{search}%"
+            statement += lambda s: s.where(
+                (col(Producto.sku).ilike(search_pattern)) |
+                (col(Producto.nombre).ilike(search_pattern))
+            )
         
-        productos_response.append(ProductoReadWithCalculatedStock(**producto_dict))
+        if tipo:
+            statement += lambda s: s.where(Producto.tipo == tipo)
+        
+        if is_active is not None:
+            statement += lambda s: s.where(Producto.is_active == is_active)
+        
+        # Paginación
+        statement += lambda s: s.offset(skip).limit(limit)
+        
+        result = await session.execute(statement)
+        productos = result.scalars().all()
+        
+        # Agregar stock calculado para productos tipo ropa
+        productos_response = []
+        for producto in productos:
+            producto_read = ProductoReadWithCalculatedStock.model_validate(producto)
+            
+            if producto.tipo == 'ropa':
+                producto_read.stock_calculado = producto.stock_actual
+            
+            productos_response.append(producto_read)
+        
+        # Serialización directa a bytes con pydantic-core; se cachean los bytes
+        contenido = _LISTA_PRODUCTOS_ADAPTER.dump_json(productos_response)
+        cache_manager.set(cache_key, contenido, PRODUCTOS_CACHE_TTL_SECONDS)
     
-    return productos_response
+    return Response(content=contenido, media_type="application/json", headers=headers)
 
 
 @router.get("/{producto_id}", response_model=ProductoReadWithCalculatedStock)
@@ -226,30 +300,27 @@ async def obtener_producto(
     producto_id: UUID,
     current_tienda: CurrentTienda,
     session: Annotated[AsyncSession, Depends(get_session)]
-) -> ProductoReadWithCalculatedStock:
+):
     """
     Obtiene un producto específico por ID
     Valida que pertenezca a la tienda actual (Multi-Tenant)
     """
-    statement = select(Producto).where(
-        Producto.id == producto_id,
-        Producto.tienda_id == current_tienda.id
-    )
-    result = await session.execute(statement)
-    producto = result.scalar_one_or_none()
+    # Lookup por PK (identity map); la pertenencia a la tienda se valida después
+    producto = await session.get(Producto, producto_id, options=[_SIN_RELACIONES])
     
-    if not producto:
+    if not producto or producto.tienda_id != current_tienda.id:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Producto no encontrado"
         )
     
-    producto_dict = ProductoReadWithCalculatedStock.model_validate(producto).model_dump()
+    producto_read = ProductoReadWithCalculatedStock.model_validate(producto)
     
     if producto.tipo == 'ropa':
-        producto_dict['stock_calculado'] = calcular_stock_ropa(producto)
+        producto_read.stock_calculado = producto.stock_actual
     
-    return ProductoReadWithCalculatedStock(**producto_dict)
+    # Ya validado: se serializa directo sin que FastAPI lo vuelva a validar
+    return Response(content=producto_read.model_dump_json(), media_type="application/json")
 
 
 @router.patch("/{producto_id}", response_model=ProductoRead)
@@ -280,37 +351,27 @@ async def actualizar_producto(
             detail="Producto no encontrado"
         )
     
-    # Validar SKU único si se está actualizando
-    if producto_update.sku and producto_update.sku != producto.sku:
-        statement = select(Producto).where(
-            Producto.tienda_id == current_tienda.id,
-            Producto.sku == producto_update.sku
-        )
-        sku_check_result = await session.execute(statement)
-        existing_producto = sku_check_result.scalar_one_or_none()
-        
-        if existing_producto is not None:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Ya existe un producto con SKU '{producto_update.sku}' en esta tienda"
-            )
-    
     # Actualizar campos
     update_data = producto_update.model_dump(exclude_unset=True)
     
     # Recalcular stock para productos tipo ropa si se actualizan atributos
-    if 'atributos' in update_data and producto.tipo == 'ropa':
-        variantes = update_data['atributos'].get('variantes', [])
-        stock_total = sum(variante.get('stock', 0) for variante in variantes)
-        update_data['stock_actual'] = float(stock_total)
+    # (o si el producto pasa a ser tipo ropa en este mismo PATCH)
+    tipo_final = update_data.get('tipo') or producto.tipo
+    if tipo_final == 'ropa' and ('atributos' in update_data or 'tipo' in update_data):
+        update_data['stock_actual'] = calcular_stock_variantes(
+            update_data.get('atributos', producto.atributos)
+        )
     
     for key, value in update_data.items():
         setattr(producto, key, value)
     
     session.add(producto)
-    await session.commit()
+    # SKU único por tienda: lo garantiza la constraint uq_producto_tienda_sku
+    await _commit_validando_sku(session, producto.sku)
     await session.refresh(producto)
     
+    await invalidate_cache(f"productos:{current_tienda.id}")
+    
     return producto
 
 
@@ -341,35 +402,56 @@ async def eliminar_producto(
     producto.is_active = False
     session.add(producto)
     await session.commit()
+    
+    await invalidate_cache(f"productos:{current_tienda.id}")
 
 
 @router.get("/sku/{sku}", response_model=ProductoReadWithCalculatedStock)
 async def buscar_por_sku(
     sku: str,
+    request: Request,
     current_tienda: CurrentTienda,
     session: Annotated[AsyncSession, Depends(get_session)]
-) -> ProductoReadWithCalculatedStock:
+):
     """
     Busca un producto por SKU dentro de la tienda actual
     Útil para sistemas de punto de venta con escáner de códigos
-    """
-    statement = select(Producto).where(
-        Producto.sku == sku,
-        Producto.tienda_id == current_tienda.id,
-        Producto.is_active == True
-    )
-    result = await session.execute(statement)
-    producto = result.scalar_one_or_none()
     
-    if not producto:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"No se encontró un producto con SKU '{sku}'"
+    Responde con ETag según la versión del catálogo (304 si no cambió)
+    """
+    etag = await _etag_productos(current_tienda.id, "sku", sku)
+    headers = {"ETag": etag}
+    
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    cache_key = f"productos:{current_tienda.id}:buscar_por_sku:{etag}"
+    contenido = cache_manager.get(cache_key)
+    
+    if contenido is None:
+        tienda_id = current_tienda.id
+        statement = lambda_stmt(
+            lambda: select(Producto).options(raiseload("*")).where(
+                Producto.sku == sku,
+                Producto.tienda_id == tienda_id,
+                Producto.is_active == True
+            )
         )
+        result = await session.execute(statement)
+        producto = result.scalar_one_or_none()
+        
+        if not producto:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"No se encontró un producto con SKU '{sku}'"
+            )
+        
+        producto_read = ProductoReadWithCalculatedStock.model_validate(producto)
+        
+        if producto.tipo == 'ropa':
+            producto_read.stock_calculado = producto.stock_actual
+        
+        contenido = producto_read.model_dump_json().encode()
+        cache_manager.set(cache_key, contenido, PRODUCTOS_CACHE_TTL_SECONDS)
     
-    producto_dict = ProductoReadWithCalculatedStock.model_validate(producto).model_dump()
-    
-    if producto.tipo == 'ropa':
-        producto_dict['stock_calculado'] = calcular_stock_ropa(producto)
-    
-    return ProductoReadWithCalculatedStock(**producto_dict)
+    return Response(content=contenido, media_type="application/json", headers=headers)
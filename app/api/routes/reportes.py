@@ -1,16 +1,21 @@
 """
 Reportes y Analytics - Nexus POS
 Endpoints para generación de reportes de negocio
+
+Los agregados se leen de las vistas materializadas diarias de reportes_service:
+los rangos de fechas se aplican por día y los datos pueden tener hasta
+REPORTES_REFRESH_SECONDS de atraso.
 """
 import logging
 from typing import Annotated, List, Optional
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta, timezone
 from uuid import UUID
 from fastapi import APIRouter, Depends, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, and_, desc
+from sqlalchemy import select, func, and_, case, desc
 from app.core.db import get_session
-from app.models import Venta, DetalleVenta, Producto
+from app.models import Producto
+from app.services.reportes_service import mv_ventas_diarias, mv_productos_vendidos_diarios
 from app.api.deps import CurrentTienda
 from pydantic import BaseModel, Field
 
@@ -32,7 +37,7 @@ class ProductoMasVendido(BaseModel):
     
 class VentasPorPeriodo(BaseModel):
     """Schema para ventas por período"""
-    fecha: str
+    fecha: date
     cantidad_ventas: int
     total_vendido: float
     ticket_promedio: float
@@ -59,6 +64,18 @@ class RentabilidadProducto(BaseModel):
     margen_porcentaje: float
 
 
+def _dia_utc(fecha: datetime) -> date:
+    """
+    Día UTC de una fecha, como lo agrupan las vistas materializadas
+    
+    Las fechas con zona horaria se pasan a UTC antes de truncar; las que
+    llegan sin zona se toman como UTC
+    """
+    if fecha.tzinfo is not None:
+        fecha = fecha.astimezone(timezone.utc)
+    return fecha.date()
+
+
 # === ENDPOINTS ===
 
 @router.get("/ventas/resumen", response_model=ResumenVentas)
@@ -80,41 +97,46 @@ async def obtener_resumen_ventas(
     """
     # Defaults de fechas
     if fecha_hasta is None:
-        fecha_hasta = datetime.utcnow()
+        fecha_hasta = datetime.now(timezone.utc)
     if fecha_desde is None:
         fecha_desde = fecha_hasta - timedelta(days=30)
     
     logger.info(f"Generando resumen de ventas para tienda {current_tienda.id} desde {fecha_desde} hasta {fecha_hasta}")
     
+    # Agregados diarios precalculados (vistas materializadas de reportes_service)
+    ventas_dia = mv_ventas_diarias.c
+    productos_dia = mv_productos_vendidos_diarios.c
+    dia_desde = _dia_utc(fecha_desde)
+    dia_hasta = _dia_utc(fecha_hasta)
+    
     # Query principal de ventas
     stmt = select(
-        func.count(Venta.id).label('total_ventas'),
-        func.sum(Venta.total).label('monto_total'),
-        func.avg(Venta.total).label('ticket_promedio')
+        func.sum(ventas_dia.cantidad_ventas).label('total_ventas'),
+        func.sum(ventas_dia.monto_total).label('monto_total')
     ).where(
         and_(
-            Venta.tienda_id == current_tienda.id,
-            Venta.fecha >= fecha_desde,
-            Venta.fecha <= fecha_hasta,
-            Venta.status_pago == 'pagado'
+            ventas_dia.tienda_id == current_tienda.id,
+            ventas_dia.dia >= dia_desde,
+            ventas_dia.dia <= dia_hasta
         )
     )
     
     result = await session.execute(stmt)
     row = result.one()
+    total_ventas = row.total_ventas or 0
+    monto_total = float(row.monto_total or 0)
     
     # Método de pago más usado
     stmt_metodo = select(
-        Venta.metodo_pago,
-        func.count(Venta.id).label('count')
+        ventas_dia.metodo_pago,
+        func.sum(ventas_dia.cantidad_ventas).label('count')
     ).where(
         and_(
-            Venta.tienda_id == current_tienda.id,
-            Venta.fecha >= fecha_desde,
-            Venta.fecha <= fecha_hasta,
-            Venta.status_pago == 'pagado'
+            ventas_dia.tienda_id == current_tienda.id,
+            ventas_dia.dia >= dia_desde,
+            ventas_dia.dia <= dia_hasta
         )
-    ).group_by(Venta.metodo_pago).order_by(desc('count')).limit(1)
+    ).group_by(ventas_dia.metodo_pago).order_by(desc('count')).limit(1)
     
     result_metodo = await session.execute(stmt_metodo)
     metodo_row = result_metodo.first()
@@ -123,19 +145,16 @@ async def obtener_resumen_ventas(
     # Producto más vendido
     stmt_producto = select(
         Producto.nombre,
-        func.sum(DetalleVenta.cantidad).label('total')
+        func.sum(productos_dia.cantidad_vendida).label('total')
     ).join(
-        DetalleVenta, Producto.id == DetalleVenta.producto_id
-    ).join(
-        Venta, DetalleVenta.venta_id == Venta.id
+        Producto, Producto.id == productos_dia.producto_id
     ).where(
         and_(
-            Venta.tienda_id == current_tienda.id,
-            Venta.fecha >= fecha_desde,
-            Venta.fecha <= fecha_hasta,
-            Venta.status_pago == 'pagado'
+            productos_dia.tienda_id == current_tienda.id,
+            productos_dia.dia >= dia_desde,
+            productos_dia.dia <= dia_hasta
         )
-    ).group_by(Producto.nombre).order_by(desc('total')).limit(1)
+    ).group_by(Producto.id, Producto.nombre).order_by(desc('total')).limit(1)
     
     result_producto = await session.execute(stmt_producto)
     producto_row = result_producto.first()
@@ -144,9 +163,9 @@ async def obtener_resumen_ventas(
     return ResumenVentas(
         periodo_inicio=fecha_desde,
         periodo_fin=fecha_hasta,
-        total_ventas=row.total_ventas or 0,
-        monto_total=float(row.monto_total or 0),
-        ticket_promedio=float(row.ticket_promedio or 0),
+        total_ventas=total_ventas,
+        monto_total=monto_total,
+        ticket_promedio=monto_total / total_ventas if total_ventas else 0.0,
         metodo_pago_mas_usado=metodo_mas_usado,
         producto_mas_vendido=producto_mas_vendido
     )
@@ -170,27 +189,26 @@ async def obtener_productos_mas_vendidos(
     """
     # Defaults de fechas
     if fecha_hasta is None:
-        fecha_hasta = datetime.utcnow()
+        fecha_hasta = datetime.now(timezone.utc)
     if fecha_desde is None:
         fecha_desde = fecha_hasta - timedelta(days=30)
     
+    productos_dia = mv_productos_vendidos_diarios.c
+    
     stmt = select(
         Producto.id.label('producto_id'),
         Producto.sku,
         Producto.nombre,
-        func.sum(DetalleVenta.cantidad).label('cantidad_vendida'),
-        func.sum(DetalleVenta.subtotal).label('total_recaudado'),
-        func.count(DetalleVenta.id).label('veces_vendido')
-    ).join(
-        DetalleVenta, Producto.id == DetalleVenta.producto_id
+        func.sum(productos_dia.cantidad_vendida).label('cantidad_vendida'),
+        func.sum(productos_dia.subtotal_vendido).label('total_recaudado'),
+        func.sum(productos_dia.veces_vendido).label('veces_vendido')
     ).join(
-        Venta, DetalleVenta.venta_id == Venta.id
+        Producto, Producto.id == productos_dia.producto_id
     ).where(
         and_(
-            Venta.tienda_id == current_tienda.id,
-            Venta.fecha >= fecha_desde,
-            Venta.fecha <= fecha_hasta,
-            Venta.status_pago == 'pagado'
+            productos_dia.tienda_id == current_tienda.id,
+            productos_dia.dia >= _dia_utc(fecha_desde),
+            productos_dia.dia <= _dia_utc(fecha_hasta)
         )
     ).group_by(
         Producto.id, Producto.sku, Producto.nombre
@@ -235,62 +253,46 @@ async def analizar_rentabilidad_productos(
     - margen: Mayor porcentaje de ganancia
     - cantidad: Más vendidos
     """
+    productos_dia = mv_productos_vendidos_diarios.c
+    
+    # Métricas calculadas en SQL: se ordena y limita en la BD y solo vuelven
+    # las `limite` filas pedidas
+    cantidad_vendida = func.sum(productos_dia.cantidad_vendida)
+    ingreso_total = func.sum(productos_dia.subtotal_vendido)
+    costo_total = Producto.precio_costo * cantidad_vendida
+    utilidad_bruta = ingreso_total - costo_total
+    margen_porcentaje = case(
+        (ingreso_total > 0, utilidad_bruta * 100.0 / ingreso_total),
+        else_=0.0
+    )
+    orden_por = {
+        "utilidad": utilidad_bruta,
+        "margen": margen_porcentaje,
+        "cantidad": cantidad_vendida
+    }
+    
     stmt = select(
         Producto.id.label('producto_id'),
         Producto.nombre,
         Producto.sku,
-        Producto.precio_costo,
-        Producto.precio_venta,
-        func.sum(DetalleVenta.cantidad).label('cantidad_vendida'),
-        func.sum(DetalleVenta.subtotal).label('ingreso_total')
+        cantidad_vendida.label('cantidad_vendida'),
+        costo_total.label('costo_total'),
+        ingreso_total.label('ingreso_total'),
+        utilidad_bruta.label('utilidad_bruta'),
+        margen_porcentaje.label('margen_porcentaje')
     ).join(
-        DetalleVenta, Producto.id == DetalleVenta.producto_id
-    ).join(
-        Venta, DetalleVenta.venta_id == Venta.id
+        Producto, Producto.id == productos_dia.producto_id
     ).where(
-        and_(
-            Venta.tienda_id == current_tienda.id,
-            Venta.status_pago == 'pagado'
-        )
+        productos_dia.tienda_id == current_tienda.id
     ).group_by(
-        Producto.id, Producto.nombre, Producto.sku,
-        Producto.precio_costo, Producto.precio_venta
-    )
+        Producto.id, Producto.nombre, Producto.sku, Producto.precio_costo
+    ).order_by(
+        orden_por[orden].desc()
+    ).limit(limite)
     
     result = await session.execute(stmt)
-    rows = result.all()
     
-    # Calcular rentabilidad
-    productos_rentabilidad = []
-    for row in rows:
-        cantidad_vendida = float(row.cantidad_vendida)
-        costo_total = row.precio_costo * cantidad_vendida
-        ingreso_total = float(row.ingreso_total)
-        utilidad_bruta = ingreso_total - costo_total
-        margen_porcentaje = (utilidad_bruta / ingreso_total * 100) if ingreso_total > 0 else 0
-        
-        productos_rentabilidad.append(
-            RentabilidadProducto(
-                producto_id=row.producto_id,
-                nombre=row.nombre,
-                sku=row.sku,
-                cantidad_vendida=cantidad_vendida,
-                costo_total=costo_total,
-                ingreso_total=ingreso_total,
-                utilidad_bruta=utilidad_bruta,
-                margen_porcentaje=margen_porcentaje
-            )
-        )
-    
-    # Ordenar según parámetro
-    if orden == "utilidad":
-        productos_rentabilidad.sort(key=lambda x: x.utilidad_bruta, reverse=True)
-    elif orden == "margen":
-        productos_rentabilidad.sort(key=lambda x: x.margen_porcentaje, reverse=True)
-    elif orden == "cantidad":
-        productos_rentabilidad.sort(key=lambda x: x.cantidad_vendida, reverse=True)
-    
-    return productos_rentabilidad[:limite]
+    return [RentabilidadProducto(**row) for row in result.mappings()]
 
 
 @router.get("/ventas/tendencia-diaria", response_model=List[VentasPorPeriodo])
@@ -307,23 +309,23 @@ async def obtener_tendencia_ventas_diaria(
     - Identificar patrones de venta
     - Proyecciones de demanda
     """
-    fecha_desde = datetime.utcnow() - timedelta(days=dias)
+    fecha_desde = datetime.now(timezone.utc) - timedelta(days=dias)
+    
+    ventas_dia = mv_ventas_diarias.c
     
     stmt = select(
-        func.date(Venta.fecha).label('fecha'),
-        func.count(Venta.id).label('cantidad_ventas'),
-        func.sum(Venta.total).label('total_vendido'),
-        func.avg(Venta.total).label('ticket_promedio')
+        ventas_dia.dia.label('fecha'),
+        func.sum(ventas_dia.cantidad_ventas).label('cantidad_ventas'),
+        func.sum(ventas_dia.monto_total).label('total_vendido')
     ).where(
         and_(
-            Venta.tienda_id == current_tienda.id,
-            Venta.fecha >= fecha_desde,
-            Venta.status_pago == 'pagado'
+            ventas_dia.tienda_id == current_tienda.id,
+            ventas_dia.dia >= _dia_utc(fecha_desde)
         )
     ).group_by(
-        func.date(Venta.fecha)
+        ventas_dia.dia
     ).order_by(
-        func.date(Venta.fecha)
+        ventas_dia.dia
     )
     
     result = await session.execute(stmt)
@@ -331,10 +333,12 @@ async def obtener_tendencia_ventas_diaria(
     
     return [
         VentasPorPeriodo(
-            fecha=row.fecha.isoformat() if row.fecha else "",
+            fecha=row.fecha,
             cantidad_ventas=row.cantidad_ventas or 0,
             total_vendido=float(row.total_vendido or 0),
-            ticket_promedio=float(row.ticket_promedio or 0)
+            ticket_promedio=(
+                float(row.total_vendido) / row.cantidad_ventas if row.cantidad_ventas else 0.0
+            )
         )
         for row in rows
     ]
@@ -2,16 +2,19 @@
 Rutas de Ventas - Nexus POS
 Motor de ventas con transacciones atómicas y optimización para POS
 """
+from datetime import date, timedelta
 from typing import Annotated, List, Optional
-from uuid import UUID
+from uuid import UUID, uuid4
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import func, insert, select
 from sqlmodel import col
+from app.core.cache import invalidate_cache
 from app.core.db import get_session
 from app.models import Producto, Venta, DetalleVenta
 from app.schemas_models.ventas import (
     ProductoScanRead,
+    ScanBatchInput,
     VentaCreate,
     VentaRead,
     VentaListRead,
@@ -24,6 +27,19 @@ from app.api.deps import CurrentTienda
 router = APIRouter(prefix="/ventas", tags=["Ventas"])
 
 
+def _scan_read(producto: Producto) -> ProductoScanRead:
+    """Respuesta optimizada de escaneo: solo los datos esenciales para el frontend"""
+    return ProductoScanRead(
+        id=producto.id,
+        nombre=producto.nombre,
+        sku=producto.sku,
+        precio_venta=producto.precio_venta,
+        stock_actual=producto.stock_actual,
+        tipo=producto.tipo,
+        tiene_stock=producto.stock_actual > 0
+    )
+
+
 @router.get("/scan/{codigo}", response_model=ProductoScanRead)
 async def scan_producto(
     codigo: str,
@@ -57,16 +73,38 @@ async def scan_producto(
             detail=f"Producto con código '{codigo}' no encontrado o inactivo"
         )
     
-    # Construir respuesta optimizada
-    return ProductoScanRead(
-        id=producto.id,
-        nombre=producto.nombre,
-        sku=producto.sku,
-        precio_venta=producto.precio_venta,
-        stock_actual=producto.stock_actual,
-        tipo=producto.tipo,
-        tiene_stock=producto.stock_actual > 0
+    return _scan_read(producto)
+
+
+@router.post("/scan", response_model=List[ProductoScanRead])
+async def scan_productos_batch(
+    scan_data: ScanBatchInput,
+    current_tienda: CurrentTienda,
+    session: Annotated[AsyncSession, Depends(get_session)]
+) -> List[ProductoScanRead]:
+    """
+    ESCANEO EN LOTE
+    
+    Resuelve todos los códigos de un carrito con una sola consulta
+    (`WHERE sku IN (...)`) en lugar de una request por código.
+    
+    - Respeta el orden de los códigos recibidos
+    - Omite los códigos inexistentes o de productos inactivos
+    """
+    statement = select(Producto).where(
+        Producto.sku.in_(list(set(scan_data.codigos))),
+        Producto.tienda_id == current_tienda.id,
+        Producto.is_active == True
     )
+    
+    result = await session.execute(statement)
+    productos_por_sku = {producto.sku: producto for producto in result.scalars()}
+    
+    return [
+        _scan_read(productos_por_sku[codigo])
+        for codigo in scan_data.codigos
+        if codigo in productos_por_sku
+    ]
 
 
 @router.post("/checkout", response_model=VentaResumen, status_code=status.HTTP_201_CREATED)
@@ -80,8 +118,8 @@ async def procesar_venta(
     
     Procesa una venta completa con garantías ACID:
     
-    1. Inicia transacción de BD
-    2. Bloquea productos con SELECT FOR UPDATE (previene race conditions)
+    1. Valida existencia, estado y tipo de los productos (sin locks)
+    2. Bloquea los productos con un único SELECT FOR UPDATE (previene race conditions)
     3. Valida stock suficiente para cada item
     4. Descuenta stock de los productos
     5. Crea registros de venta y detalles con snapshot de precios
@@ -96,49 +134,76 @@ async def procesar_venta(
         detalles_a_crear = []
         productos_a_actualizar = []
         
-        # PASO 1: Validar y bloquear productos
+        producto_ids = list({item.producto_id for item in venta_data.items})
+        
+        # PASO 1: Pre-validación sin locks. Existencia, estado y tipo no dependen
+        # del stock, así que los rechazos se resuelven antes de bloquear filas
+        statement_info = select(
+            Producto.id,
+            Producto.nombre,
+            Producto.sku,
+            Producto.is_active,
+            Producto.tipo
+        ).where(
+            Producto.id.in_(producto_ids),
+            Producto.tienda_id == current_tienda.id
+        )
+        result_info = await session.execute(statement_info)
+        info_por_id = {row.id: row for row in result_info}
+        
         for item in venta_data.items:
-            # SELECT FOR UPDATE: Bloquea la fila hasta el commit
-            statement = select(Producto).where(
-                Producto.id == item.producto_id,
-                Producto.tienda_id == current_tienda.id
-            ).with_for_update()
-            
-            result = await session.execute(statement)
-            producto = result.scalar_one_or_none()
+            info = info_por_id.get(item.producto_id)
             
             # Validación 1: Producto existe y pertenece a la tienda
-            if not producto:
+            if not info:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail=f"Producto con ID {item.producto_id} no encontrado en esta tienda"
                 )
             
             # Validación 2: Producto activo
-            if not producto.is_active:
+            if not info.is_active:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"El producto '{producto.nombre}' (SKU: {producto.sku}) está inactivo"
+                    detail=f"El producto '{info.nombre}' (SKU: {info.sku}) está inactivo"
                 )
             
-            # Validación 3: Stock suficiente
-            if producto.stock_actual < item.cantidad:
+            # Validación 3: Para productos tipo "pesable", permitir decimales
+            if info.tipo != 'pesable' and item.cantidad != int(item.cantidad):
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=(
-                        f"Stock insuficiente para '{producto.nombre}' (SKU: {producto.sku}). "
-                        f"Disponible: {producto.stock_actual}, Solicitado: {item.cantidad}"
-                    )
+                    detail=f"El producto '{info.nombre}' no permite cantidades decimales"
                 )
+        
+        # PASO 2: Bloquear todos los productos del carrito en una sola consulta.
+        # SELECT FOR UPDATE bloquea las filas hasta el commit; ORDER BY id fija el
+        # orden de adquisición de locks y evita deadlocks entre checkouts concurrentes.
+        # Con las filas bloqueadas solo se verifica stock, se descuenta y se inserta
+        statement = select(Producto).where(
+            Producto.id.in_(producto_ids),
+            Producto.tienda_id == current_tienda.id
+        ).order_by(Producto.id).with_for_update()
+        
+        result = await session.execute(statement)
+        productos_por_id = {producto.id: producto for producto in result.scalars()}
+        
+        for item in venta_data.items:
+            producto = productos_por_id[item.producto_id]
             
-            # Validación 4: Para productos tipo "pesable", permitir decimales
-            if producto.tipo != 'pesable' and item.cantidad != int(item.cantidad):
+            # Validación 4: Stock suficiente (se libera el lock antes de armar el error)
+            if producto.stock_actual < item.cantidad:
+                # El rollback expira los objetos: copiar antes los datos del mensaje
+                nombre, sku, disponible = producto.nombre, producto.sku, producto.stock_actual
+                await session.rollback()
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"El producto '{producto.nombre}' no permite cantidades decimales"
+                    detail=(
+                        f"Stock insuficiente para '{nombre}' (SKU: {sku}). "
+                        f"Disponible: {disponible}, Solicitado: {item.cantidad}"
+                    )
                 )
             
-            # PASO 2: Calcular subtotal y preparar descuento de stock
+            # Calcular subtotal y preparar descuento de stock
             subtotal = producto.precio_venta * item.cantidad
             total_venta += subtotal
             
@@ -166,16 +231,22 @@ async def procesar_venta(
         session.add(nueva_venta)
         await session.flush()  # Obtener el ID de la venta sin hacer commit
         
-        # PASO 4: Crear los detalles de venta
-        for detalle_data in detalles_a_crear:
-            detalle = DetalleVenta(
-                venta_id=nueva_venta.id,
-                producto_id=detalle_data['producto_id'],
-                cantidad=detalle_data['cantidad'],
-                precio_unitario=detalle_data['precio_unitario'],
-                subtotal=detalle_data['subtotal']
-            )
-            session.add(detalle)
+        # PASO 4: Crear los detalles de venta en un único INSERT (executemany),
+        # sin instanciar objetos ORM (el id se genera acá: no hay default en la BD)
+        await session.execute(
+            insert(DetalleVenta),
+            [
+                {
+                    'id': uuid4(),
+                    'venta_id': nueva_venta.id,
+                    'producto_id': detalle_data['producto_id'],
+                    'cantidad': detalle_data['cantidad'],
+                    'precio_unitario': detalle_data['precio_unitario'],
+                    'subtotal': detalle_data['subtotal']
+                }
+                for detalle_data in detalles_a_crear
+            ]
+        )
         
         # PASO 5: Actualizar stock de productos
         for producto in productos_a_actualizar:
@@ -184,6 +255,10 @@ async def procesar_venta(
         # PASO 6: COMMIT ATÓMICO
         await session.commit()
         
+        # La venta descontó stock: descartar estadísticas de inventario y listados cacheados
+        await invalidate_cache(f"inventario:{current_tienda.id}")
+        await invalidate_cache(f"productos:{current_tienda.id}")
+        
         # Retornar resumen de la venta
         return VentaResumen(
             venta_id=nueva_venta.id,
@@ -214,8 +289,8 @@ async def listar_ventas(
     session: Annotated[AsyncSession, Depends(get_session)],
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=500),
-    fecha_desde: Optional[str] = Query(None, description="Formato: YYYY-MM-DD"),
-    fecha_hasta: Optional[str] = Query(None, description="Formato: YYYY-MM-DD")
+    fecha_desde: Optional[date] = Query(None, description="Formato: YYYY-MM-DD"),
+    fecha_hasta: Optional[date] = Query(None, description="Formato: YYYY-MM-DD (inclusive)")
 ) -> List[VentaListRead]:
     """
     Lista ventas de la tienda actual con filtros opcionales
@@ -225,31 +300,29 @@ async def listar_ventas(
     - Filtro por rango de fechas
     - Sin detalles para optimizar performance en listados
     """
-    from datetime import datetime
-    
-    # Base query con filtro Multi-Tenant
-    statement = select(Venta).where(Venta.tienda_id == current_tienda.id)
+    # Base query con filtro Multi-Tenant. La cantidad de items se cuenta en la
+    # misma consulta (LEFT JOIN + GROUP BY) en lugar de una consulta por venta
+    statement = (
+        select(
+            Venta.id,
+            Venta.fecha,
+            Venta.total,
+            Venta.metodo_pago,
+            Venta.created_at,
+            func.count(DetalleVenta.id).label("cantidad_items")
+        )
+        .outerjoin(DetalleVenta, DetalleVenta.venta_id == Venta.id)
+        .where(Venta.tienda_id == current_tienda.id)
+        .group_by(Venta.id)
+    )
     
-    # Filtros de fecha
+    # Filtros de fecha (FastAPI ya validó el formato: uno inválido es un 422)
     if fecha_desde:
-        try:
-            fecha_desde_dt = datetime.strptime(fecha_desde, "%Y-%m-%d")
-            statement = statement.where(Venta.fecha >= fecha_desde_dt)
-        except ValueError:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Formato de fecha_desde inválido. Use YYYY-MM-DD"
-            )
+        statement = statement.where(Venta.fecha >= fecha_desde)
     
     if fecha_hasta:
-        try:
-            fecha_hasta_dt = datetime.strptime(fecha_hasta, "%Y-%m-%d")
-            statement = statement.where(Venta.fecha <= fecha_hasta_dt)
-        except ValueError:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Formato de fecha_hasta inválido. Use YYYY-MM-DD"
-            )
+        # Incluye todo el día fecha_hasta
+        statement = statement.where(Venta.fecha < fecha_hasta + timedelta(days=1))
     
     # Ordenar por fecha descendente
     statement = statement.order_by(Venta.fecha.desc())
@@ -258,26 +331,8 @@ async def listar_ventas(
     statement = statement.offset(skip).limit(limit)
     
     result = await session.execute(statement)
-    ventas = result.scalars().all()
     
-    # Construir respuesta con conteo de items
-    ventas_response = []
-    for venta in ventas:
-        # Contar detalles sin cargarlos
-        count_statement = select(DetalleVenta).where(DetalleVenta.venta_id == venta.id)
-        count_result = await session.execute(count_statement)
-        cantidad_items = len(count_result.scalars().all())
-        
-        ventas_response.append(VentaListRead(
-            id=venta.id,
-            fecha=venta.fecha,
-            total=venta.total,
-            metodo_pago=venta.metodo_pago,
-            created_at=venta.created_at,
-            cantidad_items=cantidad_items
-        ))
-    
-    return ventas_response
+    return [VentaListRead(**row) for row in result.mappings()]
 
 
 @router.get("/{venta_id}", response_model=VentaRead)
@@ -290,40 +345,49 @@ async def obtener_venta(
     Obtiene una venta específica con todos sus detalles
     Incluye información expandida de los productos
     """
-    # Buscar venta con validación Multi-Tenant
-    statement = select(Venta).where(
+    # Venta y detalles (con nombre/SKU del producto) en un solo round-trip,
+    # con validación Multi-Tenant. LEFT JOIN: una venta sin detalles igual se retorna
+    statement = select(
+        Venta,
+        DetalleVenta.id.label('detalle_id'),
+        DetalleVenta.producto_id,
+        DetalleVenta.cantidad,
+        DetalleVenta.precio_unitario,
+        DetalleVenta.subtotal,
+        Producto.nombre.label('producto_nombre'),
+        Producto.sku.label('producto_sku')
+    ).outerjoin(
+        DetalleVenta, DetalleVenta.venta_id == Venta.id
+    ).outerjoin(
+        Producto, DetalleVenta.producto_id == Producto.id
+    ).where(
         Venta.id == venta_id,
         Venta.tienda_id == current_tienda.id
     )
     result = await session.execute(statement)
-    venta = result.scalar_one_or_none()
+    rows = result.all()
     
-    if not venta:
+    if not rows:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Venta no encontrada"
         )
     
-    # Cargar detalles con información de productos
-    statement_detalles = select(DetalleVenta, Producto).where(
-        DetalleVenta.venta_id == venta_id
-    ).join(Producto, DetalleVenta.producto_id == Producto.id)
-    
-    result_detalles = await session.execute(statement_detalles)
-    detalles_raw = result_detalles.all()
+    venta = rows[0].Venta
     
     # Construir detalles expandidos
     detalles = [
         DetalleVentaRead(
-            id=detalle.id,
-            producto_id=detalle.producto_id,
-            producto_nombre=producto.nombre,
-            producto_sku=producto.sku,
-            cantidad=detalle.cantidad,
-            precio_unitario=detalle.precio_unitario,
-            subtotal=detalle.subtotal
+            id=row.detalle_id,
+            producto_id=row.producto_id,
+            producto_nombre=row.producto_nombre,
+            producto_sku=row.producto_sku,
+            cantidad=row.cantidad,
+            precio_unitario=row.precio_unitario,
+            subtotal=row.subtotal
         )
-        for detalle, producto in detalles_raw
+        for row in rows
+        if row.detalle_id is not None
     ]
     
     return VentaRead(
@@ -0,0 +1,28 @@
+"""
+Configuración de Celery - Nexus POS
+Cola de tareas para trabajos pesados fuera del proceso de la API
+
+Requiere el grupo opcional `celery` (pip install .[celery]) y CELERY_BROKER_URL.
+Worker: celery -A app.celery_app worker --loglevel=info
+"""
+from celery import Celery
+from app.core.config import settings
+
+
+celery_app = Celery(
+    "nexus_pos",
+    broker=settings.CELERY_BROKER_URL,
+    backend=settings.CELERY_RESULT_BACKEND or settings.CELERY_BROKER_URL,
+    include=["app.tasks.insights_tasks"]
+)
+
+celery_app.conf.update(
+    task_serializer="json",
+    accept_content=["json"],
+    result_serializer="json",
+    timezone="America/Argentina/Buenos_Aires",
+    enable_utc=True,
+    task_track_started=True,
+    task_time_limit=30 * 60,  # 30 minutos máximo por tarea
+    result_expires=60 * 60 * 24  # Resultados consultables por 24 horas
+)
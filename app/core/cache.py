@@ -1,51 +1,71 @@
 """
 Sistema de Caché para Nexus POS
-Implementa caché en memoria con TTL para optimizar consultas frecuentes
+Implementa caché con TTL para optimizar consultas frecuentes.
+Usa Redis (compartido entre workers) si REDIS_URL está configurado,
+si no, cae a un caché en memoria por proceso.
 """
-from datetime import datetime, timedelta
+from collections import OrderedDict
 from typing import Any, Optional, Callable
 import functools
-import json
 import hashlib
 import logging
+import time
+from uuid import UUID
+
+import orjson
+import redis.asyncio as redis
+from redis.exceptions import RedisError
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
 
 class CacheManager:
-    """Gestor de caché en memoria con TTL"""
+    """
+    Gestor de caché en memoria con TTL y tamaño acotado (LRU)
+    
+    Las entradas son tuplas (vencimiento en time.monotonic(), valor): vencen
+    al leerlas y, superado `max_entries`, se descarta la usada hace más tiempo.
+    """
     
-    def __init__(self):
-        self._cache: dict[str, dict] = {}
+    DEFAULT_MAX_ENTRIES = 10_000
+    
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self._cache: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._max_entries = max_entries
         
     def get(self, key: str) -> Optional[Any]:
         """Obtiene un valor del caché si no expiró"""
-        if key not in self._cache:
+        entry = self._cache.get(key)
+        if entry is None:
             return None
-            
-        entry = self._cache[key]
-        if datetime.utcnow() > entry['expires_at']:
+        
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
             # Expiró, eliminar
             del self._cache[key]
             logger.debug(f"Cache miss (expired): {key}")
             return None
-            
+        
+        self._cache.move_to_end(key)
         logger.debug(f"Cache hit: {key}")
-        return entry['value']
+        return value
         
     def set(self, key: str, value: Any, ttl_seconds: int = 300):
         """Guarda un valor en caché con TTL"""
-        self._cache[key] = {
-            'value': value,
-            'expires_at': datetime.utcnow() + timedelta(seconds=ttl_seconds),
-            'created_at': datetime.utcnow()
-        }
+        self._cache[key] = (time.monotonic() + ttl_seconds, value)
+        self._cache.move_to_end(key)
+        if len(self._cache) > self._max_entries:
+            self._cache.popitem(last=False)
         logger.debug(f"Cache set: {key} (TTL: {ttl_seconds}s)")
         
     def delete(self, key: str):
         """Elimina una entrada del caché"""
-        if key in self._cache:
-            del self._cache[key]
+        if self._cache.pop(key, None) is not None:
             logger.debug(f"Cache deleted: {key}")
             
     def clear(self):
@@ -65,21 +85,104 @@ class CacheManager:
 # Instancia global del caché
 cache_manager = CacheManager()
 
+# Cliente Redis compartido (se crea on-demand, maneja su propio pool)
+_redis_client: Optional[redis.Redis] = None
+
+
+def get_redis_client() -> Optional[redis.Redis]:
+    """Retorna el cliente Redis o None si REDIS_URL no está configurado"""
+    global _redis_client
+    if not settings.REDIS_URL:
+        return None
+    if _redis_client is None:
+        _redis_client = redis.from_url(settings.REDIS_URL)
+    return _redis_client
+
+
+async def close_cache():
+    """Cierra las conexiones a Redis (llamar en el shutdown de la app)"""
+    global _redis_client
+    if _redis_client is not None:
+        await _redis_client.aclose()
+        _redis_client = None
+
+
+def _cache_key_part(value: Any) -> bytes:
+    """Representación binaria compacta de un argumento (UUIDs por sus 16 bytes)"""
+    if isinstance(value, UUID):
+        return value.bytes
+    return str(value).encode()
+
 
 def generate_cache_key(*args, **kwargs) -> str:
-    """Genera una clave de caché única basada en argumentos"""
-    key_data = {
-        'args': [str(arg) for arg in args],
-        'kwargs': {k: str(v) for k, v in sorted(kwargs.items())}
-    }
-    key_string = json.dumps(key_data, sort_keys=True)
-    return hashlib.md5(key_string.encode()).hexdigest()
+    """
+    Genera una clave de caché única basada en argumentos
+    
+    Hashea con blake2b los argumentos unidos por un separador binario, sin
+    armar un JSON intermedio por llamada
+    """
+    partes = [_cache_key_part(arg) for arg in args]
+    for k, v in sorted(kwargs.items()):
+        partes.append(k.encode() + b"=" + _cache_key_part(v))
+    return hashlib.blake2b(b"\x00".join(partes), digest_size=16).hexdigest()
+
+
+# Versiones por espacio de caché (ej: "productos:{tienda_id}"). Cambian en cada
+# invalidate_cache y sirven para construir ETags y claves que nunca quedan viejas
+CACHE_VERSIONS_KEY = "cache:versions"
+# Sin Redis cada worker tiene sus propias versiones: se agrega una ventana de
+# tiempo para acotar cuánto puede durar un ETag emitido por otro worker
+LOCAL_VERSION_WINDOW_SECONDS = 30
+_local_versions: dict[str, int] = {}
+
+
+async def get_cache_version(namespace: str) -> str:
+    """Retorna la versión actual de un espacio de caché"""
+    redis_client = get_redis_client()
+    if redis_client is not None:
+        try:
+            # La versión es un timestamp: si Redis perdió el hash no se repiten valores viejos
+            await redis_client.hsetnx(CACHE_VERSIONS_KEY, namespace, time.time_ns())
+            version = await redis_client.hget(CACHE_VERSIONS_KEY, namespace)
+            return version.decode() if isinstance(version, bytes) else str(version)
+        except RedisError as e:
+            logger.warning(f"Redis no disponible, se usa la versión local: {str(e)}")
+    
+    version = _local_versions.setdefault(namespace, time.time_ns())
+    return f"{version}:{int(time.time() // LOCAL_VERSION_WINDOW_SECONDS)}"
+
+
+async def _bump_cache_version(namespace: str, redis_client: Optional[redis.Redis]):
+    """Asigna una versión nueva a un espacio de caché"""
+    _local_versions[namespace] = time.time_ns()
+    if redis_client is not None:
+        try:
+            await redis_client.hset(CACHE_VERSIONS_KEY, namespace, time.time_ns())
+        except RedisError as e:
+            logger.warning(f"No se pudo actualizar la versión del caché en Redis: {str(e)}")
+
+
+def generate_etag(*parts) -> str:
+    """Genera un ETag fuerte (entre comillas) a partir de los valores que definen la versión"""
+    version = ":".join(str(part) for part in parts)
+    return f'"{hashlib.blake2b(version.encode(), digest_size=16).hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Indica si el header If-None-Match del cliente ya contiene el ETag actual"""
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in (tag.strip() for tag in if_none_match.split(","))
 
 
 def cached(ttl_seconds: int = 300, key_prefix: str = ""):
     """
     Decorador para cachear resultados de funciones async
     
+    La clave incluye el id de `current_tienda` (si el endpoint lo recibe) para
+    aislar el caché por tenant, y descarta la sesión de BD de los argumentos.
+    Con Redis el valor se guarda serializado como JSON (orjson).
+    
     Args:
         ttl_seconds: Tiempo de vida del caché en segundos
         key_prefix: Prefijo para la clave de caché
@@ -87,25 +190,79 @@ def cached(ttl_seconds: int = 300, key_prefix: str = ""):
     def decorator(func: Callable):
         @functools.wraps(func)
         async def wrapper(*args, **kwargs):
-            # Generar clave de caché
-            cache_key = f"{key_prefix}:{func.__name__}:{generate_cache_key(*args, **kwargs)}"
+            # Generar clave de caché: {prefijo}:{tienda_id}:{función}:{hash de argumentos}
+            tienda_id = getattr(kwargs.get("current_tienda"), "id", None)
+            key_kwargs = {
+                k: v for k, v in kwargs.items()
+                if k != "current_tienda" and not isinstance(v, AsyncSession)
+            }
+            cache_key = f"{key_prefix}:{tienda_id}:{func.__name__}:{generate_cache_key(*args, **key_kwargs)}"
+            
+            redis_client = get_redis_client()
             
             # Intentar obtener del caché
-            cached_value = cache_manager.get(cache_key)
-            if cached_value is not None:
-                return cached_value
+            if redis_client is not None:
+                try:
+                    raw = await redis_client.get(cache_key)
+                    if raw is not None:
+                        logger.debug(f"Cache hit (redis): {cache_key}")
+                        return orjson.loads(raw)
+                except RedisError as e:
+                    logger.warning(f"Redis no disponible, se omite el caché: {str(e)}")
+            else:
+                cached_value = cache_manager.get(cache_key)
+                if cached_value is not None:
+                    return cached_value
                 
             # Si no está en caché, ejecutar función
             result = await func(*args, **kwargs)
             
             # Guardar en caché
-            cache_manager.set(cache_key, result, ttl_seconds)
+            if redis_client is not None:
+                try:
+                    if isinstance(result, BaseModel):
+                        payload = result.model_dump_json()
+                    else:
+                        # orjson serializa dict/list/UUID/datetime nativamente;
+                        # jsonable_encoder solo se usa para los tipos que no conoce
+                        payload = orjson.dumps(result, default=jsonable_encoder)
+                    await redis_client.set(cache_key, payload, ex=ttl_seconds)
+                except RedisError as e:
+                    logger.warning(f"No se pudo guardar en Redis: {str(e)}")
+            else:
+                cache_manager.set(cache_key, result, ttl_seconds)
             
             return result
         return wrapper
     return decorator
 
 
-def invalidate_cache(pattern: str):
-    """Helper para invalidar caché por patrón"""
+# Claves por iteración de SCAN y por comando UNLINK al invalidar
+INVALIDATE_SCAN_COUNT = 500
+
+
+async def invalidate_cache(pattern: str):
+    """
+    Helper para invalidar caché por patrón (memoria local y Redis)
+    
+    También cambia la versión del espacio `pattern`, lo que invalida los ETags
+    emitidos con get_cache_version(pattern)
+    """
     cache_manager.invalidate_pattern(pattern)
+    
+    redis_client = get_redis_client()
+    await _bump_cache_version(pattern, redis_client)
+    if redis_client is not None:
+        try:
+            # Las claves empiezan con el espacio ("{prefijo}:{tienda_id}:..."), así
+            # que el MATCH es por prefijo. UNLINK libera la memoria en segundo plano
+            keys = [
+                key async for key in redis_client.scan_iter(
+                    match=f"{pattern}*", count=INVALIDATE_SCAN_COUNT
+                )
+            ]
+            for i in range(0, len(keys), INVALIDATE_SCAN_COUNT):
+                await redis_client.unlink(*keys[i:i + INVALIDATE_SCAN_COUNT])
+            logger.info(f"Cache invalidated (redis): {len(keys)} entries with pattern '{pattern}'")
+        except RedisError as e:
+            logger.warning(f"No se pudo invalidar el caché en Redis: {str(e)}")
@@ -22,6 +22,13 @@ class Settings(BaseSettings):
     POSTGRES_PASSWORD: str
     POSTGRES_DB: str
     POSTGRES_PORT: int = 5432
+    DB_PGBOUNCER: bool = False  # True si POSTGRES_SERVER/PORT apuntan a PgBouncer (modo transacción, puerto 6432)
+    DB_ECHO: bool = False  # Log de cada query SQL con sus parámetros (solo para depurar)
+    DB_STATEMENT_CACHE_SIZE: int = 500  # Prepared statements cacheados por conexión (asyncpg)
+    DB_POOL_SIZE: int = 20  # Conexiones persistentes por worker
+    DB_MAX_OVERFLOW: int = 40  # Conexiones extra temporales en picos de carga
+    DB_POOL_TIMEOUT: int = 10  # Segundos de espera por una conexión libre antes de fallar
+    DB_POOL_RECYCLE: int = 1800  # Renovar conexiones cada 30 minutos
     
     # Seguridad JWT
     SECRET_KEY: str
@@ -38,6 +45,16 @@ class Settings(BaseSettings):
             return [origin.strip() for origin in self.BACKEND_CORS_ORIGINS.split(",")]
         return self.BACKEND_CORS_ORIGINS
     
+    # Redis (Opcional - caché compartido entre workers)
+    REDIS_URL: Optional[str] = None
+    
+    # Celery (Opcional - cola de tareas de fondo; sin broker se usa BackgroundTasks)
+    CELERY_BROKER_URL: Optional[str] = None
+    CELERY_RESULT_BACKEND: Optional[str] = None
+    
+    # Reportes (intervalo de refresco de las vistas materializadas; 0 = sin refresco automático)
+    REPORTES_REFRESH_SECONDS: int = 600
+    
     # Mercado Pago
     MERCADOPAGO_ACCESS_TOKEN: Optional[str] = None
     MERCADOPAGO_WEBHOOK_SECRET: Optional[str] = None
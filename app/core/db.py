@@ -3,19 +3,46 @@ Configuración de Base de Datos - PostgreSQL Async
 Engine y Session Factory para SQLModel
 """
 from typing import AsyncGenerator
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
 from sqlmodel import SQLModel
 from app.core.config import settings
 
 
+# Pool de conexiones
+# Con PgBouncer (modo transacción) el pooling lo hace PgBouncer: se usa NullPool
+# para no duplicarlo y se desactiva la caché de prepared statements de asyncpg,
+# que no sobrevive al cambio de conexión de servidor entre transacciones
+if settings.DB_PGBOUNCER:
+    pool_kwargs = {
+        "poolclass": NullPool,
+        "connect_args": {"statement_cache_size": 0, "prepared_statement_cache_size": 0},
+    }
+else:
+    pool_kwargs = {
+        "poolclass": AsyncAdaptedQueuePool,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_use_lifo": True,  # Reusar la conexión más reciente; las ociosas expiran antes
+        "pool_pre_ping": True,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        # Cada conexión guarda los prepared statements de las queries repetidas:
+        # Postgres no vuelve a parsear ni planificar las consultas frecuentes
+        "connect_args": {
+            "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+            "prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+        },
+    }
+
 # Motor asíncrono de SQLAlchemy
 engine = create_async_engine(
     settings.DATABASE_URL,
-    echo=True,  # Log de queries SQL (desactivar en producción)
+    echo=settings.DB_ECHO,  # Formatear y loguear cada query tiene un costo alto de CPU
     future=True,
-    pool_pre_ping=True,
-    pool_size=10,
-    max_overflow=20
+    query_cache_size=1200,  # Caché LRU de SQL compilado compartido entre requests
+    **pool_kwargs
 )
 
 # Session Factory asíncrona
@@ -34,6 +61,8 @@ async def init_db() -> None:
     Ejecutar solo en desarrollo o con migraciones controladas
     """
     async with engine.begin() as conn:
+        # Los índices trigram de productos requieren la extensión pg_trgm
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
         await conn.run_sync(SQLModel.metadata.create_all)
 
 
@@ -41,9 +70,10 @@ async def get_session() -> AsyncGenerator[AsyncSession, None]:
     """
     Dependencia de FastAPI para inyectar sesiones de BD
     Uso: session: AsyncSession = Depends(get_session)
+    
+    Debe mantenerse `async def`: FastAPI despacha las dependencias sync al
+    threadpool, lo que agrega latencia a cada request autenticado.
+    El `async with` ya cierra la sesión al terminar el request.
     """
     async with AsyncSessionLocal() as session:
-        try:
-            yield session
-        finally:
-            await session.close()
+        yield session
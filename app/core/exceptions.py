@@ -5,10 +5,11 @@ Handler centralizado para todas las excepciones de la aplicación
 import logging
 from typing import Union, Dict, Any
 from fastapi import Request, status
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from fastapi.exceptions import RequestValidationError, HTTPException
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from pydantic import ValidationError
+from app.core.logging_config import get_request_id
 
 
 logger = logging.getLogger(__name__)
@@ -62,22 +63,18 @@ class VentaInvalidaException(NexusPOSException):
 async def nexus_exception_handler(
     request: Request,
     exc: NexusPOSException
-) -> JSONResponse:
+) -> ORJSONResponse:
     """
     Handler para excepciones personalizadas de Nexus POS
     """
-    request_id = getattr(request.state, "request_id", "unknown")
+    request_id = get_request_id()
     
     logger.warning(
         f"NexusPOS Exception: {exc.message}",
-        extra={
-            "request_id": request_id,
-            "path": request.url.path,
-            "details": exc.details
-        }
+        extra={"details": exc.details}
     )
     
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=exc.status_code,
         content={
             "success": False,
@@ -94,22 +91,18 @@ async def nexus_exception_handler(
 async def http_exception_handler(
     request: Request,
     exc: HTTPException
-) -> JSONResponse:
+) -> ORJSONResponse:
     """
     Handler mejorado para HTTPException de FastAPI
     """
-    request_id = getattr(request.state, "request_id", "unknown")
+    request_id = get_request_id()
     
     logger.warning(
         f"HTTP Exception: {exc.detail}",
-        extra={
-            "request_id": request_id,
-            "status_code": exc.status_code,
-            "path": request.url.path
-        }
+        extra={"status_code": exc.status_code}
     )
     
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=exc.status_code,
         content={
             "success": False,
@@ -125,12 +118,12 @@ async def http_exception_handler(
 async def validation_exception_handler(
     request: Request,
     exc: Union[RequestValidationError, ValidationError]
-) -> JSONResponse:
+) -> ORJSONResponse:
     """
     Handler para errores de validación de Pydantic
     Retorna mensajes más amigables
     """
-    request_id = getattr(request.state, "request_id", "unknown")
+    request_id = get_request_id()
     
     # Extraer errores de validación
     errors = []
@@ -145,13 +138,10 @@ async def validation_exception_handler(
     
     logger.warning(
         f"Validation Error en {request.url.path}",
-        extra={
-            "request_id": request_id,
-            "errors": errors
-        }
+        extra={"errors": errors}
     )
     
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
         content={
             "success": False,
@@ -168,18 +158,17 @@ async def validation_exception_handler(
 async def sqlalchemy_exception_handler(
     request: Request,
     exc: SQLAlchemyError
-) -> JSONResponse:
+) -> ORJSONResponse:
     """
     Handler para errores de SQLAlchemy
     """
-    request_id = getattr(request.state, "request_id", "unknown")
+    request_id = get_request_id()
     
     # Determinar tipo de error
     if isinstance(exc, IntegrityError):
         # Error de integridad (unique, foreign key, etc.)
         logger.error(
             f"Database Integrity Error: {str(exc)}",
-            extra={"request_id": request_id},
             exc_info=True
         )
         
@@ -189,14 +178,13 @@ async def sqlalchemy_exception_handler(
         # Otros errores de base de datos
         logger.error(
             f"Database Error: {str(exc)}",
-            extra={"request_id": request_id},
             exc_info=True
         )
         
         message = "Error al procesar la operación en base de datos"
         status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
     
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=status_code,
         content={
             "success": False,
@@ -212,23 +200,19 @@ async def sqlalchemy_exception_handler(
 async def generic_exception_handler(
     request: Request,
     exc: Exception
-) -> JSONResponse:
+) -> ORJSONResponse:
     """
     Handler genérico para excepciones no capturadas
     """
-    request_id = getattr(request.state, "request_id", "unknown")
+    request_id = get_request_id()
     
     logger.critical(
         f"Unhandled Exception: {str(exc)}",
-        extra={
-            "request_id": request_id,
-            "path": request.url.path,
-            "method": request.method
-        },
+        extra={"method": request.method},
         exc_info=True
     )
     
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
         content={
             "success": False,
@@ -2,13 +2,53 @@
 Sistema de Logging Robusto - Nexus POS
 Configuración centralizada con rotación de archivos y formato estructurado
 """
+import copy
 import logging
+import queue
 import sys
+import time
+from contextvars import ContextVar
 from pathlib import Path
-from logging.handlers import RotatingFileHandler, TimedRotatingFileHandler
-from datetime import datetime
-from typing import Optional
-import json
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+    RotatingFileHandler,
+    TimedRotatingFileHandler,
+)
+from typing import Any, Dict, List, Optional
+import orjson
+
+
+# Datos del request en curso (request_id, ip_address, path); los carga RequestIDMiddleware
+request_context: ContextVar[Optional[Dict[str, Any]]] = ContextVar("request_context", default=None)
+
+
+def get_request_id() -> str:
+    """Retorna el request_id del request en curso o "unknown" fuera de un request"""
+    contexto = request_context.get()
+    return contexto["request_id"] if contexto else "unknown"
+
+
+def _install_request_context_factory() -> None:
+    """
+    Envuelve la LogRecordFactory para estampar el contexto del request en cada record
+    
+    Así los logs dentro de un request no necesitan armar un dict `extra=`
+    con request_id/ip_address/path en cada llamada.
+    """
+    factory_base = logging.getLogRecordFactory()
+    if getattr(factory_base, "_request_context", False):
+        return
+    
+    def factory(*args, **kwargs) -> logging.LogRecord:
+        record = factory_base(*args, **kwargs)
+        contexto = request_context.get()
+        if contexto:
+            record.__dict__.update(contexto)
+        return record
+    
+    factory._request_context = True
+    logging.setLogRecordFactory(factory)
 
 
 class JSONFormatter(logging.Formatter):
@@ -17,7 +57,9 @@ class JSONFormatter(logging.Formatter):
     """
     def format(self, record: logging.LogRecord) -> str:
         log_data = {
-            "timestamp": datetime.utcnow().isoformat(),
+            # El LogRecord ya trae su instante de creación; no se consulta el reloj otra vez
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))
+                         + f".{int(record.msecs):03d}Z",
             "level": record.levelname,
             "logger": record.name,
             "message": record.getMessage(),
@@ -40,7 +82,35 @@ class JSONFormatter(logging.Formatter):
         if hasattr(record, "ip_address"):
             log_data["ip_address"] = record.ip_address
         
-        return json.dumps(log_data, ensure_ascii=False)
+        # Los handlers esperan str; orjson ya emite UTF-8 sin escapar
+        return orjson.dumps(log_data, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+
+class _InProcessQueueHandler(QueueHandler):
+    """
+    QueueHandler para una cola en el mismo proceso
+    
+    El prepare() base deja el record listo para pickle y pega el traceback
+    dentro del mensaje; acá solo se resuelven los args (pueden mutar antes
+    de que el listener formatee) y se conserva exc_info para los formatters.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+# Listeners que escriben los archivos de log en su propio thread
+_queue_listeners: List[QueueListener] = []
+
+
+def _attach_queue_listener(logger: logging.Logger, *handlers: logging.Handler) -> None:
+    """Cuelga de `logger` un QueueHandler cuyos records escribe `handlers` en otro thread"""
+    log_queue: queue.Queue = queue.Queue(-1)
+    logger.addHandler(_InProcessQueueHandler(log_queue))
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    _queue_listeners.append(listener)
 
 
 class ColoredFormatter(logging.Formatter):
@@ -58,6 +128,8 @@ class ColoredFormatter(logging.Formatter):
     
     def format(self, record: logging.LogRecord) -> str:
         color = self.COLORS.get(record.levelname, self.COLORS['RESET'])
+        # Copia: el mismo record sigue hacia la cola de los handlers de archivo
+        record = copy.copy(record)
         record.levelname = f"{color}{record.levelname}{self.COLORS['RESET']}"
         return super().format(record)
 
@@ -84,12 +156,20 @@ def setup_logging(
         log_dir = Path("logs")
     log_dir.mkdir(exist_ok=True)
     
+    _install_request_context_factory()
+    
     # Configurar logger raíz
     root_logger = logging.getLogger()
     root_logger.setLevel(getattr(logging, log_level.upper()))
     
     # Limpiar handlers existentes
+    shutdown_logging()
     root_logger.handlers.clear()
+    audit_logger = get_audit_logger()
+    audit_logger.handlers.clear()
+    
+    # Los handlers de archivo no se cuelgan del root: los atiende el QueueListener
+    file_handlers = []
     
     # HANDLER 1: Consola (desarrollo)
     if enable_console:
@@ -121,7 +201,7 @@ def setup_logging(
                 '%(asctime)s | %(levelname)-8s | %(name)s | %(message)s',
                 datefmt='%Y-%m-%d %H:%M:%S'
             ))
-        root_logger.addHandler(general_handler)
+        file_handlers.append(general_handler)
     
     # HANDLER 3: Archivo de errores con rotación diaria
     if enable_file:
@@ -142,7 +222,7 @@ def setup_logging(
                 '%(asctime)s | %(levelname)-8s | %(name)s | %(funcName)s:%(lineno)d | %(message)s',
                 datefmt='%Y-%m-%d %H:%M:%S'
             ))
-        root_logger.addHandler(error_handler)
+        file_handlers.append(error_handler)
     
     # HANDLER 4: Archivo de auditoría (solo operaciones críticas)
     if enable_file:
@@ -155,10 +235,15 @@ def setup_logging(
             encoding='utf-8'
         )
         audit_handler.setLevel(logging.INFO)
-        audit_handler.addFilter(lambda record: hasattr(record, 'audit'))
-        
         audit_handler.setFormatter(JSONFormatter())
-        root_logger.addHandler(audit_handler)
+        
+        # Logger propio sin propagación: el resto de los records nunca pasa por acá
+        audit_logger.propagate = False
+        _attach_queue_listener(audit_logger, audit_handler)
+    
+    # Los requests solo encolan el record; escritura y rotación van en otro thread
+    if file_handlers:
+        _attach_queue_listener(root_logger, *file_handlers)
     
     # Configurar niveles específicos por módulo
     logging.getLogger("sqlalchemy.engine").setLevel(logging.WARNING)
@@ -169,6 +254,17 @@ def setup_logging(
     logger.info(f"Sistema de logging inicializado - Nivel: {log_level}")
 
 
+def shutdown_logging() -> None:
+    """
+    Detiene los QueueListeners vaciando antes los records pendientes
+    """
+    while _queue_listeners:
+        listener = _queue_listeners.pop()
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+
 def get_audit_logger() -> logging.Logger:
     """
     Retorna un logger configurado específicamente para auditoría
@@ -206,11 +302,12 @@ def log_audit(
         extra['user_id'] = user_id
     if tienda_id:
         extra['tienda_id'] = tienda_id
-    if ip_address:
+    # Dentro de un request la IP ya viene estampada desde request_context
+    if ip_address and not request_context.get():
         extra['ip_address'] = ip_address
     
     message = f"AUDIT: {action}"
     if details:
-        message += f" | {json.dumps(details, ensure_ascii=False)}"
+        message += f" | {orjson.dumps(details, option=orjson.OPT_NON_STR_KEYS, default=str).decode('utf-8')}"
     
     logger.info(message, extra=extra)
@@ -1,101 +1,127 @@
 """
 Middleware para Request ID y logging de requests
 Agrega correlación de requests y logging automático
+
+Implementados como middleware ASGI puro (sin BaseHTTPMiddleware) para no
+crear una tarea extra ni re-empaquetar el body en cada request
 """
 import time
 import uuid
 import logging
-from typing import Callable
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.types import ASGIApp
+from fastapi import Request
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.core.logging_config import request_context
 
 
 logger = logging.getLogger(__name__)
 
 
-class RequestIDMiddleware(BaseHTTPMiddleware):
+class RequestIDMiddleware:
     """
     Middleware que agrega un ID único a cada request
     para facilitar el tracking y debugging
     """
     
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        request = Request(scope)
+        
         # Generar o usar request_id existente del header
         request_id = request.headers.get("X-Request-ID", str(uuid.uuid4()))
         
         # Agregar request_id al estado del request
         request.state.request_id = request_id
         
+        # Contexto que la LogRecordFactory estampa en cada log de este request.
+        # No se resetea: cada request corre en su propia task (copia del contexto)
+        # y los exception handlers de ServerErrorMiddleware, que envuelve a este
+        # middleware, todavía lo necesitan.
+        client = scope.get("client")
+        request_context.set({
+            "request_id": request_id,
+            "ip_address": client[0] if client else "unknown",
+            "path": scope["path"],
+        })
+        
         # Procesar request y agregar header a response
-        response = await call_next(request)
-        response.headers["X-Request-ID"] = request_id
+        async def send_with_request_id(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append("X-Request-ID", request_id)
+            await send(message)
         
-        return response
+        await self.app(scope, receive, send_with_request_id)
 
 
-class RequestLoggingMiddleware(BaseHTTPMiddleware):
+class RequestLoggingMiddleware:
     """
     Middleware que loggea todos los requests y responses
     con métricas de performance
     """
     
     def __init__(self, app: ASGIApp, log_body: bool = False):
-        super().__init__(app)
+        self.app = app
         self.log_body = log_body
     
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
         # Tiempo de inicio
         start_time = time.time()
         
-        # Información del request
-        request_id = getattr(request.state, "request_id", "unknown")
-        client_ip = request.client.host if request.client else "unknown"
+        # Información del request, leída una sola vez del scope ASGI
+        # (request.url arma un objeto URL en cada acceso).
+        # request_id, ip_address y path llegan a cada log vía request_context.
+        method = scope["method"]
+        path = scope["path"]
         
         # Log de request entrante
         logger.info(
-            f"Request: {request.method} {request.url.path}",
+            f"Request: {method} {path}",
             extra={
-                "request_id": request_id,
-                "ip_address": client_ip,
-                "method": request.method,
-                "path": request.url.path,
-                "query_params": str(request.query_params)
+                "method": method,
+                "query_params": scope["query_string"].decode("latin-1")
             }
         )
         
+        async def send_with_metrics(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                # Calcular tiempo de procesamiento
+                process_time = time.time() - start_time
+                
+                # Log de response
+                logger.info(
+                    f"Response: {method} {path} - {message['status']} ({process_time:.3f}s)",
+                    extra={
+                        "status_code": message["status"],
+                        "process_time": process_time
+                    }
+                )
+                
+                # Agregar header de performance
+                headers = MutableHeaders(scope=message)
+                headers.append("X-Process-Time", str(process_time))
+            await send(message)
+        
         # Procesar request
         try:
-            response = await call_next(request)
-            
-            # Calcular tiempo de procesamiento
-            process_time = time.time() - start_time
-            
-            # Log de response
-            logger.info(
-                f"Response: {request.method} {request.url.path} - {response.status_code} ({process_time:.3f}s)",
-                extra={
-                    "request_id": request_id,
-                    "status_code": response.status_code,
-                    "process_time": process_time
-                }
-            )
-            
-            # Agregar header de performance
-            response.headers["X-Process-Time"] = str(process_time)
-            
-            return response
+            await self.app(scope, receive, send_with_metrics)
             
         except Exception as exc:
             # Log de error
             process_time = time.time() - start_time
             logger.error(
-                f"Request failed: {request.method} {request.url.path} - {str(exc)}",
-                extra={
-                    "request_id": request_id,
-                    "ip_address": client_ip,
-                    "process_time": process_time
-                },
+                f"Request failed: {method} {path} - {str(exc)}",
+                extra={"process_time": process_time},
                 exc_info=True
             )
             raise
@@ -3,48 +3,58 @@ Middleware de Performance Monitoring - Nexus POS
 Monitorea queries lentas y performance de endpoints
 """
 import time
-from typing import Callable
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
+from fastapi import Request
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-class PerformanceMonitoringMiddleware(BaseHTTPMiddleware):
+class PerformanceMonitoringMiddleware:
     """
-    Middleware que monitorea el performance de requests
+    Middleware ASGI que monitorea el performance de requests
     y alerta sobre queries/endpoints lentos
     """
     
-    def __init__(self, app, slow_request_threshold: float = 1.0):
-        super().__init__(app)
+    def __init__(self, app: ASGIApp, slow_request_threshold: float = 1.0):
+        self.app = app
         self.slow_request_threshold = slow_request_threshold  # segundos
     
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
-        start_time = time.time()
-        
-        # Procesar request
-        response = await call_next(request)
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
         
-        # Calcular duración
-        duration = time.time() - start_time
-        
-        # Alertar si es lento
-        if duration > self.slow_request_threshold:
-            logger.warning(
-                f"SLOW REQUEST: {request.method} {request.url.path} "
-                f"took {duration:.2f}s (threshold: {self.slow_request_threshold}s)",
-                extra={
-                    "method": request.method,
-                    "path": request.url.path,
-                    "duration_seconds": duration,
-                    "query_params": dict(request.query_params),
-                    "client_host": request.client.host if request.client else None
-                }
-            )
+        start_time = time.time()
         
-        # Agregar métrica al header
-        response.headers["X-Performance-Ms"] = str(int(duration * 1000))
+        async def send_with_metrics(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                # Calcular duración
+                duration = time.time() - start_time
+                
+                # Alertar si es lento
+                if duration > self.slow_request_threshold:
+                    # Datos leídos una sola vez del scope ASGI
+                    request = Request(scope)
+                    method = scope["method"]
+                    path = scope["path"]
+                    client = scope.get("client")
+                    logger.warning(
+                        f"SLOW REQUEST: {method} {path} "
+                        f"took {duration:.2f}s (threshold: {self.slow_request_threshold}s)",
+                        extra={
+                            "method": method,
+                            "duration_seconds": duration,
+                            "query_params": dict(request.query_params),
+                            "client_host": client[0] if client else None
+                        }
+                    )
+                
+                # Agregar métrica al header
+                headers = MutableHeaders(scope=message)
+                headers.append("X-Performance-Ms", str(int(duration * 1000)))
+            await send(message)
         
-        return response
+        # Procesar request
+        await self.app(scope, receive, send_with_metrics)
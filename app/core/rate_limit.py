@@ -1,23 +1,44 @@
 """
 Sistema de Rate Limiting - Nexus POS
 Protección contra abuso y ataques DoS
+
+Con REDIS_URL configurado la ventana deslizante vive en Redis (compartida entre
+workers y reinicios); si no, cae al RateLimiter en memoria de cada proceso.
 """
+import logging
+import math
 import time
-from typing import Dict, Tuple, Optional
-from collections import defaultdict
+import uuid
+from typing import Dict, List, Tuple, Optional
+from collections import defaultdict, deque
 from threading import Lock
 from fastapi import Request, HTTPException, status
+from redis.exceptions import RedisError
+from app.core.cache import get_redis_client
+
+
+logger = logging.getLogger(__name__)
 
 
 class RateLimiter:
     """
     Rate limiter simple basado en memoria
-    En producción, usar Redis para distribuido
+    Fallback por proceso cuando Redis no está disponible
     """
     
+    # Cantidad de particiones (potencia de 2): cada una tiene su propio lock,
+    # así requests de keys distintas no compiten por un único lock global
+    SHARDS = 64
+    
     def __init__(self):
-        self._requests: Dict[str, list] = defaultdict(list)
-        self._lock = Lock()
+        # Timestamps (time.monotonic) por key, del más antiguo al más reciente
+        self._shards: List[Dict[str, deque]] = [defaultdict(deque) for _ in range(self.SHARDS)]
+        self._locks: List[Lock] = [Lock() for _ in range(self.SHARDS)]
+    
+    def _shard(self, key: str) -> Tuple[Dict[str, deque], Lock]:
+        """Partición y lock correspondientes a una key"""
+        idx = hash(key) & (self.SHARDS - 1)
+        return self._shards[idx], self._locks[idx]
     
     def is_allowed(
         self,
@@ -36,38 +57,85 @@ class RateLimiter:
         Returns:
             Tupla (is_allowed, retry_after_seconds)
         """
-        current_time = time.time()
+        current_time = time.monotonic()
+        cutoff = current_time - window_seconds
         
-        with self._lock:
-            # Limpiar requests antiguas
-            self._requests[key] = [
-                timestamp for timestamp in self._requests[key]
-                if current_time - timestamp < window_seconds
-            ]
+        requests, lock = self._shard(key)
+        
+        with lock:
+            timestamps = requests[key]
+            
+            # Limpiar requests antiguas (están al principio)
+            while timestamps and timestamps[0] <= cutoff:
+                timestamps.popleft()
             
-            # Verificar límite
-            if len(self._requests[key]) >= max_requests:
-                oldest_request = min(self._requests[key])
-                retry_after = int(window_seconds - (current_time - oldest_request))
+            # Verificar límite: la request más antigua es la primera de la deque
+            if len(timestamps) >= max_requests:
+                retry_after = int(window_seconds - (current_time - timestamps[0]))
                 return False, retry_after
             
             # Agregar request actual
-            self._requests[key].append(current_time)
+            timestamps.append(current_time)
             return True, None
     
     def reset(self, key: str) -> None:
         """
         Resetea el contador para una key específica
         """
-        with self._lock:
-            if key in self._requests:
-                del self._requests[key]
+        requests, lock = self._shard(key)
+        with lock:
+            requests.pop(key, None)
 
 
 # Instancia global
 rate_limiter = RateLimiter()
 
 
+# Ventana deslizante atómica en un sorted set (score = timestamp en ms).
+# Retorna {1, 0} si la request se permite o {0, score más antiguo} si no
+SLIDING_WINDOW_LUA = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+if redis.call('ZCARD', key) >= limit then
+    local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+    return {0, tonumber(oldest[2])}
+end
+redis.call('ZADD', key, now, ARGV[4])
+redis.call('PEXPIRE', key, window)
+return {1, 0}
+"""
+
+RATE_LIMIT_KEY_PREFIX = "ratelimit:"
+
+# Script registrado en el cliente actual (redis-py usa EVALSHA y lo recarga si hace falta)
+_sliding_window_script = None
+
+
+async def _is_allowed_redis(
+    redis_client,
+    key: str,
+    max_requests: int,
+    window_seconds: int
+) -> Tuple[bool, Optional[int]]:
+    """Equivalente a RateLimiter.is_allowed con un solo EVALSHA a Redis"""
+    global _sliding_window_script
+    if _sliding_window_script is None or _sliding_window_script.registered_client is not redis_client:
+        _sliding_window_script = redis_client.register_script(SLIDING_WINDOW_LUA)
+    
+    ahora_ms = int(time.time() * 1000)
+    window_ms = window_seconds * 1000
+    permitido, mas_antigua_ms = await _sliding_window_script(
+        keys=[f"{RATE_LIMIT_KEY_PREFIX}{key}"],
+        args=[ahora_ms, window_ms, max_requests, f"{ahora_ms}-{uuid.uuid4().hex}"]
+    )
+    if permitido:
+        return True, None
+    return False, max(1, math.ceil((int(mas_antigua_ms) + window_ms - ahora_ms) / 1000))
+
+
 async def rate_limit_middleware(
     request: Request,
     max_requests: int = 100,
@@ -87,12 +155,22 @@ async def rate_limit_middleware(
     # Obtener identificador único (IP del cliente)
     client_ip = request.client.host if request.client else "unknown"
     
-    # Verificar rate limit
-    is_allowed, retry_after = rate_limiter.is_allowed(
-        key=client_ip,
-        max_requests=max_requests,
-        window_seconds=window_seconds
-    )
+    # Verificar rate limit (Redis compartido; memoria local si no hay o falla)
+    resultado = None
+    redis_client = get_redis_client()
+    if redis_client is not None:
+        try:
+            resultado = await _is_allowed_redis(redis_client, client_ip, max_requests, window_seconds)
+        except RedisError as e:
+            logger.warning(f"Redis no disponible, rate limit en memoria: {str(e)}")
+    
+    if resultado is None:
+        resultado = rate_limiter.is_allowed(
+            key=client_ip,
+            max_requests=max_requests,
+            window_seconds=window_seconds
+        )
+    is_allowed, retry_after = resultado
     
     if not is_allowed:
         raise HTTPException(
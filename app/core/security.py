@@ -2,9 +2,10 @@
 Seguridad y Autenticación - Nexus POS
 Hashing de passwords y generación de tokens JWT
 """
-from datetime import datetime, timedelta
+import asyncio
+from datetime import datetime, timedelta, timezone
 from typing import Optional
-from jose import jwt
+from jose import jwk, jwt
 from passlib.context import CryptContext
 from app.core.config import settings
 
@@ -12,6 +13,10 @@ from app.core.config import settings
 # Contexto de Passlib para bcrypt
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# Clave de firma construida una sola vez: jose acepta el objeto Key ya armado
+# y así no re-parsea SECRET_KEY ni re-instancia el firmador en cada token
+_JWT_SIGNING_KEY = jwk.construct(settings.SECRET_KEY, settings.ALGORITHM)
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
@@ -27,6 +32,14 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """
+    verify_password para endpoints async: bcrypt tarda decenas de ms de CPU,
+    así que corre en el threadpool en lugar de frenar el event loop
+    """
+    return await asyncio.to_thread(pwd_context.verify, plain_password, hashed_password)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """
     Crea un token JWT con payload personalizado
@@ -41,11 +54,11 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     to_encode = data.copy()
     
     if expires_delta:
-        expire = datetime.utcnow() + expires_delta
+        expire = datetime.now(timezone.utc) + expires_delta
     else:
-        expire = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+        expire = datetime.now(timezone.utc) + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
+    encoded_jwt = jwt.encode(to_encode, _JWT_SIGNING_KEY, algorithm=settings.ALGORITHM)
     
     return encoded_jwt
@@ -2,16 +2,21 @@
 Aplicación Principal - Nexus POS
 FastAPI App con configuración Multi-Tenant
 """
+import asyncio
+import contextlib
 import logging
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.exceptions import RequestValidationError, HTTPException
 from sqlalchemy.exc import SQLAlchemyError
 from contextlib import asynccontextmanager
 from app.core.config import settings
-from app.core.db import init_db
-from app.core.logging_config import setup_logging
+from app.core.db import engine, init_db
+from app.core.cache import close_cache
+from app.core.logging_config import setup_logging, shutdown_logging
 from app.core.middleware import RequestIDMiddleware, RequestLoggingMiddleware
+from app.services.reportes_service import reportes_service
 from app.core.exceptions import (
     NexusPOSException,
     nexus_exception_handler,
@@ -45,12 +50,25 @@ async def lifespan(app: FastAPI):
     # Startup: Crear tablas en desarrollo
     # En producción usar Alembic para migraciones
     await init_db()
+    async with engine.begin() as conn:
+        await reportes_service.crear_vistas(conn)
     logger.info("Base de datos inicializada correctamente")
     
+    # Refresco periódico de las vistas materializadas de /reportes
+    refresco_reportes = None
+    if settings.REPORTES_REFRESH_SECONDS > 0:
+        refresco_reportes = asyncio.create_task(reportes_service.refrescar_periodicamente())
+    
     yield
     
     # Shutdown: Limpiar recursos si es necesario
     logger.info("Cerrando aplicación...")
+    if refresco_reportes is not None:
+        refresco_reportes.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await refresco_reportes
+    await close_cache()
+    shutdown_logging()
 
 
 # Instancia de FastAPI
@@ -60,6 +78,7 @@ app = FastAPI(
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
     docs_url=f"{settings.API_V1_STR}/docs",
     redoc_url=f"{settings.API_V1_STR}/redoc",
+    default_response_class=ORJSONResponse,  # Serialización JSON con orjson
     lifespan=lifespan
 )
 
@@ -73,8 +92,9 @@ app.add_middleware(
 )
 
 # Middleware de Request ID y Logging
-app.add_middleware(RequestIDMiddleware)
+# (el último agregado queda por fuera: RequestID debe envolver al de logging)
 app.add_middleware(RequestLoggingMiddleware, log_body=False)
+app.add_middleware(RequestIDMiddleware)
 
 # Registrar handlers de excepciones
 app.add_exception_handler(NexusPOSException, nexus_exception_handler)
@@ -2,14 +2,19 @@
 Modelos de Base de Datos - Nexus POS
 SQLModel con soporte Multi-Tenant
 """
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Optional, List, Dict, Any
 from uuid import UUID, uuid4
 from sqlmodel import SQLModel, Field, Relationship
-from sqlalchemy import Column, DateTime, func
+from sqlalchemy import Column, DateTime, Index, UniqueConstraint, func, text
 from sqlalchemy.dialects.postgresql import JSONB
 
 
+def _utcnow() -> datetime:
+    """Fecha/hora actual en UTC con zona horaria (datetime.utcnow está deprecado)"""
+    return datetime.now(timezone.utc)
+
+
 class Tienda(SQLModel, table=True):
     """
     Modelo de Tienda - Entidad principal Multi-Tenant
@@ -40,7 +45,7 @@ class Tienda(SQLModel, table=True):
         index=True
     )
     created_at: datetime = Field(
-        default_factory=datetime.utcnow,
+        default_factory=_utcnow,
         sa_column=Column(DateTime(timezone=True), nullable=False, server_default=func.now())
     )
     
@@ -89,7 +94,7 @@ class User(SQLModel, table=True):
         index=True
     )
     created_at: datetime = Field(
-        default_factory=datetime.utcnow,
+        default_factory=_utcnow,
         sa_column=Column(DateTime(timezone=True), nullable=False, server_default=func.now())
     )
     
@@ -105,12 +110,62 @@ class User(SQLModel, table=True):
     tienda: Optional[Tienda] = Relationship(back_populates="users")
 
 
+# Vector de búsqueda de productos. El índice ix_productos_busqueda_fts y las
+# consultas deben usar exactamente esta expresión para que el planner lo aproveche
+PRODUCTO_SEARCH_VECTOR_SQL = (
+    "to_tsvector('spanish'::regconfig, "
+    "coalesce(nombre, '') || ' ' || coalesce(sku, '') || ' ' || coalesce(descripcion, ''))"
+)
+
+
 class Producto(SQLModel, table=True):
     """
     Modelo de Producto - Polimórfico con JSONB
     Soporta diferentes tipos de productos con atributos personalizados
     """
     __tablename__ = "productos"
+    __table_args__ = (
+        # SKU único dentro de cada tienda
+        UniqueConstraint("tienda_id", "sku", name="uq_producto_tienda_sku"),
+        # Stock bajo/crítico y valorización del inventario (solo productos activos)
+        Index(
+            "ix_productos_tienda_stock_valores_activos",
+            "tienda_id", "stock_actual",
+            postgresql_include=["precio_costo", "precio_venta"],
+            postgresql_where=text("is_active")
+        ),
+        # Listado de productos agotados
+        Index(
+            "ix_productos_tienda_sin_stock_activos",
+            "tienda_id", "nombre",
+            postgresql_where=text("is_active AND stock_actual = 0")
+        ),
+        # Listado de productos: ILIKE '%q%' sobre nombre/sku (pg_trgm)
+        Index(
+            "ix_productos_nombre_trgm",
+            "nombre",
+            postgresql_using="gin",
+            postgresql_ops={"nombre": "gin_trgm_ops"}
+        ),
+        Index(
+            "ix_productos_sku_trgm",
+            "sku",
+            postgresql_using="gin",
+            postgresql_ops={"sku": "gin_trgm_ops"}
+        ),
+        # Búsqueda avanzada: texto completo en español sobre nombre/sku/descripcion
+        Index(
+            "ix_productos_busqueda_fts",
+            text(PRODUCTO_SEARCH_VECTOR_SQL),
+            postgresql_using="gin"
+        ),
+        # Filtros de rango de la búsqueda avanzada (precio/stock, solo activos)
+        Index(
+            "ix_productos_tienda_precio_stock_activos",
+            "tienda_id", "precio_venta", "stock_actual",
+            postgresql_where=text("is_active")
+        ),
+    )
     
     id: UUID = Field(
         default_factory=uuid4,
@@ -162,11 +217,11 @@ class Producto(SQLModel, table=True):
         index=True
     )
     created_at: datetime = Field(
-        default_factory=datetime.utcnow,
+        default_factory=_utcnow,
         sa_column=Column(DateTime(timezone=True), nullable=False, server_default=func.now())
     )
     updated_at: datetime = Field(
-        default_factory=datetime.utcnow,
+        default_factory=_utcnow,
         sa_column=Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
     )
     
@@ -189,6 +244,14 @@ class Venta(SQLModel, table=True):
     Cabecera de la venta con totales y método de pago
     """
     __tablename__ = "ventas"
+    __table_args__ = (
+        # Agregados de ventas pagadas por tienda y rango de fechas (index-only scan)
+        Index(
+            "ix_ventas_tienda_status_fecha",
+            "tienda_id", "status_pago", "fecha",
+            postgresql_include=["total"]
+        ),
+    )
     
     id: UUID = Field(
         default_factory=uuid4,
@@ -197,7 +260,7 @@ class Venta(SQLModel, table=True):
         nullable=False
     )
     fecha: datetime = Field(
-        default_factory=datetime.utcnow,
+        default_factory=_utcnow,
         sa_column=Column(DateTime(timezone=True), nullable=False, index=True, server_default=func.now())
     )
     total: float = Field(
@@ -210,7 +273,7 @@ class Venta(SQLModel, table=True):
         description="Método de pago: efectivo, tarjeta_debito, tarjeta_credito, transferencia"
     )
     created_at: datetime = Field(
-        default_factory=datetime.utcnow,
+        default_factory=_utcnow,
         sa_column=Column(DateTime(timezone=True), nullable=False, server_default=func.now())
     )
     
@@ -260,6 +323,15 @@ class DetalleVenta(SQLModel, table=True):
     Snapshot de precios al momento de la transacción
     """
     __tablename__ = "detalles_venta"
+    __table_args__ = (
+        # Detalles de una venta (reportes, checkout, detalle de venta): índice
+        # cubriente, el join con ventas no necesita leer la tabla
+        Index(
+            "ix_detalles_venta_venta_cubriente",
+            "venta_id",
+            postgresql_include=["producto_id", "cantidad", "subtotal"]
+        ),
+    )
     
     id: UUID = Field(
         default_factory=uuid4,
@@ -283,8 +355,7 @@ class DetalleVenta(SQLModel, table=True):
     # Foreign Keys
     venta_id: UUID = Field(
         foreign_key="ventas.id",
-        nullable=False,
-        index=True
+        nullable=False
     )
     producto_id: UUID = Field(
         foreign_key="productos.id",
@@ -338,7 +409,7 @@ class Insight(SQLModel, table=True):
         description="Datos adicionales específicos del insight (producto_id, monto, etc.)"
     )
     created_at: datetime = Field(
-        default_factory=datetime.utcnow,
+        default_factory=_utcnow,
         sa_column=Column(DateTime(timezone=True), nullable=False, index=True, server_default=func.now())
     )
     
@@ -352,3 +423,13 @@ class Insight(SQLModel, table=True):
     
     # Relaciones
     tienda: Optional[Tienda] = Relationship(back_populates="insights")
+
+
+# Listado de insights por tienda ordenado por urgencia y fecha (más recientes primero)
+Index(
+    "ix_insights_tienda_activo_urgencia_fecha",
+    Insight.tienda_id,
+    Insight.is_active,
+    Insight.nivel_urgencia,
+    Insight.created_at.desc()
+)
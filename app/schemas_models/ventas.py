@@ -48,6 +48,19 @@ class VentaCreate(BaseModel):
         return v
 
 
+class ScanBatchInput(BaseModel):
+    """
+    Schema para escanear varios códigos en una sola request
+    Usado al precargar un carrito completo
+    """
+    codigos: List[str] = Field(
+        ...,
+        min_length=1,
+        max_length=200,
+        description="SKUs escaneados, en el orden del carrito"
+    )
+
+
 # ==================== VENTA OUTPUT SCHEMAS ====================
 
 class DetalleVentaRead(BaseModel):
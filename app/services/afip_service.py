@@ -5,7 +5,7 @@ Integración con AFIP para emisión de facturas electrónicas (Mock/Base)
 import logging
 from typing import Dict, Any, Optional
 from uuid import UUID
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from app.core.config import settings
 
 
@@ -158,7 +158,7 @@ class AfipService:
         
         # MOCK: Generar CAE simulado
         cae_mock = f"{venta_id.int % 100000000:014d}"  # 14 dígitos
-        vto_mock = (datetime.utcnow() + timedelta(days=10)).strftime("%Y-%m-%d")
+        vto_mock = (datetime.now(timezone.utc) + timedelta(days=10)).strftime("%Y-%m-%d")
         
         logger.info(f"[MOCK] CAE generado: {cae_mock}")
         logger.info(f"[MOCK] Vencimiento: {vto_mock}")
@@ -167,7 +167,7 @@ class AfipService:
             "cae": cae_mock,
             "vto": vto_mock,
             "numero_comprobante": "00001-00000123",  # Mock
-            "fecha_emision": datetime.utcnow().strftime("%Y-%m-%d"),
+            "fecha_emision": datetime.now(timezone.utc).strftime("%Y-%m-%d"),
             "tipo_comprobante": tipo_comprobante,
             "mock": True,  # Indicador de que es simulación
             "mensaje": "Factura emitida en modo MOCK. Configure AFIP para producción."
@@ -3,9 +3,9 @@ Servicio de Insights - Nexus POS
 Motor de análisis y generación de alertas inteligentes
 """
 import logging
-from typing import List, Optional
+from typing import List, Optional, Set
 from uuid import UUID
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func, and_
 from sqlmodel import col
@@ -26,6 +26,9 @@ class InsightService:
     - VENTAS_SEMANALES: Resumen semanal
     """
     
+    # Tipos de insight conocidos (los filtros con otro valor no pueden devolver nada)
+    TIPOS = frozenset({"STOCK_BAJO", "VENTAS_DIARIAS", "PRODUCTO_SIN_STOCK", "VENTAS_SEMANALES"})
+    
     # Configuración de umbrales
     STOCK_UMBRAL_BAJO = 10
     STOCK_UMBRAL_CRITICO = 3
@@ -70,16 +73,17 @@ class InsightService:
         
         logger.info(f"Encontrados {len(productos_bajo_stock)} productos con stock bajo")
         
+        # Productos que ya tienen una alerta activa (una sola consulta para todos)
+        productos_con_alerta = await self._get_productos_con_insight(
+            session=session,
+            tienda_id=tienda_id,
+            tipo="STOCK_BAJO",
+            producto_ids=[producto.id for producto in productos_bajo_stock]
+        )
+        
         for producto in productos_bajo_stock:
             # Verificar si ya existe una alerta activa para este producto
-            existing_alert = await self._check_existing_insight(
-                session=session,
-                tienda_id=tienda_id,
-                tipo="STOCK_BAJO",
-                producto_id=producto.id
-            )
-            
-            if existing_alert:
+            if str(producto.id) in productos_con_alerta:
                 logger.debug(f"Alerta de stock ya existe para producto {producto.nombre}")
                 continue
             
@@ -144,7 +148,7 @@ class InsightService:
         logger.info(f"Generando resumen de ventas de últimas {horas}h para tienda {tienda_id}")
         
         # Calcular fecha límite
-        fecha_desde = datetime.utcnow() - timedelta(hours=horas)
+        fecha_desde = datetime.now(timezone.utc) - timedelta(hours=horas)
         
         # Consulta agregada: total vendido y cantidad de ventas
         statement = select(
@@ -257,16 +261,16 @@ class InsightService:
         
         logger.info(f"Encontrados {len(productos_sin_stock)} productos sin stock")
         
+        productos_con_alerta = await self._get_productos_con_insight(
+            session=session,
+            tienda_id=tienda_id,
+            tipo="PRODUCTO_SIN_STOCK",
+            producto_ids=[producto.id for producto in productos_sin_stock]
+        )
+        
         for producto in productos_sin_stock:
             # Verificar alerta existente
-            existing_alert = await self._check_existing_insight(
-                session=session,
-                tienda_id=tienda_id,
-                tipo="PRODUCTO_SIN_STOCK",
-                producto_id=producto.id
-            )
-            
-            if existing_alert:
+            if str(producto.id) in productos_con_alerta:
                 continue
             
             mensaje = (
@@ -348,7 +352,7 @@ class InsightService:
         Returns:
             Insight existente o None
         """
-        fecha_limite = datetime.utcnow() - timedelta(hours=hours_back)
+        fecha_limite = datetime.now(timezone.utc) - timedelta(hours=hours_back)
         
         statement = select(Insight).where(
             and_(
@@ -369,6 +373,49 @@ class InsightService:
         result = await session.execute(statement)
         return result.scalar_one_or_none()
 
+    
+    async def _get_productos_con_insight(
+        self,
+        session: AsyncSession,
+        tienda_id: UUID,
+        tipo: str,
+        producto_ids: List[UUID],
+        hours_back: int = 24
+    ) -> Set[str]:
+        """
+        Obtiene en una sola consulta los productos que ya tienen un insight activo
+        
+        Reemplaza llamar a _check_existing_insight por cada producto (N consultas)
+        
+        Args:
+            session: Sesión de base de datos
+            tienda_id: ID de la tienda
+            tipo: Tipo de insight
+            producto_ids: IDs de los productos a verificar
+            hours_back: Ventana de tiempo para considerar (horas)
+        
+        Returns:
+            Conjunto de producto_id (como string, igual que en extra_data)
+        """
+        if not producto_ids:
+            return set()
+        
+        fecha_limite = datetime.now(timezone.utc) - timedelta(hours=hours_back)
+        producto_id_json = col(Insight.extra_data)["producto_id"].astext
+        
+        statement = select(producto_id_json).where(
+            and_(
+                Insight.tienda_id == tienda_id,
+                Insight.tipo == tipo,
+                Insight.is_active == True,
+                Insight.created_at >= fecha_limite,
+                producto_id_json.in_([str(producto_id) for producto_id in producto_ids])
+            )
+        )
+        
+        result = await session.execute(statement)
+        return set(result.scalars().all())
+
 
 # Instancia singleton del servicio
 insight_service = InsightService()
@@ -2,7 +2,11 @@
 Servicio de Pagos - Nexus POS
 Integración con Mercado Pago para procesamiento de pagos
 """
+import hashlib
+import hmac
 import logging
+import time
+from collections import OrderedDict
 from typing import Dict, Any, Optional
 from uuid import UUID
 import mercadopago
@@ -18,8 +22,15 @@ class PaymentService:
     Gestiona creación de preferencias, QR y links de pago
     """
     
+    # Ventana de validez del timestamp firmado de los webhooks
+    WEBHOOK_TOLERANCIA_SEGUNDOS = 300
+    # Máximo de X-Request-Id recordados para detectar reenvíos
+    WEBHOOK_REPLAY_MAX_IDS = 10_000
+    
     def __init__(self):
         """Inicializa el SDK de Mercado Pago"""
+        self._request_ids_vistos: "OrderedDict[str, float]" = OrderedDict()
+        
         if not settings.MERCADOPAGO_ACCESS_TOKEN:
             logger.warning("MERCADOPAGO_ACCESS_TOKEN no configurado. Los pagos no funcionarán.")
             self.sdk = None
@@ -121,27 +132,101 @@ class PaymentService:
             logger.error(f"Error al obtener información de pago {payment_id}: {str(e)}")
             raise
     
-    def validate_webhook_signature(self, request_data: Dict[str, Any], x_signature: str) -> bool:
+    def validate_webhook_signature(
+        self,
+        data_id: Optional[str],
+        x_request_id: Optional[str],
+        x_signature: Optional[str]
+    ) -> bool:
         """
-        Valida la firma del webhook de Mercado Pago (opcional pero recomendado)
+        Valida la firma del webhook de Mercado Pago
+        
+        El header X-Signature tiene el formato `ts=<timestamp>,v1=<hmac>`, donde
+        v1 es HMAC-SHA256 (con MERCADOPAGO_WEBHOOK_SECRET) del manifiesto
+        `id:<data.id>;request-id:<x-request-id>;ts:<ts>;`
+        
+        Además de la firma se exige que `ts` esté dentro de la ventana de
+        tolerancia, para que un webhook capturado no pueda reenviarse más tarde.
         
         Args:
-            request_data: Datos del request del webhook
+            data_id: data.id de la notificación
+            x_request_id: Header X-Request-Id enviado por MercadoPago
             x_signature: Header X-Signature enviado por MercadoPago
         
         Returns:
-            True si la firma es válida
+            True si la firma es válida y reciente
         
-        TODO: Implementar validación real de firma con MERCADOPAGO_WEBHOOK_SECRET
+        Documentación:
+        https://www.mercadopago.com.ar/developers/es/docs/your-integrations/notifications/webhooks
         """
         if not settings.MERCADOPAGO_WEBHOOK_SECRET:
             logger.warning("MERCADOPAGO_WEBHOOK_SECRET no configurado. Saltando validación de firma.")
             return True
         
-        # TODO: Implementar validación de firma según documentación de MercadoPago
-        # https://www.mercadopago.com.ar/developers/es/docs/your-integrations/notifications/webhooks
+        if not x_signature or not x_request_id:
+            logger.warning("Webhook sin X-Signature o X-Request-Id")
+            return False
+        
+        partes = dict(
+            parte.strip().split("=", 1)
+            for parte in x_signature.split(",")
+            if "=" in parte
+        )
+        ts = partes.get("ts")
+        firma = partes.get("v1")
+        
+        if not ts or not firma:
+            logger.warning("X-Signature sin ts o v1")
+            return False
+        
+        # MercadoPago envía ts en milisegundos; se aceptan también segundos
+        try:
+            ts_segundos = int(ts)
+        except ValueError:
+            logger.warning(f"Timestamp de firma inválido: {ts}")
+            return False
+        if ts_segundos > 10**11:
+            ts_segundos //= 1000
+        
+        if abs(time.time() - ts_segundos) > self.WEBHOOK_TOLERANCIA_SEGUNDOS:
+            logger.warning(f"Webhook fuera de la ventana de tolerancia (ts={ts})")
+            return False
+        
+        # Los ids alfanuméricos se firman en minúsculas
+        manifest = f"id:{str(data_id).lower() if data_id else ''};request-id:{x_request_id};ts:{ts};"
+        esperada = hmac.new(
+            settings.MERCADOPAGO_WEBHOOK_SECRET.encode(),
+            manifest.encode(),
+            hashlib.sha256
+        ).hexdigest()
+        
+        return hmac.compare_digest(esperada, firma)
+    
+    def is_replay(self, x_request_id: str) -> bool:
+        """
+        Indica si el X-Request-Id ya fue procesado dentro de la ventana de tolerancia
+        
+        Registra el id si es nuevo. Los ids se guardan en un LRU acotado: pasada
+        la ventana, un reenvío ya es rechazado por el timestamp de la firma.
+        """
+        ahora = time.monotonic()
+        vistos = self._request_ids_vistos
+        
+        # Descartar entradas vencidas (las más antiguas están al principio)
+        while vistos:
+            request_id, visto_en = next(iter(vistos.items()))
+            if ahora - visto_en <= self.WEBHOOK_TOLERANCIA_SEGUNDOS * 2:
+                break
+            vistos.popitem(last=False)
+        
+        if x_request_id in vistos:
+            return True
+        
+        vistos[x_request_id] = ahora
+        if len(vistos) > self.WEBHOOK_REPLAY_MAX_IDS:
+            vistos.popitem(last=False)
         
-        return True
+        return False
 
 
 # Instancia singleton del servicio
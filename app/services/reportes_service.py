@@ -0,0 +1,124 @@
+"""
+Servicio de Reportes - Nexus POS
+Vistas materializadas con los agregados diarios de ventas
+"""
+import asyncio
+import logging
+from sqlalchemy import Date, Float, Integer, String, column, table, text
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID
+from sqlalchemy.ext.asyncio import AsyncConnection
+from app.core.config import settings
+from app.core.db import engine
+
+
+logger = logging.getLogger(__name__)
+
+
+# Ventas pagadas por tienda, día y método de pago
+mv_ventas_diarias = table(
+    "mv_ventas_diarias",
+    column("tienda_id", PG_UUID(as_uuid=True)),
+    column("dia", Date),
+    column("metodo_pago", String),
+    column("cantidad_ventas", Integer),
+    column("monto_total", Float),
+)
+
+# Unidades vendidas por tienda, día y producto (solo ventas pagadas)
+mv_productos_vendidos_diarios = table(
+    "mv_productos_vendidos_diarios",
+    column("tienda_id", PG_UUID(as_uuid=True)),
+    column("dia", Date),
+    column("producto_id", PG_UUID(as_uuid=True)),
+    column("cantidad_vendida", Float),
+    column("subtotal_vendido", Float),
+    column("veces_vendido", Integer),
+)
+
+# Definiciones (se mantienen en sincronía con la migración que crea las vistas)
+VISTAS_MATERIALIZADAS = {
+    "mv_ventas_diarias": (
+        """
+        SELECT v.tienda_id,
+               date(v.fecha AT TIME ZONE 'UTC') AS dia,
+               v.metodo_pago,
+               count(*)::integer AS cantidad_ventas,
+               sum(v.total)::double precision AS monto_total
+        FROM ventas v
+        WHERE v.status_pago = 'pagado'
+        GROUP BY v.tienda_id, date(v.fecha AT TIME ZONE 'UTC'), v.metodo_pago
+        """,
+        ("tienda_id", "dia", "metodo_pago"),
+    ),
+    "mv_productos_vendidos_diarios": (
+        """
+        SELECT v.tienda_id,
+               date(v.fecha AT TIME ZONE 'UTC') AS dia,
+               d.producto_id,
+               sum(d.cantidad)::double precision AS cantidad_vendida,
+               sum(d.subtotal)::double precision AS subtotal_vendido,
+               count(*)::integer AS veces_vendido
+        FROM detalles_venta d
+        JOIN ventas v ON v.id = d.venta_id
+        WHERE v.status_pago = 'pagado'
+        GROUP BY v.tienda_id, date(v.fecha AT TIME ZONE 'UTC'), d.producto_id
+        """,
+        ("tienda_id", "dia", "producto_id"),
+    ),
+}
+
+
+class ReportesService:
+    """
+    Mantiene las vistas materializadas de reportes
+    
+    Los endpoints de /reportes leen estas vistas en lugar de agregar todo el
+    historial de ventas en cada request. Los datos tienen granularidad diaria
+    y hasta REPORTES_REFRESH_SECONDS de atraso.
+    """
+    
+    # Advisory lock compartido por todos los workers: solo uno refresca por vez
+    REFRESH_LOCK_ID = 7_402_113
+    
+    async def crear_vistas(self, conn: AsyncConnection) -> None:
+        """Crea las vistas si no existen (desarrollo; en producción las crea Alembic)"""
+        for nombre, (definicion, claves) in VISTAS_MATERIALIZADAS.items():
+            await conn.execute(text(f"CREATE MATERIALIZED VIEW IF NOT EXISTS {nombre} AS {definicion}"))
+            # El índice único es requisito de REFRESH ... CONCURRENTLY
+            await conn.execute(text(
+                f"CREATE UNIQUE INDEX IF NOT EXISTS uq_{nombre} ON {nombre} ({', '.join(claves)})"
+            ))
+    
+    async def refrescar_vistas(self) -> bool:
+        """
+        Refresca las vistas sin bloquear las lecturas
+        
+        Returns:
+            False si otro worker ya estaba refrescando
+        """
+        async with engine.begin() as conn:
+            adquirido = await conn.scalar(
+                text("SELECT pg_try_advisory_xact_lock(:lock_id)"),
+                {"lock_id": self.REFRESH_LOCK_ID}
+            )
+            if not adquirido:
+                return False
+            
+            for nombre in VISTAS_MATERIALIZADAS:
+                await conn.execute(text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {nombre}"))
+        
+        return True
+    
+    async def refrescar_periodicamente(self) -> None:
+        """Loop de refresco cada REPORTES_REFRESH_SECONDS (se cancela al apagar la app)"""
+        while True:
+            await asyncio.sleep(settings.REPORTES_REFRESH_SECONDS)
+            try:
+                if await self.refrescar_vistas():
+                    logger.info("Vistas materializadas de reportes refrescadas")
+            except Exception as e:
+                logger.error(f"Error refrescando vistas de reportes: {str(e)}", exc_info=True)
+
+
+# Instancia singleton del servicio
+reportes_service = ReportesService()
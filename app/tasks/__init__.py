@@ -0,0 +1 @@
+"""Tareas de Celery"""
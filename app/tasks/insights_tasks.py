@@ -0,0 +1,46 @@
+"""
+Tareas de Celery para generación de insights
+"""
+import asyncio
+import logging
+from uuid import UUID
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from sqlalchemy.pool import NullPool
+from app.celery_app import celery_app
+from app.core.cache import close_cache, invalidate_cache
+from app.core.config import settings
+from app.services.insight_service import insight_service
+
+
+logger = logging.getLogger(__name__)
+
+
+async def _generar_insights(tienda_id: UUID) -> dict:
+    """
+    Genera los insights de una tienda con un engine propio
+    
+    Cada tarea corre en un event loop nuevo (asyncio.run), por lo que no se
+    reutiliza el pool de la API: las conexiones quedarían atadas a otro loop.
+    """
+    engine = create_async_engine(settings.DATABASE_URL, poolclass=NullPool)
+    session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    try:
+        async with session_factory() as session:
+            resultado = await insight_service.generate_all_insights(
+                tienda_id=tienda_id,
+                session=session
+            )
+        await invalidate_cache(f"insights:{tienda_id}")
+        return resultado
+    finally:
+        await close_cache()
+        await engine.dispose()
+
+
+@celery_app.task(name="app.tasks.insights_tasks.generate_insights_task")
+def generate_insights_task(tienda_id: str) -> dict:
+    """Genera todos los insights de una tienda"""
+    logger.info(f"Generando insights en worker para tienda {tienda_id}")
+    resultado = asyncio.run(_generar_insights(UUID(tienda_id)))
+    logger.info(f"Insights generados en worker: {resultado}")
+    return {"tienda_id": tienda_id, "insights_generados": resultado}
@@ -0,0 +1,96 @@
+"""
+Tests de paginación por cursor (keyset) del listado de insights
+"""
+import base64
+from datetime import datetime, timedelta, timezone
+import pytest
+from httpx import AsyncClient
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models import Insight, Tienda
+
+
+URL = "/api/v1/insights/"
+
+
+async def _crear_insights(db: AsyncSession, tienda: Tienda) -> list[Insight]:
+    """Insights con empates de urgencia y de created_at para forzar el desempate por id"""
+    fecha = datetime(2026, 10, 15, 12, 0, tzinfo=timezone.utc)
+    niveles = (
+        ["CRITICA"] * 2   # mismo rank y misma fecha
+        + ["ALTA"] * 5    # mismo rank y misma fecha
+        + ["MEDIA"] * 3   # mismo rank, fechas distintas
+        + ["BAJA"]
+    )
+    insights = [
+        Insight(
+            tipo="STOCK_BAJO",
+            mensaje=f"Insight {i}",
+            nivel_urgencia=nivel,
+            tienda_id=tienda.id,
+            created_at=fecha - timedelta(minutes=i) if nivel == "MEDIA" else fecha
+        )
+        for i, nivel in enumerate(niveles)
+    ]
+    db.add_all(insights)
+    await db.commit()
+    return insights
+
+
+async def _paginar(client: AsyncClient, limit: int) -> list[list[dict]]:
+    """Recorre todas las páginas siguiendo el header X-Next-Cursor"""
+    paginas = []
+    params = {"limit": limit}
+    while True:
+        response = await client.get(URL, params=params)
+        assert response.status_code == 200
+        paginas.append(response.json())
+        
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return paginas
+        params = {"limit": limit, "cursor": cursor}
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 5, 11])
+async def test_paginacion_sin_duplicados_ni_huecos(
+    authenticated_client: AsyncClient,
+    db: AsyncSession,
+    tienda: Tienda,
+    limit: int
+):
+    insights = await _crear_insights(db, tienda)
+    
+    paginas = await _paginar(authenticated_client, limit)
+    ids = [item["id"] for pagina in paginas for item in pagina]
+    
+    assert all(len(pagina) <= limit for pagina in paginas)
+    assert len(ids) == len(set(ids))
+    assert set(ids) == {str(insight.id) for insight in insights}
+
+
+async def test_paginacion_respeta_el_orden_completo(
+    authenticated_client: AsyncClient,
+    db: AsyncSession,
+    tienda: Tienda
+):
+    await _crear_insights(db, tienda)
+    
+    completa = (await authenticated_client.get(URL, params={"limit": 200})).json()
+    paginas = await _paginar(authenticated_client, 2)
+    
+    assert [item["id"] for pagina in paginas for item in pagina] == [item["id"] for item in completa]
+    
+    niveles = [item["nivel_urgencia"] for item in completa]
+    assert niveles == sorted(niveles, key=["CRITICA", "ALTA", "MEDIA", "BAJA"].index)
+
+
+@pytest.mark.parametrize("cursor", [
+    "no-es-un-cursor",
+    base64.urlsafe_b64encode(b"{}").decode(),
+    base64.urlsafe_b64encode(b'[1, "ayer", "no-uuid"]').decode(),
+    base64.urlsafe_b64encode(b"123").decode(),
+])
+async def test_cursor_malformado_devuelve_400(authenticated_client: AsyncClient, cursor: str):
+    response = await authenticated_client.get(URL, params={"cursor": cursor})
+    
+    assert response.status_code == 400
@@ -0,0 +1,122 @@
+"""
+Fixtures globales de tests - Nexus POS
+
+Los tests que usan la BD necesitan un PostgreSQL con la base de test
+(POSTGRES_DB=nexus_pos_test); las tablas se crean una vez por ejecución y se
+vacían después de cada test.
+"""
+import asyncio
+from typing import AsyncIterator
+import pytest
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlmodel import SQLModel
+from app.core.config import settings
+from app.core.db import get_session
+from app.core.security import create_access_token, get_password_hash
+from app.main import app
+from app.models import Tienda, User
+from app.services.reportes_service import VISTAS_MATERIALIZADAS
+
+
+def _crear_engine() -> AsyncEngine:
+    # NullPool: ninguna conexión sobrevive al event loop de un test
+    return create_async_engine(settings.DATABASE_URL, poolclass=NullPool)
+
+
+async def _borrar_esquema(conn) -> None:
+    # Las vistas de reportes (si la app corrió contra esta base) dependen de las tablas
+    await conn.execute(text(f"DROP MATERIALIZED VIEW IF EXISTS {', '.join(VISTAS_MATERIALIZADAS)}"))
+    await conn.run_sync(SQLModel.metadata.drop_all)
+
+
+async def _crear_tablas() -> None:
+    engine = _crear_engine()
+    async with engine.begin() as conn:
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        await _borrar_esquema(conn)
+        await conn.run_sync(SQLModel.metadata.create_all)
+    await engine.dispose()
+
+
+async def _borrar_tablas() -> None:
+    engine = _crear_engine()
+    async with engine.begin() as conn:
+        await _borrar_esquema(conn)
+    await engine.dispose()
+
+
+@pytest.fixture(scope="session")
+def _tablas():
+    """Crea el esquema una vez por ejecución de la suite"""
+    asyncio.run(_crear_tablas())
+    yield
+    asyncio.run(_borrar_tablas())
+
+
+@pytest.fixture
+async def db_engine(_tablas) -> AsyncIterator[AsyncEngine]:
+    """Engine de test; al terminar vacía todas las tablas"""
+    engine = _crear_engine()
+    yield engine
+    
+    tablas = ", ".join(table.name for table in SQLModel.metadata.sorted_tables)
+    async with engine.begin() as conn:
+        await conn.execute(text(f"TRUNCATE {tablas} CASCADE"))
+    await engine.dispose()
+
+
+@pytest.fixture
+async def db(db_engine: AsyncEngine) -> AsyncIterator[AsyncSession]:
+    """Sesión de base de datos para preparar datos de prueba"""
+    async with AsyncSession(db_engine, expire_on_commit=False) as session:
+        yield session
+
+
+@pytest.fixture
+async def client(db_engine: AsyncEngine) -> AsyncIterator[AsyncClient]:
+    """Cliente HTTP sin autenticación; la app usa sesiones del engine de test"""
+    session_factory = async_sessionmaker(db_engine, class_=AsyncSession, expire_on_commit=False)
+    
+    async def get_session_test() -> AsyncIterator[AsyncSession]:
+        async with session_factory() as session:
+            yield session
+    
+    app.dependency_overrides[get_session] = get_session_test
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as async_client:
+        yield async_client
+    app.dependency_overrides.pop(get_session, None)
+
+
+@pytest.fixture
+async def tienda(db: AsyncSession) -> Tienda:
+    """Tienda de prueba principal"""
+    tienda = Tienda(nombre="Tienda Test", rubro="ropa")
+    db.add(tienda)
+    await db.commit()
+    return tienda
+
+
+@pytest.fixture
+async def user(db: AsyncSession, tienda: Tienda) -> User:
+    """Usuario owner de la tienda principal"""
+    user = User(
+        email="owner@test.com",
+        hashed_password=get_password_hash("password123"),
+        full_name="Test Owner",
+        rol="owner",
+        tienda_id=tienda.id
+    )
+    db.add(user)
+    await db.commit()
+    return user
+
+
+@pytest.fixture
+async def authenticated_client(client: AsyncClient, user: User) -> AsyncClient:
+    """Cliente autenticado con el usuario owner de la tienda principal"""
+    token = create_access_token(data={"sub": str(user.id)})
+    client.headers["Authorization"] = f"Bearer {token}"
+    return client
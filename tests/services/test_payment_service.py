@@ -0,0 +1,138 @@
+"""
+Tests de validación de webhooks de MercadoPago (firma X-Signature y reenvíos)
+"""
+import hashlib
+import hmac
+import time
+import pytest
+from app.core.config import settings
+from app.services.payment_service import PaymentService
+
+
+SECRET = "webhook-secret-de-test"
+REQUEST_ID = "bb56a2f1-6aae-46ac-982e-9dcd3581d08e"
+DATA_ID = "123456789"
+
+
+@pytest.fixture
+def service(monkeypatch) -> PaymentService:
+    """PaymentService nuevo (LRU de request ids vacío) con secreto de webhook configurado"""
+    monkeypatch.setattr(settings, "MERCADOPAGO_WEBHOOK_SECRET", SECRET)
+    monkeypatch.setattr(settings, "MERCADOPAGO_ACCESS_TOKEN", None)
+    return PaymentService()
+
+
+def _firmar(data_id: str, request_id: str, ts: str) -> str:
+    manifest = f"id:{data_id};request-id:{request_id};ts:{ts};"
+    return hmac.new(SECRET.encode(), manifest.encode(), hashlib.sha256).hexdigest()
+
+
+def _x_signature(data_id: str = DATA_ID, request_id: str = REQUEST_ID, ts: str = None) -> str:
+    ts = ts or str(int(time.time() * 1000))
+    return f"ts={ts},v1={_firmar(data_id, request_id, ts)}"
+
+
+def test_firma_valida(service: PaymentService):
+    assert service.validate_webhook_signature(DATA_ID, REQUEST_ID, _x_signature())
+
+
+def test_firma_v1_incorrecta(service: PaymentService):
+    ts = str(int(time.time() * 1000))
+    x_signature = f"ts={ts},v1={'0' * 64}"
+    
+    assert not service.validate_webhook_signature(DATA_ID, REQUEST_ID, x_signature)
+
+
+def test_firma_de_otro_request_id(service: PaymentService):
+    x_signature = _x_signature(request_id="otro-request-id")
+    
+    assert not service.validate_webhook_signature(DATA_ID, REQUEST_ID, x_signature)
+
+
+@pytest.mark.parametrize("x_signature", [
+    "v1=" + "a" * 64,
+    f"ts={int(time.time())}",
+    "",
+    "basura",
+])
+def test_firma_sin_ts_o_v1(service: PaymentService, x_signature: str):
+    assert not service.validate_webhook_signature(DATA_ID, REQUEST_ID, x_signature)
+
+
+def test_sin_request_id(service: PaymentService):
+    assert not service.validate_webhook_signature(DATA_ID, None, _x_signature())
+
+
+def test_ts_no_numerico(service: PaymentService):
+    x_signature = f"ts=abc,v1={_firmar(DATA_ID, REQUEST_ID, 'abc')}"
+    
+    assert not service.validate_webhook_signature(DATA_ID, REQUEST_ID, x_signature)
+
+
+@pytest.mark.parametrize("desfase", [
+    PaymentService.WEBHOOK_TOLERANCIA_SEGUNDOS + 5,
+    -(PaymentService.WEBHOOK_TOLERANCIA_SEGUNDOS + 5),
+])
+def test_ts_fuera_de_ventana(service: PaymentService, desfase: int):
+    ts = str(int((time.time() - desfase) * 1000))
+    
+    assert not service.validate_webhook_signature(DATA_ID, REQUEST_ID, _x_signature(ts=ts))
+
+
+def test_ts_en_milisegundos(service: PaymentService):
+    ts = str(int(time.time() * 1000))
+    
+    assert service.validate_webhook_signature(DATA_ID, REQUEST_ID, _x_signature(ts=ts))
+
+
+def test_ts_en_segundos(service: PaymentService):
+    ts = str(int(time.time()))
+    
+    assert service.validate_webhook_signature(DATA_ID, REQUEST_ID, _x_signature(ts=ts))
+
+
+def test_ts_en_segundos_vencido(service: PaymentService):
+    ts = str(int(time.time()) - PaymentService.WEBHOOK_TOLERANCIA_SEGUNDOS - 5)
+    
+    assert not service.validate_webhook_signature(DATA_ID, REQUEST_ID, _x_signature(ts=ts))
+
+
+def test_data_id_alfanumerico_en_mayusculas(service: PaymentService):
+    # MercadoPago firma los ids alfanuméricos en minúsculas
+    x_signature = _x_signature(data_id="abc123def")
+    
+    assert service.validate_webhook_signature("ABC123DEF", REQUEST_ID, x_signature)
+
+
+def test_sin_secreto_no_valida_firma(service: PaymentService, monkeypatch):
+    monkeypatch.setattr(settings, "MERCADOPAGO_WEBHOOK_SECRET", None)
+    
+    assert service.validate_webhook_signature(DATA_ID, None, None)
+
+
+def test_request_id_repetido_es_replay(service: PaymentService):
+    assert not service.is_replay(REQUEST_ID)
+    assert service.is_replay(REQUEST_ID)
+    assert not service.is_replay("otro-request-id")
+
+
+def test_request_id_vencido_se_olvida(service: PaymentService, monkeypatch):
+    ahora = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: ahora)
+    assert not service.is_replay(REQUEST_ID)
+    
+    # Pasada la ventana el reenvío ya lo rechaza el timestamp de la firma
+    despues = ahora + PaymentService.WEBHOOK_TOLERANCIA_SEGUNDOS * 2 + 1
+    monkeypatch.setattr(time, "monotonic", lambda: despues)
+    assert not service.is_replay(REQUEST_ID)
+
+
+def test_lru_de_request_ids_acotado(service: PaymentService, monkeypatch):
+    monkeypatch.setattr(service, "WEBHOOK_REPLAY_MAX_IDS", 2)
+    
+    for request_id in ("a", "b", "c"):
+        assert not service.is_replay(request_id)
+    
+    # "a" fue desalojado por ser el más antiguo
+    assert not service.is_replay("a")
+    assert service.is_replay("c")
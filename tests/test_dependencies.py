@@ -0,0 +1,54 @@
+"""
+Regresión: las dependencias de las rutas deben ser async
+
+FastAPI despacha las dependencias `def` al threadpool, lo que agrega latencia
+a cada request (ver app.core.db.get_session). Este test recorre el árbol de
+dependencias de todas las rutas y falla si aparece alguna síncrona.
+"""
+import inspect
+from typing import Callable, Iterator
+from fastapi.dependencies.models import Dependant
+from fastapi.routing import APIRoute
+from fastapi.security import OAuth2PasswordRequestForm
+from app.core.db import get_session
+from app.main import app
+
+
+# Clases de FastAPI que solo parsean el form de login, sin I/O
+DEPENDENCIAS_SINCRONAS_PERMITIDAS = {OAuth2PasswordRequestForm}
+
+
+def _es_async(call: Callable) -> bool:
+    """Función async / async generator, o instancia con __call__ async (OAuth2PasswordBearer)"""
+    if inspect.iscoroutinefunction(call) or inspect.isasyncgenfunction(call):
+        return True
+    if inspect.isclass(call):
+        return False
+    dunder_call = getattr(call, "__call__", None)
+    return inspect.iscoroutinefunction(dunder_call) or inspect.isasyncgenfunction(dunder_call)
+
+
+def _dependencias(dependant: Dependant) -> Iterator[Dependant]:
+    """Recorre en profundidad todas las sub-dependencias"""
+    for sub_dependant in dependant.dependencies:
+        yield sub_dependant
+        yield from _dependencias(sub_dependant)
+
+
+def test_get_session_es_async_generator():
+    assert inspect.isasyncgenfunction(get_session)
+
+
+def test_dependencias_de_rutas_son_async():
+    rutas = [route for route in app.routes if isinstance(route, APIRoute)]
+    assert rutas
+    
+    sincronas = [
+        f"{', '.join(sorted(route.methods))} {route.path}: {dependencia.call!r}"
+        for route in rutas
+        for dependencia in _dependencias(route.dependant)
+        if dependencia.call not in DEPENDENCIAS_SINCRONAS_PERMITIDAS
+        and not _es_async(dependencia.call)
+    ]
+    
+    assert not sincronas, "Dependencias síncronas (corren en el threadpool):\n" + "\n".join(sincronas)